@@ -1,6 +1,7 @@
 import json
 
-from ollama import Options
+import httpx
+from ollama import Options, ResponseError
 from rich.text import Text
 from textual.app import ComposeResult
 from textual.containers import Container, Horizontal, Vertical
@@ -8,9 +9,11 @@ from textual.css.query import NoMatches
 from textual.reactive import reactive
 from textual.screen import ModalScreen
 from textual.widgets import Button, Checkbox, Input, Label, OptionList
+from textual.widgets.option_list import Option
 
 from oterm.app.widgets.text_area import TextArea
-from oterm.ollamaclient import OllamaLLM, parse_ollama_parameters
+from oterm.model_catalog import modelCatalog
+from oterm.ollamaclient import OllamaError, parse_ollama_parameters
 
 
 class ChatEdit(ModalScreen[str]):
@@ -26,6 +29,7 @@ class ChatEdit(ModalScreen[str]):
     json_format: reactive[bool] = reactive(False)
     edit_mode: reactive[bool] = reactive(False)
     last_highlighted_index = None
+    selected_model: str | None = None
     keep_alive: reactive[int] = reactive(5)
 
     BINDINGS = [
@@ -71,26 +75,45 @@ class ChatEdit(ModalScreen[str]):
         self._return_chat_meta()
 
     def select_model(self, model: str) -> None:
+        # The model is highlighted once its details are loaded.
+        self.selected_model = model
         select = self.query_one("#model-select", OptionList)
         for index, option in enumerate(select._options):
-            if str(option.prompt) == model:
+            if str(option.prompt) == model and not option.disabled:
                 select.highlighted = index
                 break
 
-    async def on_mount(self) -> None:
-        self.models = OllamaLLM.list()["models"]
-        models = [model["name"] for model in self.models]
-        for model in models:
-            info = dict(OllamaLLM.show(model))
-            for key in ["modelfile", "license"]:
-                if key in info.keys():
-                    del info[key]
-            self.models_info[model] = info
+    def on_mount(self) -> None:
+        self.run_worker(self.load_models())
+
+    async def load_models(self) -> None:
+        # The dialog stays usable, e.g. to cancel, when Ollama cannot be reached.
+        try:
+            await self.list_models()
+        except (OllamaError, ResponseError, httpx.HTTPError) as e:
+            self.app.notify(
+                f"Unable to load the models: {e}", title="Ollama", severity="error"
+            )
+
+    async def list_models(self) -> None:
+        # Every model is listed right away and becomes selectable as soon as
+        # its details arrive from the catalog.
+        self.models = await modelCatalog.list()
         option_list = self.query_one("#model-select", OptionList)
         option_list.clear_options()
-        for model in models:
-            option_list.add_option(item=self.model_option(model))
-        option_list.highlighted = self.last_highlighted_index
+        option_list.add_options(
+            Option(self.model_option(model["name"]), id=model["name"], disabled=True)
+            for model in self.models
+        )
+        async for model, info in modelCatalog.infos(self.models):
+            self.models_info[model["name"]] = info
+            index = option_list.get_option_index(model["name"])
+            option_list.enable_option_at_index(index)
+            if self.selected_model is not None:
+                if model["name"] == self.selected_model:
+                    option_list.highlighted = index
+            elif index == self.last_highlighted_index:
+                option_list.highlighted = index
 
     def on_option_list_option_selected(self, option: OptionList.OptionSelected) -> None:
         self._return_chat_meta()
@@ -0,0 +1,76 @@
+import asyncio
+import re
+
+from rich.text import Text
+from textual import on, work
+from textual.app import ComposeResult
+from textual.containers import Container
+from textual.screen import ModalScreen
+from textual.widgets import Input, Label, OptionList
+from textual.widgets.option_list import Option
+
+from oterm.store.store import MATCH_END, MATCH_START
+
+# Seconds to wait for more keystrokes before searching.
+SEARCH_DEBOUNCE = 0.2
+
+
+def highlight(snippet: str) -> Text:
+    text = Text()
+    matches = re.compile(f"({re.escape(MATCH_START)}.*?{re.escape(MATCH_END)})")
+    for part in matches.split(" ".join(snippet.split())):
+        if part.startswith(MATCH_START):
+            text.append(part[1:-1], style="bold reverse")
+        else:
+            text.append(part)
+    return text
+
+
+class ChatSearch(ModalScreen[tuple[int, int]]):
+    """Search the messages of all chats, returning `(chat id, message id)`."""
+
+    chat_names: dict[int, str] = {}
+    BINDINGS = [
+        ("escape", "cancel", "Cancel"),
+    ]
+
+    def action_cancel(self) -> None:
+        self.dismiss()
+
+    async def on_mount(self) -> None:
+        chats = await self.app.store.get_chats()  # type: ignore
+        self.chat_names = {id: name for id, name, *_ in chats}
+
+    @on(Input.Changed)
+    def on_query_changed(self, event: Input.Changed) -> None:
+        self.search(event.value)
+
+    @work(exclusive=True)
+    async def search(self, query: str) -> None:
+        # Cancelled, along with the running query, by the next keystroke.
+        await asyncio.sleep(SEARCH_DEBOUNCE)
+        results = await self.app.store.search(query)  # type: ignore
+        option_list = self.query_one("#chat-search-results", OptionList)
+        option_list.clear_options()
+        for message_id, chat_id, _, snippet in results:
+            prompt = Text(f"{self.chat_names.get(chat_id, '')}: ", style="bold")
+            prompt.append(highlight(snippet))
+            option_list.add_option(Option(prompt, id=f"{chat_id}-{message_id}"))
+        if results:
+            option_list.highlighted = 0
+
+    @on(Input.Submitted)
+    def on_submit(self) -> None:
+        option_list = self.query_one("#chat-search-results", OptionList)
+        if option_list.highlighted is not None:
+            option_list.action_select()
+
+    def on_option_list_option_selected(self, event: OptionList.OptionSelected) -> None:
+        chat_id, message_id = str(event.option.id).split("-")
+        self.dismiss((int(chat_id), int(message_id)))
+
+    def compose(self) -> ComposeResult:
+        with Container(id="chat-search-container"):
+            yield Label("Search chats", classes="title")
+            yield Input(id="chat-search-input", placeholder="Words to find")
+            yield OptionList(id="chat-search-results")
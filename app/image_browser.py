@@ -1,16 +1,18 @@
-from base64 import b64encode
-from io import BytesIO
+import asyncio
 from pathlib import Path
 
-from PIL import Image as PILImage
 from PIL import UnidentifiedImageError
 from textual import on
 from textual.app import ComposeResult
 from textual.containers import Container, Horizontal, Vertical
 from textual.screen import ModalScreen
-from textual.widgets import DirectoryTree, Input, Label
+from textual.widgets import Input, Label
 
-from oterm.app.widgets.image import IMAGE_EXTENSIONS, Image, ImageDirectoryTree
+from oterm.app.widgets.image import Image, ImageDirectoryTree, image_extensions
+from oterm.image_pipeline import imagePipeline
+
+# Seconds to wait for typing to pause before changing the root directory.
+ROOT_DEBOUNCE = 0.3
 
 
 class ImageSelect(ModalScreen[tuple[Path, str]]):
@@ -26,31 +28,34 @@ class ImageSelect(ModalScreen[tuple[Path, str]]):
         dt.show_guides = False
         dt.focus()
 
-    @on(DirectoryTree.FileSelected)
-    async def on_image_selected(self, ev: DirectoryTree.FileSelected) -> None:
+    @on(ImageDirectoryTree.FileSelected)
+    async def on_image_selected(self, ev: ImageDirectoryTree.FileSelected) -> None:
         try:
-            buffer = BytesIO()
-            image = PILImage.open(ev.path)
-            if image.mode != "RGB":
-                image = image.convert("RGB")
-            image.save(buffer, format="JPEG")
-            b64 = b64encode(buffer.getvalue()).decode("utf-8")
-            self.dismiss((ev.path, b64))
-        except UnidentifiedImageError:
+            digest = await imagePipeline.prepare(ev.path)
+            self.dismiss((ev.path, digest))
+        except (UnidentifiedImageError, OSError):
             self.dismiss()
 
-    @on(DirectoryTree.NodeHighlighted)
-    async def on_image_highlighted(self, ev: DirectoryTree.NodeHighlighted) -> None:
+    @on(ImageDirectoryTree.NodeHighlighted)
+    async def on_image_highlighted(
+        self, ev: ImageDirectoryTree.NodeHighlighted
+    ) -> None:
         path = ev.node.data.path
-        if path.suffix in IMAGE_EXTENSIONS:
+        if path.suffix.lower() in image_extensions():
             image = self.query_one(Image)
             image.path = path.as_posix()
 
     @on(Input.Changed)
-    async def on_root_changed(self, ev: Input.Changed) -> None:
+    def on_root_changed(self, ev: Input.Changed) -> None:
+        # Replaces, and so cancels, the pending root change if any.
+        self.run_worker(self.change_root(ev.value), exclusive=True, group="root")
+
+    async def change_root(self, value: str) -> None:
+        # Only once typing pauses, rather than for every partial path.
+        await asyncio.sleep(ROOT_DEBOUNCE)
         dt = self.query_one(ImageDirectoryTree)
-        path = Path(ev.value)
-        if not path.exists() or not path.is_dir():
+        path = Path(value)
+        if not path.is_dir() or path == dt.path:
             return
         dt.path = path
 
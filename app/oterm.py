@@ -7,9 +7,12 @@ from textual.app import App, ComposeResult
 from textual.widgets import Footer, Header, TabbedContent, TabPane
 
 from oterm.app.chat_edit import ChatEdit
+from oterm.app.chat_search import ChatSearch
 from oterm.app.splash import SplashScreen
 from oterm.app.widgets.chat import ChatContainer
 from oterm.config import appConfig
+from oterm.ollamaclient import backendPool, close_clients
+from oterm.scheduler import inferenceScheduler
 from oterm.store.store import Store
 
 # Configure logging
@@ -23,6 +26,7 @@ class OTerm(App):
         ("ctrl+n", "new_chat", "new"),
         ("ctrl+tab", "cycle_chat(+1)", "next chat"),
         ("ctrl+shift+tab", "cycle_chat(-1)", "prev chat"),
+        ("ctrl+g", "search", "search"),
         ("ctrl+t", "toggle_dark", "toggle theme"),
         ("ctrl+q", "quit", "quit"),
     ]
@@ -34,7 +38,10 @@ class OTerm(App):
 
     async def action_quit(self) -> None:
         logging.info("Quitting the application")
-        await self.exit()
+        for container in self.query(ChatContainer):
+            await container.stop_inference()
+        await self.store.close()
+        self.exit()
 
     async def action_cycle_chat(self, change: int) -> None:
         tabs = self.query_one(TabbedContent)
@@ -50,6 +57,25 @@ class OTerm(App):
                 logging.info(f"Switched to chat {next_id}")
                 break
 
+    def action_search(self) -> None:
+        def on_result_select(result: tuple[int, int] | None) -> None:
+            if result is None:
+                return
+            chat_id, message_id = result
+            tabs = self.query_one(TabbedContent)
+            try:
+                tabs.active = f"chat-{chat_id}"
+                container = tabs.get_pane(f"chat-{chat_id}").query_one(ChatContainer)
+            except Exception as e:
+                logging.error(f"Error showing message {message_id}: {e}")
+                return
+            # Once the chat has been laid out again, with the search dismissed.
+            self.call_after_refresh(
+                self.run_worker, container.show_message(message_id)
+            )
+
+        self.push_screen(ChatSearch(), on_result_select)
+
     def action_new_chat(self) -> None:
         async def on_model_select(model_info: Optional[str]) -> None:
             if model_info is None:
@@ -78,7 +104,6 @@ class OTerm(App):
                         format=model["format"],
                         parameters=model["parameters"],
                         keep_alive=model["keep_alive"],
-                        messages=[],
                     )
                 )
                 await tabs.add_pane(pane)
@@ -94,7 +119,10 @@ class OTerm(App):
 
     async def on_mount(self) -> None:
         self.store = await Store.create()
+        backendPool.start()
         self.dark = appConfig.get("theme") == "dark"
+        # Only chat metadata is loaded here; each chat hydrates its messages
+        # and LLM client when its tab is first activated.
         saved_chats = await self.store.get_chats()
         if not saved_chats:
             self.action_new_chat()
@@ -102,12 +130,10 @@ class OTerm(App):
             tabs = self.query_one(TabbedContent)
             for id, name, model, system, format, parameters, keep_alive in saved_chats:
                 try:
-                    messages = await self.store.get_messages(id)
                     container = ChatContainer(
                         db_id=id,
                         chat_name=name,
                         model=model,
-                        messages=messages,
                         system=system,
                         format=format,
                         parameters=parameters,
@@ -119,11 +145,19 @@ class OTerm(App):
                     logging.error(f"Error loading chat {id}: {e}")
         await self.push_screen(SplashScreen())
 
+    async def on_unmount(self) -> None:
+        if hasattr(self, "store"):
+            await self.store.close()
+        await backendPool.stop()
+        await close_clients()
+
     @on(TabbedContent.TabActivated)
     async def on_tab_activated(self, event: TabbedContent.TabActivated) -> None:
         container = event.pane.query_one(ChatContainer)
+        inferenceScheduler.foreground = container.db_id
         try:
             await container.load_messages()
+            container.query_one("#prompt").focus()
             logging.info(f"Loaded messages for tab {event.pane.id}")
         except Exception as e:
             logging.error(f"Error loading messages for tab {event.pane.id}: {e}")
@@ -133,5 +167,3 @@ class OTerm(App):
         yield TabbedContent(id="tabs")
         yield Footer()
 
-
-app = OTerm()
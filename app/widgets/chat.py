@@ -1,17 +1,21 @@
 import asyncio
+import io
 import json
-from enum import Enum
+from bisect import bisect_left, bisect_right
+from contextlib import aclosing
+from itertools import accumulate
 from pathlib import Path
-from typing import Literal
+from typing import Any, Coroutine, Literal
 
-import pyperclip
 from ollama import Message
 from textual import on
 from textual.app import ComposeResult
 from textual.binding import Binding
 from textual.containers import Horizontal, Vertical
 from textual.events import Click
+from textual.message import Message as TextualMessage
 from textual.reactive import reactive
+from textual.timer import Timer
 from textual.widget import Widget
 from textual.widgets import (
     LoadingIndicator,
@@ -26,23 +30,469 @@ from oterm.app.chat_rename import ChatRename
 from oterm.app.prompt_history import PromptHistory
 from oterm.app.widgets.image import ImageAdded
 from oterm.app.widgets.prompt import FlexibleInput
-from oterm.ollamaclient import OllamaLLM, Options
+from oterm.ollamaclient import (
+    OllamaError,
+    OllamaLLM,
+    Options,
+    ResponseMetrics,
+    backendPool,
+)
+from oterm.scheduler import inferenceScheduler
+from oterm.store.store import StreamingMessage
+from oterm.enums import Author
+
+
+def is_json_object(text: str) -> bool:
+    try:
+        return isinstance(json.loads(text), dict)
+    except json.JSONDecodeError:
+        return False
 
 
-class Author(Enum):
-    USER = "me"
-    OLLAMA = "ollama"
+async def run_to_completion(coroutine: Coroutine[Any, Any, None]) -> None:
+    """Run `coroutine` to its end, even if the caller is cancelled meanwhile."""
+    task = asyncio.ensure_future(coroutine)
+    while not task.done():
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            pass
+    task.result()
+
+
+def finished_blocks_end(text: str, start: int = 0) -> int:
+    """
+    Return the offset in `text` up to which the Markdown starting at `start`
+    consists of finished blocks, i.e. the start of the last top-level block.
+
+    A block is finished once a blank line outside of a code fence is
+    followed by a non-indented line. `start` must be at a block boundary.
+    """
+    boundary = start
+    position = start
+    fence = ""
+    block_ended = False
+    for line in text[start:].splitlines(keepends=True):
+        stripped = line.strip()
+        if fence:
+            if line.endswith("\n") and stripped.startswith(fence):
+                if not stripped.strip(fence[0]):
+                    fence = ""
+                    block_ended = True
+        elif stripped and not line[0].isspace():
+            if block_ended and position > start:
+                boundary = position
+            block_ended = False
+            if stripped.startswith(("```", "~~~")):
+                marker = stripped[0]
+                fence = marker * (len(stripped) - len(stripped.lstrip(marker)))
+        elif not stripped:
+            block_ended = True
+        position += len(line)
+    return boundary
+
+
+class ChatItem(Widget):
+    """
+    A chat message rendered as Markdown.
+
+    Streamed replies are fed through `append_text`. Incoming tokens are
+    coalesced and painted at most `RENDER_FPS` times per second. Every
+    finished Markdown block is mounted once in its own `Markdown` widget and
+    never parsed again, so each frame only re-parses the trailing, still
+    growing block.
+    """
+
+    RENDER_FPS = 15
+
+    text: reactive[str] = reactive("")
+    author: Author
+    metrics: ResponseMetrics | None = None
+
+    class Rendered(TextualMessage):
+        """Posted after a streaming frame has been painted."""
+
+        def __init__(self, chat_item: "ChatItem") -> None:
+            self.chat_item = chat_item
+            super().__init__()
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._stream = io.StringIO()
+        self._committed = 0
+        self._dirty = False
+        self._render_timer: Timer | None = None
+
+    @on(Click)
+    async def on_click(self, event: Click) -> None:
+        import pyperclip
+
+        try:
+            pyperclip.copy(self.text)
+        except pyperclip.PyperclipException:
+            # https://pyperclip.readthedocs.io/en/latest/index.html#not-implemented-error
+            return
+        widgets = self.query(".text")
+        for widget in widgets:
+            widget.styles.animate("opacity", 0.5, duration=0.1)
+            widget.styles.animate("opacity", 1.0, duration=0.1, delay=0.1)
+
+    def append_text(self, delta: str) -> None:
+        self._stream.write(delta)
+        self._dirty = True
+        if self._render_timer is None:
+            self._render_timer = self.set_interval(
+                1 / self.RENDER_FPS, self.render_stream
+            )
+
+    async def render_stream(self) -> None:
+        if not self._dirty:
+            return
+        self._dirty = False
+        text = self._stream.getvalue()
+        # Do not trigger `watch_text`, which re-renders the whole document.
+        self.set_reactive(ChatItem.text, text)
+
+        blocks = self.query_one(".text", Vertical)
+        tail = self.query_one(".tail", Markdown)
+        boundary = finished_blocks_end(text, self._committed)
+        if boundary > self._committed:
+            block = self.markdown(text[self._committed : boundary], classes="block")
+            await blocks.mount(block, before=tail)
+            self._committed = boundary
+        await tail.update(text[self._committed :])
+        self.post_message(self.Rendered(self))
+
+    def stop_stream(self) -> None:
+        if self._render_timer is not None:
+            self._render_timer.stop()
+            self._render_timer = None
+
+    async def finish_stream(self) -> None:
+        self.stop_stream()
+        await self.render_stream()
+        if is_json_object(self.text):
+            await self.watch_text(self.text)
+
+    def set_metrics(self, metrics: ResponseMetrics | None) -> None:
+        self.metrics = metrics
+        widget = self.query_one(".metrics", Static)
+        widget.update(str(metrics) if metrics else "")
+        widget.display = metrics is not None
+
+    async def set_message(
+        self, author: Author, text: str, metrics: ResponseMetrics | None = None
+    ) -> None:
+        """Reuse this item for another message."""
+        if author != self.author:
+            row = self.query_one(".chatItem", Horizontal)
+            row.remove_class(self.author.name)
+            row.add_class(author.name)
+            self.query_one(".author", Static).update(author.value)
+            self.author = author
+        self.set_metrics(metrics)
+        # Render before returning rather than in a watcher task, so the
+        # item has its final height on the next layout.
+        self.set_reactive(ChatItem.text, text)
+        await self.watch_text(text)
+
+    async def watch_text(self, text: str) -> None:
+        text = self.text
+        if is_json_object(text):
+            text = f"```json\n{self.text}\n```"
+
+        await self.query(".block").remove()
+        self._committed = 0
+        txt_widget = self.query_one(".tail", Markdown)
+        await txt_widget.update(text)
+
+    @staticmethod
+    def markdown(text: str, classes: str) -> Markdown:
+        mrk_down = Markdown(text, classes=classes)
+        mrk_down.code_dark_theme = "solarized-dark"
+        mrk_down.code_light_theme = "solarized-light"
+        return mrk_down
+
+    def compose(self) -> ComposeResult:
+        """A chat item."""
+        with Horizontal(classes=f"{self.author.name} chatItem"):
+            yield Static(self.author.value, classes="author", markup=False)
+            with Vertical(classes="text"):
+                yield self.markdown(self.text, classes="tail")
+                metrics = Static(
+                    str(self.metrics) if self.metrics else "",
+                    classes="metrics",
+                    markup=False,
+                )
+                metrics.display = self.metrics is not None
+                yield metrics
+
+
+# A message of a `MessageList`: its id in the store, if saved, author, text
+# and metrics of the response.
+Entry = tuple[int | None, Author, str, ResponseMetrics | None]
+
+
+class MessageList(Vertical):
+    """
+    A virtualized list of chat messages.
+
+    Only the messages in the viewport, plus `OVERSCAN` on either side, are
+    mounted as `ChatItem`s. The others are represented by two spacers sized
+    from measured heights, or estimated ones for messages never mounted.
+    `ChatItem`s are recycled as the window moves. Widgets mounted after the
+    bottom spacer (the exchange being streamed, notifications, the loading
+    indicator) are not virtualized.
+    """
+
+    OVERSCAN = 10
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.entries: list[Entry] = []
+        self.heights: list[int] = []
+        self.items: list[ChatItem] = []
+        self.start = 0
+        self.end = 0
+        self.top_spacer = Widget(classes="spacer")
+        self.bottom_spacer = Widget(classes="spacer")
+        # Serializes changes to the window: a change interrupted half-way
+        # would leave the mounted items out of sync with the entries.
+        self._lock = asyncio.Lock()
+        self._window_update_pending = False
+        # Message index and its offset from the top of the viewport to keep
+        # in place once the next layout has measured the mounted items.
+        self._anchor: tuple[int, float] | None = None
+        # False until the initial messages have been laid out and scrolled to.
+        self._settled = False
+        # Whether the list was last scrolled to the bottom, and should follow
+        # it as the heights of the items settle.
+        self._at_bottom = False
+
+    def compose(self) -> ComposeResult:
+        yield self.top_spacer
+        yield self.bottom_spacer
+
+    def on_mount(self) -> None:
+        self.watch(self, "scroll_y", self.on_scroll_y, init=False)
+        self.watch(self, "virtual_size", self.on_virtual_size, init=False)
+
+    def on_resize(self) -> None:
+        self.update_window()
+
+    def on_scroll_y(self, old_value: float, new_value: float) -> None:
+        self._at_bottom = new_value >= self.max_scroll_y
+        self.update_window()
+
+    def on_virtual_size(self) -> None:
+        if self._at_bottom and self._anchor is None:
+            self.jump_to(self.max_scroll_y)
+
+    def estimate_height(self, entry: Entry) -> int:
+        _, _, text, metrics = entry
+        width = max(int(self.size.width * 0.8), 20) if self.size.width else 80
+        lines = sum(len(line) // width + 1 for line in text.splitlines())
+        if metrics is not None:
+            lines += 1
+        # Padding and margins of ChatItem and its Markdown.
+        return max(lines, 1) + 4
+
+    def measure(self) -> None:
+        for index, item in enumerate(self.items, self.start):
+            if item.outer_size.height:
+                self.heights[index] = item.outer_size.height
+
+    def offset(self, index: int) -> int:
+        return sum(self.heights[:index])
+
+    def position(self, index: int) -> int:
+        """The laid out offset of a message, given the actual top spacer height."""
+        return (
+            self.offset(index)
+            - self.offset(self.start)
+            + self.top_spacer.outer_size.height
+        )
+
+    def visible_range(self) -> tuple[int, int]:
+        self.measure()
+        offsets = list(accumulate(self.heights, initial=0))
+        top = self.scroll_y - self.position(0)
+        first = max(bisect_right(offsets, top) - 1, 0)
+        last = bisect_left(offsets, top + self.size.height)
+        return min(first, len(self.entries)), min(last, len(self.entries))
+
+    def jump_to(self, y: float) -> None:
+        # Unlike `scroll_to`, applies immediately rather than after a refresh.
+        self.scroll_target_y = self.scroll_y = y
+
+    def set_anchor(self, index: int, offset: float) -> None:
+        if self._anchor is None:
+            self.call_after_refresh(self.restore_anchor)
+        self._anchor = (index, offset)
+
+    def restore_anchor(self, attempts: int = 20) -> None:
+        if self._anchor is None:
+            return
+        # Positions are off until the resized top spacer has been laid out,
+        # which may take a few refreshes.
+        if attempts and self.top_spacer.outer_size.height != self.offset(self.start):
+            self.call_after_refresh(self.restore_anchor, attempts - 1)
+            return
+        index, offset = self._anchor
+        self._anchor = None
+        self.measure()
+        self.jump_to(self.position(index) - offset)
+
+    def update_window(self) -> None:
+        if self._window_update_pending or not self._settled:
+            return
+        self._window_update_pending = True
+        self.run_worker(self._update_window(), group="message-window")
+
+    async def _update_window(self) -> None:
+        async with self._lock:
+            self._window_update_pending = False
+            if not self.entries or self._anchor is not None:
+                return
+            first, last = self.visible_range()
+            if first < self.start or last > self.end:
+                # Anchoring on the end of the list keeps it pinned to the bottom.
+                anchor = first
+                if self.scroll_y >= self.max_scroll_y:
+                    anchor = len(self.entries)
+                self.set_anchor(anchor, self.position(anchor) - self.scroll_y)
+                await self._show_window(
+                    max(first - self.OVERSCAN, 0),
+                    min(last + self.OVERSCAN, len(self.entries)),
+                )
+
+    async def _show_window(self, start: int, end: int) -> None:
+        """Mount the messages in [start, end), recycling mounted items."""
+        self.measure()
+        mounted = dict(enumerate(self.items, self.start))
+        recycled = [
+            item for index, item in mounted.items() if not start <= index < end
+        ]
+        items: list[ChatItem] = []
+        new_items: list[ChatItem] = []
+        for index in range(start, end):
+            item = mounted.get(index)
+            if item is None:
+                _, author, text, metrics = self.entries[index]
+                if recycled:
+                    item = recycled.pop()
+                    await item.set_message(author, text, metrics)
+                else:
+                    item = ChatItem()
+                    item.author = author
+                    item.text = text
+                    item.metrics = metrics
+                    new_items.append(item)
+            items.append(item)
+
+        if recycled:
+            await self.remove_children(recycled)
+        if new_items:
+            await self.mount_all(new_items, before=self.bottom_spacer)
+        previous: Widget = self.top_spacer
+        for item in items:
+            self.move_child(item, after=previous)
+            previous = item
+
+        self.items = items
+        self.start, self.end = start, end
+        self.top_spacer.styles.height = self.offset(start)
+        self.bottom_spacer.styles.height = sum(self.heights[end:])
+
+    async def set_messages(self, entries: list[Entry]) -> None:
+        async with self._lock:
+            self._settled = False
+            await self._show_window(0, 0)
+            self.entries = list(entries)
+            self.heights = [self.estimate_height(entry) for entry in entries]
+            await self._show_window(
+                max(len(self.entries) - 2 * self.OVERSCAN, 0), len(self.entries)
+            )
+
+        def settle() -> None:
+            self.measure()
+            self.bottom_spacer.styles.height = 0
+            self.jump_to(self.max_scroll_y)
+            self._settled = True
+            self.update_window()
+
+        self.call_after_refresh(settle)
+
+    async def prepend(self, entries: list[Entry]) -> None:
+        """Add older messages above the current ones, keeping the scroll position."""
+        async with self._lock:
+            first, _ = self.visible_range()
+            offset = self.position(first) - self.scroll_y
+            self.entries[:0] = entries
+            self.heights[:0] = [self.estimate_height(entry) for entry in entries]
+            self.start += len(entries)
+            self.end += len(entries)
+            self.top_spacer.styles.height = self.offset(self.start)
+            self.set_anchor(first + len(entries), offset)
+
+    async def show_entry(self, index: int) -> None:
+        """Scroll so that the message at `index` is at the top of the list."""
+        async with self._lock:
+            await self._show_window(
+                max(index - self.OVERSCAN, 0),
+                min(index + self.size.height + self.OVERSCAN, len(self.entries)),
+            )
+            self._at_bottom = False
+            self.set_anchor(index, 0)
+
+    async def append_message(
+        self,
+        author: Author,
+        text: str,
+        id: int | None = None,
+        item: ChatItem | None = None,
+        metrics: ResponseMetrics | None = None,
+    ) -> ChatItem:
+        """
+        Add a message at the end of the list. An already mounted `item`, e.g.
+        a streamed reply, is moved into the list instead of creating one.
+        """
+        async with self._lock:
+            if self.end < len(self.entries):
+                await self._show_window(
+                    max(len(self.entries) - 2 * self.OVERSCAN, self.start),
+                    len(self.entries),
+                )
+            if item is None:
+                item = ChatItem()
+                item.author = author
+                item.text = text
+                item.metrics = metrics
+                await self.mount(item, before=self.bottom_spacer)
+            else:
+                self.move_child(item, before=self.bottom_spacer)
+            entry = (id, author, text, metrics)
+            self.entries.append(entry)
+            self.heights.append(item.outer_size.height or self.estimate_height(entry))
+            self.items.append(item)
+            self.end = len(self.entries)
+            self.bottom_spacer.styles.height = 0
+            return item
 
 
 class ChatContainer(Widget):
-    ollama = OllamaLLM()
+    ollama: OllamaLLM | None = None
     messages: reactive[list[tuple[Author, str]]] = reactive([])
     chat_name: str
+    model: str
     system: str | None
     format: Literal["", "json"]
     parameters: Options
     keep_alive: int = 5
-    images: list[tuple[Path, str]] = []
+    # Attached to the next message: paths and digests in the ImageStore.
+    images: list[tuple[Path, str]]
+    # Digests of the images of messages, by index in `messages`.
+    message_images: dict[int, list[str]]
 
     BINDINGS = [
         Binding("ctrl+e", "edit_chat", "edit", priority=True),
@@ -61,7 +511,6 @@ class ChatContainer(Widget):
         db_id: int,
         chat_name: str,
         model: str = "tinyllama:latest",
-        messages: list[tuple[Author, str]] = [],
         system: str | None = None,
         format: Literal["", "json"] = "",
         parameters: Options,
@@ -69,120 +518,341 @@ class ChatContainer(Widget):
         **kwargs,
     ) -> None:
         super().__init__(*children, **kwargs)
-
+        # The last page of messages is hydrated lazily by `load_messages` the
+        # first time the chat's tab is activated, the whole history and the
+        # LLM client by `load_history` the first time they are needed.
+        self.chat_name = chat_name
+        self.db_id = db_id
+        self.model = model
+        self.messages = []
+        self.images = []
+        self.message_images = {}
+        self.system = system
+        self.format = format
+        self.parameters = parameters
+        self.keep_alive = keep_alive
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+        self._history_lock = asyncio.Lock()
+        self.oldest_message_id: int | None = None
+        self.has_older_messages = False
+        self.metrics: ResponseMetrics | None = None
+        # Replies being generated or waiting for the scheduler, oldest first,
+        # and the positions in its queue of those waiting.
+        self.inference_tasks: list[asyncio.Task] = []
+        self.queue_positions: dict[object, int] = {}
+
+    def build_llm(self) -> OllamaLLM:
         history: list[Message] = [
             (
                 {"role": "user", "content": message}
                 if author == Author.USER
                 else {"role": "assistant", "content": message}
             )
-            for author, message in messages
+            for author, message in self.messages
         ]
-
-        self.ollama = OllamaLLM(
-            model=model,
-            system=system,
-            format=format,
-            options=parameters,
-            keep_alive=keep_alive,
+        for index, digests in self.message_images.items():
+            history[index]["images"] = digests
+        return OllamaLLM(
+            model=self.model,
+            system=self.system,
+            format=self.format,
+            options=self.parameters,
+            keep_alive=self.keep_alive,
             history=history,
         )
 
-        self.chat_name = chat_name
-        self.db_id = db_id
-        self.messages = messages
-        self.system = system
-        self.format = format
-        self.parameters = parameters
-        self.keep_alive = keep_alive
-        self.loaded = False
-
     def on_mount(self) -> None:
-        self.query_one("#prompt").focus()
+        # The prompt is focused on tab activation instead of here: focusing a
+        # widget activates its pane, which would hydrate every chat on startup.
+        message_container = self.query_one("#messageContainer")
+        self.watch(message_container, "scroll_y", self.on_messages_scroll, init=False)
 
     async def load_messages(self) -> None:
-        if self.loaded:
+        # Concurrent callers, e.g. tab activation and a search result, wait
+        # for the messages to be loaded once.
+        async with self._load_lock:
+            if self.loaded:
+                return
+            store = self.app.store  # type: ignore
+            message_list = self.query_one("#messageContainer", MessageList)
+            page = await store.get_messages_page(self.db_id)
+            if page:
+                self.oldest_message_id = page[0][0]
+                self.has_older_messages = True
+            entries = self.entries(page)
+            await message_list.set_messages(entries)
+            metrics = [metrics for *_, metrics in entries if metrics is not None]
+            self.update_info(metrics[-1] if metrics else None)
+            self.loaded = True
+
+    async def load_history(self) -> None:
+        # Reads the whole chat, so it is put off until a message is sent or
+        # the prompt history is shown rather than done when the tab opens.
+        async with self._history_lock:
+            if self.ollama is not None:
+                return
+            history = await self.app.store.get_history(self.db_id)  # type: ignore
+            self.messages = [(author, text) for author, text, _ in history]
+            self.message_images = {
+                index: digests
+                for index, (*_, digests) in enumerate(history)
+                if digests
+            }
+            self.ollama = self.build_llm()
+
+    @staticmethod
+    def entries(page: list[tuple[int, Author, str, dict | None]]) -> list[Entry]:
+        return [
+            (id, author, text, ResponseMetrics.from_dict(metrics) if metrics else None)
+            for id, author, text, metrics in page
+        ]
+
+    def update_info(self, metrics: ResponseMetrics | None = None) -> None:
+        self.metrics = metrics or self.metrics
+        info = f"model: {self.model}"
+        if self.queue_positions:
+            info = f"{info} · queued #{min(self.queue_positions.values())}"
+        elif self.metrics is not None:
+            info = f"{info} · {self.metrics}"
+        self.query_one("#info", Static).update(info)
+
+    async def load_older_messages(self) -> None:
+        if not self.has_older_messages:
             return
-        message_container = self.query_one("#messageContainer")
-        for author, message in self.messages:
-            chat_item = ChatItem()
-            chat_item.text = message
-            chat_item.author = author
-            await message_container.mount(chat_item)
-        message_container.scroll_end()
-        self.loaded = True
+        # Claim the page before awaiting so that scroll events arriving while
+        # it loads do not fetch it again.
+        self.has_older_messages = False
+        message_list = self.query_one("#messageContainer", MessageList)
+        page = await self.app.store.get_messages_page(  # type: ignore
+            self.db_id, before_id=self.oldest_message_id
+        )
+        if not page:
+            # Reached the first message of the chat.
+            return
+        self.oldest_message_id = page[0][0]
+        await message_list.prepend(self.entries(page))
+        self.has_older_messages = True
+
+    async def show_message(self, message_id: int) -> None:
+        """Scroll to a message, loading the older messages up to it."""
+        await self.load_messages()
+        message_list = self.query_one("#messageContainer", MessageList)
+        if self.oldest_message_id is not None and message_id < self.oldest_message_id:
+            self.has_older_messages = False
+            page = await self.app.store.get_messages_since(  # type: ignore
+                self.db_id, message_id, before_id=self.oldest_message_id
+            )
+            if page:
+                self.oldest_message_id = page[0][0]
+                await message_list.prepend(self.entries(page))
+            self.has_older_messages = True
+        for index, (id, *_) in enumerate(message_list.entries):
+            if id == message_id:
+                await message_list.show_entry(index)
+                break
+
+    def on_messages_scroll(self, old_value: float, new_value: float) -> None:
+        if new_value == 0 and old_value > 0 and self.has_older_messages:
+            self.run_worker(self.load_older_messages(), exclusive=True)
 
     @on(FlexibleInput.Submitted)
     async def on_submit(self, event: FlexibleInput.Submitted) -> None:
         message = event.value
         input = event.input
-        message_container = self.query_one("#messageContainer")
+        message_list = self.query_one("#messageContainer", MessageList)
 
         if not message.strip():
             input.clear()
             input.focus()
             return
+        await self.load_messages()
+        await self.load_history()
 
-        async def response_task() -> None:
-            input.clear()
+        async def generate(host: str) -> None:
+            images = [digest for _, digest in self.images]
             self.messages.append((Author.USER, message))
+            if images:
+                self.message_images[len(self.messages) - 1] = images
+            # Both messages are saved right away, the reply is then
+            # checkpointed while it streams so that it survives a crash.
+            user_id = await self.app.store.save_message(  # type: ignore
+                chat_id=self.db_id,
+                author=Author.USER.value,
+                text=message,
+            )
+            if images:
+                await self.app.store.save_message_images(  # type: ignore
+                    user_id, images
+                )
+            reply = StreamingMessage(
+                self.app.store, self.db_id, Author.OLLAMA.value  # type: ignore
+            )
+            await reply.start()
+
+            # The exchange is mounted below the virtualized messages until the
+            # reply is complete, and only then becomes part of the list.
             user_chat_item = ChatItem()
             user_chat_item.text = message
             user_chat_item.author = Author.USER
-            message_container.mount(user_chat_item)
+            message_list.mount(user_chat_item)
 
             response_chat_item = ChatItem()
             response_chat_item.author = Author.OLLAMA
-            message_container.mount(response_chat_item)
+            message_list.mount(response_chat_item)
             loading = LoadingIndicator()
-            await message_container.mount(loading)
-            message_container.scroll_end()
-
-            try:
-                response = ""
-                async for text in self.ollama.stream(
-                    message, [img for _, img in self.images]
-                ):
-                    response = text
-                    response_chat_item.text = text
-                    if message_container.can_view(response_chat_item):
-                        message_container.scroll_end()
+            await message_list.mount(loading)
+            message_list.scroll_end()
+
+            async def complete(
+                response: str, metrics: ResponseMetrics | None
+            ) -> None:
+                await response_chat_item.finish_stream()
+                response_chat_item.set_metrics(metrics)
+                self.update_info(metrics)
+                response = response or response_chat_item.text
                 self.messages.append((Author.OLLAMA, response))
                 self.images = []
+                await reply.finish(
+                    response, metrics=metrics.to_json() if metrics else None
+                )
 
-                # Save to db
-                await self.app.store.save_message(  # type: ignore
-                    chat_id=self.db_id,
-                    author=Author.USER.value,
-                    text=message,
+                # The attached images have been sent along with the message.
+                await message_list.query(Notification).remove()
+                await message_list.append_message(
+                    Author.USER, message, id=user_id, item=user_chat_item
                 )
-                await self.app.store.save_message(  # type: ignore
-                    chat_id=self.db_id,
-                    author=Author.OLLAMA.value,
-                    text=response,
+                await message_list.append_message(
+                    Author.OLLAMA,
+                    response,
+                    id=reply.id,
+                    item=response_chat_item,
+                    metrics=metrics,
                 )
-            except asyncio.CancelledError:
-                user_chat_item.remove()
-                response_chat_item.remove()
-                input.text = message
+
+            async def keep_partial(response: str) -> None:
+                # Keep the partial reply, in the chat as in the store. The
+                # client left the failed turn out of its history.
+                await response_chat_item.finish_stream()
+                self.messages.append((Author.OLLAMA, response))
+                user_prompt: Message = {"role": "user", "content": message}
+                if images:
+                    user_prompt["images"] = images
+                self.ollama.history += [  # type: ignore
+                    user_prompt,
+                    {"role": "assistant", "content": response},
+                ]
+                await reply.finish(response, status="aborted")
+                await message_list.append_message(
+                    Author.USER, message, id=user_id, item=user_chat_item
+                )
+                await message_list.append_message(
+                    Author.OLLAMA, response, id=reply.id, item=response_chat_item
+                )
+
+            try:
+                response = ""
+                metrics: ResponseMetrics | None = None
+                try:
+                    # Closed on cancellation, so that the server stops
+                    # generating.
+                    async with aclosing(
+                        self.ollama.stream_deltas(  # type: ignore
+                            message, images, host=host
+                        )
+                    ) as chunks:
+                        async for chunk in chunks:
+                            if chunk.done:
+                                response = chunk.text
+                                metrics = chunk.metrics
+                                continue
+                            response_chat_item.append_text(chunk.delta)
+                            reply.append(chunk.delta)
+                except (asyncio.CancelledError, OllamaError) as e:
+                    if isinstance(e, OllamaError):
+                        self.app.notify(str(e), title="Ollama", severity="error")
+                    response_chat_item.stop_stream()
+                    if not reply.text:
+                        # Nothing was generated, give the prompt back.
+                        await reply.discard()
+                        await self.app.store.delete_message(user_id)  # type: ignore
+                        self.messages.pop()
+                        self.message_images.pop(len(self.messages), None)
+                        user_chat_item.remove()
+                        response_chat_item.remove()
+                        input.text = message
+                        return
+                    # Saved once, even if cancelled again meanwhile.
+                    await run_to_completion(keep_partial(reply.text))
+                else:
+                    # Once the stream is over, a late cancel no longer aborts
+                    # the turn.
+                    await run_to_completion(complete(response, metrics))
             finally:
                 loading.remove()
-                input.focus()
+                self.focus_prompt()
+
+        key = object()
+
+        def on_position(position: int) -> None:
+            if position:
+                self.queue_positions[key] = position
+            else:
+                self.queue_positions.pop(key, None)
+            if self.is_attached:
+                self.update_info()
 
-        self.inference_task = asyncio.create_task(response_task())
+        async def response_task() -> None:
+            input.clear()
+            try:
+                hosts = await backendPool.hosts(
+                    self.model, prefer=self.ollama.host  # type: ignore
+                )
+                async with inferenceScheduler.slot(
+                    hosts, self.model, owner=self.db_id, on_position=on_position
+                ) as host:
+                    await generate(host)
+            except asyncio.CancelledError:
+                # Cancelled while queued, before anything was sent.
+                on_position(0)
+                if not input.text:
+                    input.text = message
+                self.focus_prompt()
+
+        task = asyncio.create_task(response_task())
+        self.inference_tasks.append(task)
+        task.add_done_callback(self.inference_tasks.remove)
+
+    def focus_prompt(self) -> None:
+        # Focusing a widget activates its pane, so the prompt of a chat in the
+        # background is left alone when its reply completes.
+        if self.app.query_one(TabbedContent).active == f"chat-{self.db_id}":
+            self.query_one("#prompt", FlexibleInput).focus()
 
     def key_escape(self) -> None:
-        if hasattr(self, "inference_task"):
-            self.inference_task.cancel()
+        # The running reply, or else the next message in the queue.
+        pending = [task for task in self.inference_tasks if not task.done()]
+        if pending:
+            pending[0].cancel()
+
+    async def stop_inference(self) -> None:
+        """Cancel the inferences, waiting for their replies to be saved."""
+        pending = [task for task in self.inference_tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
 
     async def action_edit_chat(self) -> None:
         async def on_model_select(model_info: str | None) -> None:
             if model_info is None:
                 return
             model: dict = json.loads(model_info)
+            self.model = model["name"]
             self.system = model.get("system")
             self.format = model.get("format", "")
             self.keep_alive = model.get("keep_alive", 5)
+            self.parameters = model["parameters"]
 
             await self.app.store.edit_chat(
                 id=self.db_id,
@@ -192,32 +862,15 @@ class ChatContainer(Widget):
                 parameters=json.dumps(model["parameters"]),
                 keep_alive=model["keep_alive"],
             )
+            self.ollama = self.build_llm()
 
-            # load the history from messages
-            history: list[Message] = [
-                (
-                    {"role": "user", "content": message}
-                    if author == Author.USER
-                    else {"role": "assistant", "content": message}
-                )
-                for author, message in self.messages
-            ]
-
-            self.ollama = OllamaLLM(
-                model=model["name"],
-                system=model["system"],
-                format=model["format"],
-                options=model["parameters"],
-                keep_alive=model["keep_alive"],
-                history=history,
-            )
-
+        await self.load_history()
         screen = ChatEdit()
-        screen.model_name = self.ollama.model
+        screen.model_name = self.model
 
         await self.app.push_screen(screen, on_model_select)
         screen.edit_mode = True
-        screen.select_model(self.ollama.model)
+        screen.select_model(self.model)
 
         if self.system:
             screen.system = self.system
@@ -245,6 +898,7 @@ class ChatContainer(Widget):
 
     async def action_forget_chat(self) -> None:
         tabs = self.app.query_one(TabbedContent)
+        await self.stop_inference()
         await self.app.store.delete_chat(self.db_id)
         tabs.remove_pane(tabs.active)
 
@@ -258,6 +912,7 @@ class ChatContainer(Widget):
             prompt.text = text
             prompt.focus()
 
+        await self.load_history()
         prompts = [
             message for author, message in self.messages if author == Author.USER
         ]
@@ -265,60 +920,31 @@ class ChatContainer(Widget):
         screen = PromptHistory(prompts)
         self.app.push_screen(screen, on_history_selected)
 
+    @on(ChatItem.Rendered)
+    def on_chat_item_rendered(self, event: "ChatItem.Rendered") -> None:
+        message_container = self.query_one("#messageContainer")
+        if message_container.can_view(event.chat_item):
+            message_container.scroll_end(animate=False)
+
     @on(ImageAdded)
     def on_image_added(self, ev: ImageAdded) -> None:
-        self.images.append((ev.path, ev.image))
         message_container = self.query_one("#messageContainer")
         notification = Notification()
-        notification.message = f"Image {ev.path} added."
+        if ev.image in [digest for _, digest in self.images]:
+            notification.message = f"Image {ev.path} already added."
+        else:
+            self.images.append((ev.path, ev.image))
+            notification.message = f"Image {ev.path} added."
         message_container.mount(notification)
         message_container.scroll_end()
 
     def compose(self) -> ComposeResult:
         with Vertical():
-            yield Static(f"model: {self.ollama.model}", id="info")
-            yield Vertical(id="messageContainer")
+            yield Static(f"model: {self.model}", id="info")
+            yield MessageList(id="messageContainer")
             yield FlexibleInput("", id="prompt", classes="singleline")
 
 
-class ChatItem(Widget):
-    text: reactive[str] = reactive("")
-    author: Author
-
-    @on(Click)
-    async def on_click(self, event: Click) -> None:
-        try:
-            pyperclip.copy(self.text)
-        except pyperclip.PyperclipException:
-            # https://pyperclip.readthedocs.io/en/latest/index.html#not-implemented-error
-            return
-        widgets = self.query(".text")
-        for widget in widgets:
-            widget.styles.animate("opacity", 0.5, duration=0.1)
-            widget.styles.animate("opacity", 1.0, duration=0.1, delay=0.1)
-
-    async def watch_text(self, text: str) -> None:
-        text = self.text
-        try:
-            jsn = json.loads(text)
-            if isinstance(jsn, dict):
-                text = f"```json\n{self.text}\n```"
-        except json.JSONDecodeError:
-            pass
-
-        txt_widget = self.query_one(".text", Markdown)
-        await txt_widget.update(text)
-
-    def compose(self) -> ComposeResult:
-        """A chat item."""
-        mrk_down = Markdown(self.text, classes="text")
-        mrk_down.code_dark_theme = "solarized-dark"
-        mrk_down.code_light_theme = "solarized-light"
-        with Horizontal(classes=f"{self.author.name} chatItem"):
-            yield Static(self.author.value, classes="author", markup=False)
-            yield mrk_down
-
-
 class Notification(Widget):
     message: reactive[str] = reactive("")
 
@@ -1,16 +1,65 @@
+import asyncio
+import os
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Hashable
 
-from PIL import Image as PILImage
-from PIL import UnidentifiedImageError
-from rich_pixels import Pixels
+from rich.cells import cell_len
+from rich.style import Style
+from rich.text import Text
+from textual import on
 from textual.message import Message
-from textual.reactive import reactive
+from textual.reactive import reactive, var
 from textual.widget import Widget
-from textual.widgets import DirectoryTree
+from textual.widgets import Tree
+from textual.widgets.tree import TreeNode
+from textual.worker import get_current_worker
+
+if TYPE_CHECKING:
+    from rich_pixels import Pixels
 
 IMG_MAX_SIZE = 80
-IMAGE_EXTENSIONS = PILImage.registered_extensions()
+
+# Seconds a highlighted image has to stay highlighted to be rendered.
+PREVIEW_DEBOUNCE = 0.15
+# Estimated memory of a rendered preview pixel, and of all cached previews.
+PREVIEW_PIXEL_BYTES = 500
+PREVIEW_CACHE_BYTES = 64 * 1024 * 1024
+
+# Entries listed per directory, added to the tree a batch at a time as
+# they are read.
+MAX_DIRECTORY_ENTRIES = 10000
+DIRECTORY_BATCH_SIZE = 250
+MAX_DIRECTORY_BATCH_SIZE = 1000
+DIRECTORY_BATCH_INTERVAL = 0.01
+LABEL_ICON_WIDTH = cell_len("📄 ")
+
+# Width and height in pixels, and the rendered pixels of an image.
+Preview = tuple[int, int, "Pixels"]
+
+
+@lru_cache(maxsize=None)
+def image_extensions() -> dict[str, str]:
+    # PIL and its plugins are only imported once images are browsed.
+    from PIL import Image as PILImage
+
+    return PILImage.registered_extensions()
+
+
+@dataclass
+class ImageEntry:
+    """A directory or an image of an `ImageDirectoryTree`."""
+
+    path: Path
+    is_dir: bool
+    # Whether the directory has been listed, and the sort keys of the
+    # entries added so far.
+    loaded: bool = False
+    keys: list[tuple[bool, str]] = field(default_factory=list)
 
 
 class ImageAdded(Message):
@@ -20,33 +69,95 @@ class ImageAdded(Message):
         super().__init__()
 
 
+class PreviewCache(object):
+    """
+    Least recently used previews, bounded by an estimate of their memory:
+    rendered pixels are kept as rich segments, about PREVIEW_PIXEL_BYTES
+    each.
+    """
+
+    def __init__(self, max_bytes: int = PREVIEW_CACHE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.previews: OrderedDict[Hashable, Preview] = OrderedDict()
+
+    @staticmethod
+    def cost(preview: Preview) -> int:
+        width, height, _ = preview
+        return width * height * PREVIEW_PIXEL_BYTES
+
+    def get(self, key: Hashable) -> Preview | None:
+        preview = self.previews.get(key)
+        if preview is not None:
+            self.previews.move_to_end(key)
+        return preview
+
+    def put(self, key: Hashable, preview: Preview) -> None:
+        if key in self.previews:
+            self.size -= self.cost(self.previews.pop(key))
+        self.previews[key] = preview
+        self.size += self.cost(preview)
+        while self.size > self.max_bytes and len(self.previews) > 1:
+            _, evicted = self.previews.popitem(last=False)
+            self.size -= self.cost(evicted)
+
+
+def render_preview(path: str) -> Preview:
+    from PIL import Image as PILImage
+    from rich_pixels import Pixels
+
+    with PILImage.open(path) as img:
+        max_size = max(img.width, img.height)
+        width = max(int(img.width / max_size * IMG_MAX_SIZE), 1)
+        height = max(int(img.height / max_size * IMG_MAX_SIZE), 1)
+        # Decode JPEGs directly at a reduced scale.
+        img.draft("RGB", (width, height))
+        return width, height, Pixels.from_image(img, (width, height))
+
+
 class Image(Widget):
     path: reactive[str] = reactive("")
+    # Shared by all previews.
+    previews = PreviewCache()
 
     def __init__(self, id="", classes="") -> None:
         self.pixels = None
         super().__init__(id=id, classes=classes)
 
     def watch_path(self, path: str) -> None:
+        # Replaces, and so cancels, the preview being rendered if any.
+        self.run_worker(self.show_preview(path), exclusive=True, group="preview")
+
+    async def show_preview(self, path: str) -> None:
+        preview = None
         if path:
             try:
-                with PILImage.open(path) as img:
-                    max_size = max(img.width, img.height)
-                    width = int(img.width / max_size * IMG_MAX_SIZE)
-                    height = int(img.height / max_size * IMG_MAX_SIZE)
-
-                    self.set_styles(
-                        f"""
-                        width: {width * 2};
-                        height: {height};
-                        padding:1;
-                        """
-                    )
-                    self.pixels = Pixels.from_image_path(path, (width, height))
-            except UnidentifiedImageError:
-                self.pixels = None
-        else:
+                stat = os.stat(path)
+                key = (path, stat.st_mtime_ns, stat.st_size)
+                preview = self.previews.get(key)
+                if preview is None:
+                    # Only render once the selection settles, e.g. when an
+                    # arrow key is held down through a folder.
+                    await asyncio.sleep(PREVIEW_DEBOUNCE)
+                    preview = await asyncio.to_thread(render_preview, path)
+                    self.previews.put(key, preview)
+            except Exception:
+                # Unreadable or odd files are not previewed: PIL raises, besides
+                # OSError, e.g. DecompressionBombError or ValueError.
+                preview = None
+
+        if preview is None:
             self.pixels = None
+        else:
+            width, height, self.pixels = preview
+            self.set_styles(
+                f"""
+                width: {width * 2};
+                height: {height};
+                padding:1;
+                """
+            )
+        self.refresh()
 
     def render(self):
         if self.pixels:
@@ -54,8 +165,166 @@ class Image(Widget):
         return ""
 
 
-class ImageDirectoryTree(DirectoryTree):
-    def filter_paths(self, paths: Iterable[Path]) -> Iterable[Path]:
-        return [
-            path for path in paths if path.suffix in IMAGE_EXTENSIONS or path.is_dir()
-        ]
+class ImageDirectoryTree(Tree[ImageEntry]):
+    """
+    A tree of the directories and images under `path`.
+
+    Directories are listed by a thread with `os.scandir`, whose entries know
+    whether they are directories without a `stat` per file, and filtered by
+    extension as they are read. Entries are added to the tree, in order, a
+    batch at a time as they are read, so that huge directories show up right
+    away without blocking the app. At most MAX_DIRECTORY_ENTRIES of a
+    directory are listed.
+    """
+
+    COMPONENT_CLASSES = {"image-directory-tree--folder"}
+
+    DEFAULT_CSS = """
+    ImageDirectoryTree > .image-directory-tree--folder {
+        text-style: bold;
+    }
+    """
+
+    path: var[Path] = var(Path("."), init=False, always_update=True)
+
+    class FileSelected(Message):
+        """Posted when an image is selected."""
+
+        def __init__(self, node: TreeNode[ImageEntry], path: Path) -> None:
+            self.node = node
+            self.path = path
+            super().__init__()
+
+        @property
+        def control(self) -> Tree[ImageEntry]:
+            return self.node.tree
+
+    def __init__(
+        self,
+        path: str | Path,
+        *,
+        name: str | None = None,
+        id: str | None = None,
+        classes: str | None = None,
+        disabled: bool = False,
+    ) -> None:
+        super().__init__(
+            str(path),
+            data=ImageEntry(Path(path), is_dir=True),
+            name=name,
+            id=id,
+            classes=classes,
+            disabled=disabled,
+        )
+        self.path = Path(path)
+
+    def validate_path(self, path: str | Path) -> Path:
+        return Path(path)
+
+    async def watch_path(self, path: Path) -> None:
+        self.workers.cancel_group(self, "scan")
+        self.reset(str(path), ImageEntry(path, is_dir=True))
+        self.load(self.root)
+
+    def load(self, node: TreeNode[ImageEntry]) -> None:
+        """List the directory of `node` in the background, once."""
+        entry = node.data
+        if entry is None or not entry.is_dir or entry.loaded:
+            return
+        entry.loaded = True
+        node.expand()
+        self.run_worker(
+            partial(self.scan, node), group="scan", thread=True, exit_on_error=False
+        )
+
+    def scan(self, node: TreeNode[ImageEntry]) -> None:
+        worker = get_current_worker()
+        location = node.data.path  # type: ignore
+        batch: list[ImageEntry] = []
+        size = DIRECTORY_BATCH_SIZE
+        count = 0
+        try:
+            with os.scandir(location) as entries:
+                for entry in entries:
+                    if worker.is_cancelled:
+                        return
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    path = location / entry.name
+                    if not is_dir and path.suffix.lower() not in image_extensions():
+                        continue
+                    if count == MAX_DIRECTORY_ENTRIES:
+                        self.app.call_from_thread(
+                            self.notify,
+                            f"Only {MAX_DIRECTORY_ENTRIES} entries of {location} "
+                            "are listed.",
+                        )
+                        break
+                    count += 1
+                    batch.append(ImageEntry(path, is_dir))
+                    if len(batch) == size:
+                        self.app.call_from_thread(self.add_entries, node, batch)
+                        # The whole tree is laid out again after each batch,
+                        # so batches grow with it. Let the app handle input
+                        # and refresh in between.
+                        batch, size = [], min(size * 2, MAX_DIRECTORY_BATCH_SIZE)
+                        time.sleep(DIRECTORY_BATCH_INTERVAL)
+        except OSError:
+            pass
+        if batch and not worker.is_cancelled:
+            self.app.call_from_thread(self.add_entries, node, batch)
+
+    def add_entries(
+        self, node: TreeNode[ImageEntry], entries: list[ImageEntry]
+    ) -> None:
+        """Add `entries` to the directory of `node`, directories first."""
+        top = node
+        while top.parent is not None:
+            top = top.parent
+        if top is not self.root:
+            # Reset, e.g. by changing the root of the tree.
+            return
+        keys = node.data.keys  # type: ignore
+        for entry in entries:
+            key = (not entry.is_dir, entry.path.name.lower())
+            index = bisect_right(keys, key)
+            keys.insert(index, key)
+            node.add(
+                entry.path.name, data=entry, before=index, allow_expand=entry.is_dir
+            )
+
+    @on(Tree.NodeExpanded)
+    def on_node_expanded(self, event: Tree.NodeExpanded[ImageEntry]) -> None:
+        event.stop()
+        self.load(event.node)
+
+    @on(Tree.NodeSelected)
+    def on_node_selected(self, event: Tree.NodeSelected[ImageEntry]) -> None:
+        entry = event.node.data
+        if entry is not None and not entry.is_dir:
+            self.post_message(self.FileSelected(event.node, entry.path))
+
+    def render_label(
+        self, node: TreeNode[ImageEntry], base_style: Style, style: Style
+    ) -> Text:
+        label = node.label.copy()
+        label.stylize(style)
+        if node.data is not None and node.data.is_dir:
+            icon = "📂 " if node.is_expanded else "📁 "
+            if self.is_mounted:
+                label.stylize_before(
+                    self.get_component_rich_style(
+                        "image-directory-tree--folder", partial=True
+                    )
+                )
+        else:
+            icon = "📄 "
+        return Text.assemble((icon, base_style), label)
+
+    def get_label_width(self, node: TreeNode[ImageEntry]) -> int:
+        # Rendering every label, as the default does, dominates rebuilding
+        # the tree when it has thousands of nodes. All icons have the width
+        # of the icon of files.
+        return LABEL_ICON_WIDTH + node.label.cell_len
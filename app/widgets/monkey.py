@@ -1,4 +1,3 @@
-import pyperclip
 import textual.widgets._markdown as markdown
 from textual import on
 from textual.events import Click
@@ -8,6 +7,8 @@ class MarkdownFence(markdown.MarkdownFence):
     @on(Click)
     async def on_click(self, event: Click) -> None:
         event.stop()
+        import pyperclip
+
         try:
             pyperclip.copy(self.code)
         except pyperclip.PyperclipException:
@@ -11,7 +11,6 @@ from textual.reactive import reactive
 from textual.widget import Widget
 from textual.widgets import Button, Input
 
-from oterm.app.image_browser import ImageSelect
 from oterm.app.widgets.image import ImageAdded
 from oterm.app.widgets.text_area import TextArea
 
@@ -108,10 +107,8 @@ class FlexibleInput(Widget):
         self.text = text
 
     def on_mount(self) -> None:
-        input = self.query_one("#promptInput", PastableInput)
         textarea = self.query_one("#promptArea", TextArea)
         textarea.show_line_numbers = False
-        input.focus()
 
     def clear(self) -> None:
         self.text = ""
@@ -163,11 +160,14 @@ class FlexibleInput(Widget):
             pass
 
     def action_add_image(self) -> None:
+        # The image browser, along with PIL, is only imported when opened.
+        from oterm.app.image_browser import ImageSelect
+
         async def on_image_selected(image) -> None:
             if image is None:
                 return
-            path, b64 = image
-            self.post_message(ImageAdded(path, b64))
+            path, digest = image
+            self.post_message(ImageAdded(path, digest))
 
         screen = ImageSelect()
         self.app.push_screen(screen, on_image_selected)
@@ -63,7 +63,7 @@ fi
 
 # Update oterm package in the Python site-packages directory
 oterm_path="$site_packages_path/oterm"
-dist_info_path="$site_packages_path/oterm-0.4.0.dist-info"
+dist_info_path="$site_packages_path/oterm-0.5.0.dist-info"
 
 if [ -d "$oterm_path" ]; then
     rm -rf "$oterm_path"
@@ -76,8 +76,8 @@ else
     exit 1
 fi
 
-if [ -d ".oterm-0.4.0.dist-info" ]; then
-    cp -r .oterm-0.4.0.dist-info "$dist_info_path"
+if [ -d ".oterm-0.5.0.dist-info" ]; then
+    cp -r .oterm-0.5.0.dist-info "$dist_info_path"
 else
     echo "Error: oterm dist-info not found."
     exit 1
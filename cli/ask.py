@@ -0,0 +1,223 @@
+import asyncio
+import json
+import sys
+import time
+from contextlib import aclosing
+from dataclasses import asdict, dataclass
+from typing import Any, Optional, TextIO
+
+from ollama import Message
+
+from oterm.enums import Author
+from oterm.ollamaclient import OllamaLLM, ResponseMetrics, StreamChunk, close_clients
+from oterm.store.store import Store, StreamingMessage
+
+# Prompts of a batch being answered at the same time, by default.
+BATCH_CONCURRENCY = 4
+
+
+class AskError(Exception):
+    """A prompt that could not be answered."""
+
+
+@dataclass
+class BatchSummary:
+    prompts: int = 0
+    failed: int = 0
+    cached: int = 0
+    eval_count: int = 0
+    wall_time: float = 0.0
+
+    def __str__(self) -> str:
+        rate = self.prompts / self.wall_time if self.wall_time else 0.0
+        tokens = self.eval_count / self.wall_time if self.wall_time else 0.0
+        return (
+            f"{self.prompts} prompts, {self.failed} failed, {self.cached} cached "
+            f"in {self.wall_time:.1f}s ({rate:.1f} prompts/s, {tokens:.1f} tok/s)"
+        )
+
+
+async def answer(
+    llm: OllamaLLM, prompt: str, out: Optional[TextIO] = None
+) -> StreamChunk:
+    """
+    Stream the reply of `llm` to `prompt`, writing each delta to `out` as it
+    arrives, and return the final chunk.
+    """
+    async with aclosing(llm.stream_deltas(prompt)) as chunks:
+        async for chunk in chunks:
+            if chunk.done:
+                return chunk
+            if out is not None:
+                out.write(chunk.delta)
+                out.flush()
+    raise AskError(f"No response from {llm.model}")
+
+
+async def load_chat(store: Store, chat_id: int) -> OllamaLLM:
+    """An `OllamaLLM` continuing the stored chat `chat_id`."""
+    chat = await store.get_chat(chat_id)
+    if chat is None:
+        raise AskError(f"No chat with id {chat_id}")
+    _, _, model, system, format, parameters, keep_alive = chat
+    history: list[Message] = []
+    for author, text, images in await store.get_history(chat_id):
+        message: Message = {
+            "role": "user" if author == Author.USER else "assistant",
+            "content": text,
+        }
+        if images:
+            message["images"] = images
+        history.append(message)
+    return OllamaLLM(
+        model=model,
+        system=system,
+        format=format,
+        options=parameters,
+        keep_alive=keep_alive,
+        history=history,
+    )
+
+
+async def ask(
+    prompt: str,
+    model: Optional[str] = None,
+    chat_id: Optional[int] = None,
+    out: TextIO = sys.stdout,
+) -> StreamChunk:
+    """
+    Answer `prompt`, streaming the reply to `out`. With `chat_id`, the stored
+    chat is continued and the prompt and its reply are appended to it.
+    """
+    if chat_id is None:
+        if model is None:
+            raise AskError("A model or a chat id is required")
+        return await answer(OllamaLLM(model=model), prompt, out)
+
+    store = await Store.create()
+    try:
+        llm = await load_chat(store, chat_id)
+        if model is not None:
+            llm.model = model
+        user_id = await store.save_message(chat_id, Author.USER.value, prompt)
+        reply = StreamingMessage(store, chat_id, Author.OLLAMA.value)
+        await reply.start()
+        try:
+            async with aclosing(llm.stream_deltas(prompt)) as chunks:
+                async for chunk in chunks:
+                    if chunk.done:
+                        metrics = chunk.metrics
+                        await reply.finish(
+                            chunk.text, metrics=metrics.to_json() if metrics else None
+                        )
+                        return chunk
+                    out.write(chunk.delta)
+                    out.flush()
+                    reply.append(chunk.delta)
+            raise AskError(f"No response from {llm.model}")
+        except BaseException:
+            # As in the app: a partial reply is kept, otherwise the prompt is
+            # taken back.
+            if reply.text:
+                await reply.finish(status="aborted")
+            else:
+                await reply.discard()
+                await store.delete_message(user_id)
+            raise
+    finally:
+        await store.close()
+
+
+async def answer_request(
+    request: dict[str, Any], model: Optional[str]
+) -> tuple[dict[str, Any], Optional[ResponseMetrics]]:
+    """Answer one line of a batch, returning its result and metrics."""
+    result: dict[str, Any] = {"id": request.get("id"), "model": None}
+    metrics = None
+    try:
+        prompt = request.get("prompt")
+        result["model"] = request.get("model") or model
+        if not isinstance(prompt, str):
+            raise AskError("A prompt is required")
+        if result["model"] is None:
+            raise AskError("A model is required")
+        llm = OllamaLLM(
+            model=result["model"],
+            system=request.get("system"),
+            format=request.get("format", ""),
+            **({"options": request["options"]} if "options" in request else {}),
+        )
+        chunk = await answer(llm, prompt)
+        metrics = chunk.metrics
+        result["response"] = chunk.text
+        result["metrics"] = asdict(metrics) if metrics else None
+    except Exception as e:
+        result["error"] = str(e)
+    return result, metrics
+
+
+async def ask_batch(
+    lines: TextIO,
+    out: TextIO = sys.stdout,
+    model: Optional[str] = None,
+    concurrency: int = BATCH_CONCURRENCY,
+) -> BatchSummary:
+    """
+    Answer the prompts of a JSONL stream, `concurrency` at a time, writing a
+    JSONL result per prompt to `out` as soon as it is answered.
+
+    Each line is an object with a `prompt` and optionally an `id`, `model`,
+    `system`, `format` and `options`. Results have the `line` number and
+    `id` of their prompt, the `model`, and either the `response` and its
+    `metrics` or an `error`.
+    """
+    summary = BatchSummary()
+    # Bounded, so that lines are only read as fast as they are answered.
+    queue: asyncio.Queue[tuple[int, str] | None] = asyncio.Queue(concurrency)
+    start = time.perf_counter()
+
+    async def worker() -> None:
+        while (item := await queue.get()) is not None:
+            number, line = item
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("Each line must be a JSON object")
+            except ValueError as e:
+                result: dict[str, Any] = {"error": f"Invalid line: {e}"}
+                metrics = None
+            else:
+                result, metrics = await answer_request(request, model)
+            summary.prompts += 1
+            if "error" in result:
+                summary.failed += 1
+            if metrics is not None and metrics.cached:
+                summary.cached += 1
+            elif metrics is not None:
+                summary.eval_count += metrics.eval_count
+            out.write(json.dumps({"line": number, **result}) + "\n")
+            out.flush()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        number = 0
+        # Read in a thread, so that a slow pipe does not block the loop.
+        while line := await asyncio.to_thread(lines.readline):
+            number += 1
+            if line.strip():
+                await queue.put((number, line))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    summary.wall_time = time.perf_counter() - start
+    return summary
+
+
+async def run(coroutine):
+    try:
+        return await coroutine
+    finally:
+        await close_clients()
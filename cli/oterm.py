@@ -1,20 +1,63 @@
 import asyncio
-from importlib import metadata
+import sys
+import time
+from importlib import import_module, metadata
+from pathlib import Path
+from typing import Optional
+
 import typer
 
-from oterm.app.oterm import app
 from oterm.config import envConfig
-from oterm.store.store import Store
 
 cli = typer.Typer()
 
+# Imported one after the other by --profile-startup, each timed on its own.
+PROFILED_IMPORTS = ["textual.app", "ollama", "aiosqlite", "oterm.app.oterm"]
+
+
 async def upgrade_db():
-    await Store.create()
+    from oterm.store.store import Store
+
+    store = await Store.create()
+    await store.close()
 
 async def handle_upgrade():
     await upgrade_db()
 
-def oterm_sync(version: bool, upgrade: bool, sqlite: bool):
+def profile_startup() -> list[tuple[str, float]]:
+    """
+    Launch the app, time its imports, until it is mounted and until its first
+    paint, then exit. Returns the milliseconds each step took.
+    """
+    timings: list[tuple[str, float]] = []
+    start = last = time.perf_counter()
+
+    def mark(step: str) -> None:
+        nonlocal last
+        now = time.perf_counter()
+        timings.append((step, (now - last) * 1000))
+        last = now
+
+    for module in PROFILED_IMPORTS:
+        import_module(module)
+        mark(f"import {module}")
+
+    from oterm.app.oterm import OTerm
+
+    async def auto_pilot(pilot) -> None:
+        # Called once the app, and so the store and the tabs, are mounted.
+        mark("mount")
+        painted = asyncio.Event()
+        pilot.app.call_after_refresh(painted.set)
+        await painted.wait()
+        mark("first paint")
+        pilot.app.exit()
+
+    OTerm().run(auto_pilot=auto_pilot)
+    timings.append(("total", (last - start) * 1000))
+    return timings
+
+def oterm_sync(version: bool, upgrade: bool, sqlite: bool, profile: bool):
     if version:
         typer.echo(f"oterm v{metadata.version('oterm')}")
     elif upgrade:
@@ -22,16 +65,84 @@ def oterm_sync(version: bool, upgrade: bool, sqlite: bool):
         asyncio.run(handle_upgrade())
     elif sqlite:
         typer.echo(envConfig.OTERM_DATA_DIR / "store.db")
+    elif profile:
+        for step, elapsed in profile_startup():
+            typer.echo(f"{step:<28}{elapsed:>10.1f} ms")
     else:
-        app.run()
+        # The UI, and everything it depends on, is only imported to run it.
+        from oterm.app.oterm import OTerm
 
-@cli.command()
+        OTerm().run()
+
+# The flags spell out their flag_value, which newer click releases otherwise
+# leave unset for typer's bool options.
+@cli.callback(invoke_without_command=True)
 def oterm(
-    version: bool = typer.Option(None, "--version", "-v"),
-    upgrade: bool = typer.Option(None, "--upgrade"),
-    sqlite: bool = typer.Option(None, "--db"),
+    ctx: typer.Context,
+    version: bool = typer.Option(False, "--version", "-v", flag_value=True),
+    upgrade: bool = typer.Option(False, "--upgrade", flag_value=True),
+    sqlite: bool = typer.Option(False, "--db", flag_value=True),
+    profile: bool = typer.Option(
+        False,
+        "--profile-startup",
+        flag_value=True,
+        help="Report import, mount and first paint timings, then exit.",
+    ),
+):
+    if ctx.invoked_subcommand is None:
+        oterm_sync(version, upgrade, sqlite, profile)
+
+@cli.command()
+def ask(
+    prompt: Optional[list[str]] = typer.Argument(
+        None, help="The prompt, followed by anything piped to stdin."
+    ),
+    model: Optional[str] = typer.Option(None, "--model", "-m"),
+    chat: Optional[int] = typer.Option(
+        None, "--chat", "-c", help="Continue, and append to, a stored chat."
+    ),
+    batch: Optional[Path] = typer.Option(
+        None,
+        "--batch",
+        "-b",
+        help="Answer the prompts of a JSONL file, '-' for stdin.",
+    ),
+    output: Optional[Path] = typer.Option(
+        None, "--output", "-o", help="Write the JSONL results of --batch here."
+    ),
+    concurrency: int = typer.Option(
+        4, "--concurrency", "-j", min=1, help="Prompts of --batch answered at once."
+    ),
 ):
-    oterm_sync(version, upgrade, sqlite)
+    """Answer a prompt, or a batch of prompts, without the UI."""
+    # Only the client and the store are imported, not Textual.
+    from oterm.cli.ask import AskError, ask_batch, run
+    from oterm.cli.ask import ask as ask_prompt
+    from oterm.ollamaclient import OllamaError
+
+    if batch is not None:
+        lines = sys.stdin if str(batch) == "-" else batch.open()
+        out = sys.stdout if output is None else output.open("w")
+        try:
+            summary = asyncio.run(run(ask_batch(lines, out, model, concurrency)))
+        finally:
+            for f in (lines, out):
+                if f not in (sys.stdin, sys.stdout):
+                    f.close()
+        typer.echo(summary, err=True)
+        raise typer.Exit(1 if summary.failed else 0)
+
+    text = " ".join(prompt or [])
+    if not sys.stdin.isatty():
+        text = "\n\n".join(part for part in (text, sys.stdin.read()) if part)
+    if not text.strip():
+        raise typer.BadParameter("A prompt is required, as arguments or on stdin.")
+    try:
+        asyncio.run(run(ask_prompt(text, model, chat)))
+    except (AskError, OllamaError) as e:
+        typer.echo(f"Error: {e}", err=True)
+        raise typer.Exit(1)
+    typer.echo()
 
 if __name__ == "__main__":
     cli()
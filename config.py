@@ -28,8 +28,28 @@ class EnvConfig:
     ENV: str = "development"
     OLLAMA_HOST: str = "0.0.0.0:11434"
     OLLAMA_URL: str = ""
+    # Several Ollama hosts to route requests to, as a JSON list of URLs.
+    OLLAMA_URLS: list[str] = []
+    OTERM_HEALTH_CHECK_INTERVAL: float = 10.0
     OTERM_VERIFY_SSL: bool = True
     OTERM_DATA_DIR: Path = get_default_data_dir()
+    OTERM_MAX_CONNECTIONS: int = 20
+    OTERM_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    OTERM_KEEPALIVE_EXPIRY: float = 30.0
+    OTERM_CONNECT_TIMEOUT: float = 10.0
+    OTERM_FIRST_TOKEN_TIMEOUT: float = 300.0
+    OTERM_TOKEN_TIMEOUT: float = 60.0
+    OTERM_RETRIES: int = 2
+    OTERM_RETRY_BACKOFF: float = 0.5
+    OTERM_CONTEXT_BUDGET: float = 0.75
+    OTERM_SUMMARIZE_CONTEXT: bool = False
+    OTERM_IMAGE_MAX_EDGE: int = 1024
+    OTERM_IMAGE_MAX_BYTES: int = 500_000
+    OTERM_MAX_INFERENCES_PER_MODEL: int = 2
+    OTERM_MAX_INFERENCES_PER_BACKEND: int = 4
+    OTERM_RESPONSE_CACHE: bool = False
+    OTERM_RESPONSE_CACHE_MAX_BYTES: int = 50_000_000
+    OTERM_RESPONSE_CACHE_TTL: float = 604_800.0
 
     def __init__(self, env: dict[str, str]):
         for field, var_type in get_type_hints(EnvConfig).items():
@@ -70,33 +90,44 @@ class AppConfig:
     """Class to manage application configuration."""
 
     def __init__(self, path: Optional[Path] = None):
-        self._path = path or envConfig.OTERM_DATA_DIR / "config.json"
-        self._data = {"theme": "dark"}
-        self._load_config()
+        self._path = path
+        self._data: Optional[dict[str, Any]] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path or envConfig.OTERM_DATA_DIR / "config.json"
+
+    @property
+    def data(self) -> dict[str, Any]:
+        """The configuration, loaded from its file on first use."""
+        if self._data is None:
+            self._data = {"theme": "dark"}
+            self._load_config()
+        return self._data
 
     def _load_config(self):
         """Load configuration from a file, or initialize if not present."""
-        if self._path.exists():
-            with self._path.open("r") as f:
+        if self.path.exists():
+            with self.path.open("r") as f:
                 saved = json.load(f)
-                self._data.update(saved)
+                self.data.update(saved)
         else:
-            self._path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
             self.save()
 
     def set(self, key: str, value: Any):
         """Set a configuration value and save it."""
-        self._data[key] = value
+        self.data[key] = value
         self.save()
 
     def get(self, key: str) -> Optional[Any]:
         """Get a configuration value."""
-        return self._data.get(key)
+        return self.data.get(key)
 
     def save(self):
         """Save the configuration to a file."""
-        with self._path.open("w") as f:
-            json.dump(self._data, f, indent=4)
+        with self.path.open("w") as f:
+            json.dump(self.data, f, indent=4)
 
-# Expose AppConfig object for app to import
+# Expose AppConfig object for app to import, read on first use
 appConfig = AppConfig()
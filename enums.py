@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class Author(Enum):
+    USER = "me"
+    OLLAMA = "ollama"
@@ -0,0 +1,128 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+from oterm.config import envConfig
+from oterm.store.images import ImageStore, imageStore
+
+# JPEG qualities tried, by bisection, to fit the byte budget.
+MIN_QUALITY = 40
+MAX_QUALITY = 90
+# How much smaller an image is made when even MIN_QUALITY is too large.
+DOWNSCALE = 0.75
+# Number of prepared images remembered by path, mtime and size.
+CACHE_SIZE = 256
+
+
+def to_rgb(image: Image.Image) -> Image.Image:
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        # Transparent areas are rendered on white rather than black.
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def encode(path: Path, max_edge: int, max_bytes: int) -> bytes:
+    """
+    Decode the image at `path` and encode it as a JPEG whose longest edge is
+    at most `max_edge` pixels, in the best quality that fits `max_bytes`.
+    """
+    with Image.open(path) as image:
+        # JPEGs are decoded directly at a reduced scale when possible, which
+        # is much faster than decoding all the pixels of a large photo.
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        image = to_rgb(image)
+
+    while True:
+        low, high = MIN_QUALITY, MAX_QUALITY
+        best = None
+        while low <= high:
+            quality = (low + high) // 2
+            data = jpeg(image, quality)
+            if len(data) <= max_bytes:
+                best = data
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is not None:
+            return best
+        if max(image.size) <= 64:
+            return jpeg(image, MIN_QUALITY)
+        width, height = image.size
+        image = image.resize(
+            (max(int(width * DOWNSCALE), 1), max(int(height * DOWNSCALE), 1)),
+            Image.Resampling.LANCZOS,
+        )
+
+
+class ImagePipeline(object):
+    """
+    Prepares images to attach to messages: decodes, resizes and encodes them
+    in a thread pool, off the event loop, and saves them to the `ImageStore`.
+
+    The digest of each prepared image is remembered by path, modification
+    time and size, so attaching an unchanged image again is immediate.
+    """
+
+    def __init__(
+        self,
+        max_edge: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        store: Optional[ImageStore] = None,
+        executor: Optional[Executor] = None,
+    ):
+        self.max_edge = max_edge or envConfig.OTERM_IMAGE_MAX_EDGE
+        self.max_bytes = max_bytes or envConfig.OTERM_IMAGE_MAX_BYTES
+        self.store = store or imageStore
+        self._executor = executor
+        self.cache: OrderedDict[tuple[str, int, int], str] = OrderedDict()
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="oterm-image"
+            )
+        return self._executor
+
+    def key(self, path: Path) -> tuple[str, int, int]:
+        stat = path.stat()
+        return (str(path.resolve()), stat.st_mtime_ns, stat.st_size)
+
+    def _prepare(self, path: Path) -> str:
+        return self.store.put(encode(path, self.max_edge, self.max_bytes))
+
+    async def prepare(self, path: Path) -> str:
+        """Prepare the image at `path`, returning its digest in the store."""
+        key = self.key(path)
+        digest = self.cache.get(key)
+        if digest is not None and self.store.contains(digest):
+            self.cache.move_to_end(key)
+            return digest
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(self.executor, self._prepare, path)
+        self.cache[key] = digest
+        while len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return digest
+
+
+# Expose the ImagePipeline object for the app to import
+imagePipeline = ImagePipeline()
@@ -0,0 +1,124 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterable, Mapping, Optional
+
+from ollama import AsyncClient
+
+from oterm.config import envConfig
+from oterm.ollamaclient import backendPool, get_client
+
+# Large fields of `show` responses that oterm does not use.
+EXCLUDED_INFO_KEYS = ("modelfile", "license")
+
+
+class ModelCatalog:
+    """
+    The installed models and their details (`ollama show`).
+
+    Details are fetched concurrently, at most `concurrency` at a time, and
+    cached in memory and in `models.json` under OTERM_DATA_DIR. Entries are
+    keyed by model name and are invalidated when the model's digest changes.
+    """
+
+    def __init__(self, path: Optional[Path] = None, concurrency: int = 4):
+        self._path = path
+        self.concurrency = concurrency
+        self.cache: dict[str, dict[str, Any]] = {}
+        self._loaded = False
+
+    @property
+    def path(self) -> Path:
+        return self._path or envConfig.OTERM_DATA_DIR / "models.json"
+
+    @staticmethod
+    def client() -> AsyncClient:
+        return get_client()
+
+    def load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with self.path.open("r") as f:
+                self.cache.update(json.load(f))
+        except (OSError, ValueError):
+            # Missing or corrupt, it is rebuilt on the next save.
+            pass
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("w") as f:
+            json.dump(self.cache, f)
+
+    def cached(self, model: Mapping[str, Any]) -> Optional[dict[str, Any]]:
+        entry = self.cache.get(model["name"])
+        if entry is not None and entry["digest"] == model.get("digest"):
+            return entry["info"]
+        return None
+
+    def client_for(self, model: Mapping[str, Any]) -> AsyncClient:
+        """The client of a backend that has the model."""
+        if len(backendPool.urls) > 1:
+            return get_client(backendPool.candidates(model["name"])[0].url)
+        return self.client()
+
+    async def list(self) -> list[dict[str, Any]]:
+        if len(backendPool.urls) > 1:
+            # The models of every backend, from their health checks.
+            await backendPool.refresh()
+            return [dict(model) for model in backendPool.models()]
+        response = await self.client().list()
+        return response["models"]
+
+    async def show(
+        self, client: AsyncClient, model: Mapping[str, Any]
+    ) -> dict[str, Any]:
+        info = dict(await client.show(model["name"]))
+        for key in EXCLUDED_INFO_KEYS:
+            info.pop(key, None)
+        self.cache[model["name"]] = {"digest": model.get("digest"), "info": info}
+        return info
+
+    async def infos(
+        self, models: Iterable[Mapping[str, Any]]
+    ) -> AsyncIterator[tuple[Mapping[str, Any], dict[str, Any]]]:
+        """
+        Yield `(model, info)` for each model: cached ones first, then the
+        others as their details arrive.
+        """
+        self.load()
+        models = list(models)
+        names = {model["name"] for model in models}
+        stale = [name for name in self.cache if name not in names]
+        for name in stale:
+            del self.cache[name]
+
+        missing = []
+        for model in models:
+            info = self.cached(model)
+            if info is None:
+                missing.append(model)
+            else:
+                yield model, info
+
+        if not missing and not stale:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(model: Mapping[str, Any]):
+            async with semaphore:
+                return model, await self.show(self.client_for(model), model)
+
+        tasks = [asyncio.create_task(fetch(model)) for model in missing]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.save()
+
+
+# Expose the ModelCatalog object for the app to import
+modelCatalog = ModelCatalog()
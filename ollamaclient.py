@@ -1,10 +1,692 @@
 import asyncio
+import json
+import logging
+import re
+import sys
+import time
 from ast import literal_eval
-from typing import Any, AsyncGenerator, AsyncIterator, Literal, Mapping, Optional
+from contextlib import aclosing, contextmanager
+from dataclasses import asdict, dataclass, field
+from hashlib import sha256
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Iterator,
+    Literal,
+    Mapping,
+    Optional,
+)
 
-from ollama import AsyncClient, Client, Message, Options
+import aiosqlite
+import httpx
+from ollama import AsyncClient, Client, Message, Options, ResponseError
 
 from oterm.config import envConfig
+from oterm.store.images import imageStore
+from oterm.store.responses import queries as response_queries
+
+if sys.version_info >= (3, 11):
+    from asyncio import timeout
+else:
+    from async_timeout import timeout
+
+# Shared clients by (host, verify), along with the event loop they belong to.
+_clients: dict[
+    tuple[str, bool], tuple[Optional[asyncio.AbstractEventLoop], AsyncClient]
+] = {}
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def get_client(
+    host: Optional[str] = None, verify: Optional[bool] = None
+) -> AsyncClient:
+    """
+    The process-wide `AsyncClient` for `host` (OLLAMA_URL by default), so
+    that all chats share one pool of keep-alive connections.
+    """
+    key = (
+        host or envConfig.OLLAMA_URL,
+        envConfig.OTERM_VERIFY_SSL if verify is None else verify,
+    )
+    loop = _running_loop()
+    entry = _clients.get(key)
+    # Connections cannot be carried over to another event loop.
+    if entry is not None and entry[0] in (loop, None):
+        if entry[0] is None and loop is not None:
+            _clients[key] = (loop, entry[1])
+        return entry[1]
+
+    client = AsyncClient(
+        host=key[0],
+        verify=key[1],
+        # Replies are timed out per token by OllamaLLM, not per read.
+        timeout=httpx.Timeout(None, connect=envConfig.OTERM_CONNECT_TIMEOUT or None),
+        limits=httpx.Limits(
+            max_connections=envConfig.OTERM_MAX_CONNECTIONS,
+            max_keepalive_connections=envConfig.OTERM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=envConfig.OTERM_KEEPALIVE_EXPIRY,
+        ),
+    )
+    _clients[key] = (loop, client)
+    return client
+
+
+async def close_clients() -> None:
+    """Close the shared clients of the running event loop, and the cache."""
+    loop = _running_loop()
+    for key, (client_loop, client) in list(_clients.items()):
+        if client_loop in (loop, None):
+            del _clients[key]
+            await client._client.aclose()
+    await responseCache.close()
+
+
+# Seconds a health check waits for a backend to answer.
+HEALTH_CHECK_TIMEOUT = 5.0
+
+
+def model_name(name: str) -> str:
+    """The name of a model as listed by Ollama, with its tag."""
+    return name if ":" in name else f"{name}:latest"
+
+
+@dataclass
+class Backend:
+    """An Ollama host, as seen by its last health check and requests."""
+
+    url: str
+    healthy: bool = True
+    # Models installed (/api/tags), by name, and those loaded (/api/ps).
+    models: dict[str, Mapping[str, Any]] = field(default_factory=dict)
+    loaded: set[str] = field(default_factory=set)
+    in_flight: int = 0
+    checked_at: Optional[float] = None
+    error: Optional[str] = None
+
+    def has(self, model: str) -> Optional[bool]:
+        """Whether the model is installed, None until checked."""
+        if self.checked_at is None or not self.healthy:
+            return None
+        return model in self.models
+
+
+class BackendPool(object):
+    """
+    The Ollama hosts requests are routed to: OLLAMA_URLS, or OLLAMA_URL
+    alone. Their models are health-checked every OTERM_HEALTH_CHECK_INTERVAL
+    seconds, and each request goes to a healthy host that has the model,
+    preferably one where it is loaded, with the least requests in flight.
+
+    With a single host there is nothing to choose from, and it is never
+    checked.
+    """
+
+    def __init__(
+        self, urls: Optional[list[str]] = None, interval: Optional[float] = None
+    ) -> None:
+        self._urls = urls
+        self._interval = interval
+        self.backends: dict[str, Backend] = {}
+        self._checks: dict[str, asyncio.Task] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+    @property
+    def urls(self) -> list[str]:
+        return self._urls or envConfig.OLLAMA_URLS or [envConfig.OLLAMA_URL]
+
+    @property
+    def interval(self) -> float:
+        return self._interval or envConfig.OTERM_HEALTH_CHECK_INTERVAL
+
+    def pool(self) -> list[Backend]:
+        """The configured backends, in order."""
+        return [self.backends.setdefault(url, Backend(url)) for url in self.urls]
+
+    async def _check(self, backend: Backend) -> None:
+        client = get_client(backend.url)
+        try:
+            tags, ps = await asyncio.wait_for(
+                asyncio.gather(client.list(), client.ps()), HEALTH_CHECK_TIMEOUT
+            )
+        except Exception as e:
+            self.failed(backend, e)
+            return
+        backend.models = {model["name"]: model for model in tags["models"]}
+        backend.loaded = {model["name"] for model in ps["models"]}
+        backend.healthy = True
+        backend.error = None
+        backend.checked_at = time.monotonic()
+
+    async def check(self, backend: Backend) -> None:
+        """Health-check a backend, joining a check already in progress."""
+        task = self._checks.get(backend.url)
+        if task is None or task.done() or task.get_loop() is not _running_loop():
+            task = asyncio.create_task(self._check(backend))
+            self._checks[backend.url] = task
+        await asyncio.shield(task)
+
+    async def refresh(self, force: bool = False) -> None:
+        """Health-check the backends not checked for `interval` seconds."""
+        backends = self.pool()
+        if len(backends) < 2:
+            return
+        now = time.monotonic()
+        stale = [
+            backend
+            for backend in backends
+            if force
+            or backend.checked_at is None
+            or now - backend.checked_at > self.interval
+        ]
+        await asyncio.gather(*(self.check(backend) for backend in stale))
+
+    async def watch(self) -> None:
+        while True:
+            await self.refresh(force=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Health-check the backends periodically, in the background."""
+        if len(self.urls) > 1 and (self._watcher is None or self._watcher.done()):
+            self._watcher = asyncio.create_task(self.watch())
+
+    async def stop(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+
+    def candidates(self, model: str, prefer: Optional[str] = None) -> list[Backend]:
+        """
+        Every backend, the best to send a request for `model` to first. The
+        ones that are down or lack the model come last, to be tried anyway
+        when no other one can answer.
+        """
+        name = model_name(model)
+
+        def rank(item: tuple[int, Backend]) -> tuple:
+            index, backend = item
+            has = backend.has(name)
+            return (
+                not backend.healthy,
+                {True: 0, None: 1, False: 2}[has],
+                # Avoids waiting for the model to be loaded, and the memory
+                # it would take.
+                name not in backend.loaded,
+                backend.in_flight,
+                # Otherwise stay where the prompt of the chat is cached.
+                backend.url != prefer,
+                index,
+            )
+
+        return [backend for _, backend in sorted(enumerate(self.pool()), key=rank)]
+
+    async def route(self, model: str, prefer: Optional[str] = None) -> list[Backend]:
+        """The `candidates` for `model`, from up to date health checks."""
+        await self.refresh()
+        return self.candidates(model, prefer)
+
+    async def hosts(self, model: str, prefer: Optional[str] = None) -> list[str]:
+        """
+        The URLs of the healthy backends that may have `model`, best first,
+        or of every backend when there are none.
+        """
+        candidates = await self.route(model, prefer)
+        name = model_name(model)
+        usable = [b for b in candidates if b.healthy and b.has(name) is not False]
+        return [backend.url for backend in usable or candidates]
+
+    def models(self) -> list[Mapping[str, Any]]:
+        """The models of the healthy backends, once each."""
+        models: dict[str, Mapping[str, Any]] = {}
+        for backend in self.pool():
+            if backend.healthy:
+                for name, model in backend.models.items():
+                    models.setdefault(name, model)
+        return list(models.values())
+
+    @contextmanager
+    def request(self, backend: Backend) -> Iterator[None]:
+        backend.in_flight += 1
+        try:
+            yield
+        finally:
+            backend.in_flight -= 1
+
+    def failed(self, backend: Backend, error: Exception) -> None:
+        backend.healthy = False
+        backend.error = str(error) or type(error).__name__
+        backend.checked_at = time.monotonic()
+        logging.warning(f"Ollama backend {backend.url} is down: {backend.error}")
+
+    def succeeded(self, backend: Backend, model: str) -> None:
+        backend.healthy = True
+        backend.loaded.add(model_name(model))
+
+
+# Expose the BackendPool object for the app to import
+backendPool = BackendPool()
+
+
+class OllamaError(Exception):
+    """A request to Ollama that failed, on `host` when known."""
+
+    def __init__(self, message: str, host: Optional[str] = None) -> None:
+        super().__init__(message)
+        self.host = host
+
+
+class OllamaConnectionError(OllamaError):
+    """No backend could be reached."""
+
+
+class OllamaTimeoutError(OllamaError):
+    """The model took too long to start, or to continue, its reply."""
+
+
+class OllamaResponseError(OllamaError):
+    """The server answered with an error."""
+
+    def __init__(
+        self, message: str, host: Optional[str] = None, status_code: int = -1
+    ) -> None:
+        super().__init__(message, host)
+        self.status_code = status_code
+
+
+class OllamaStreamError(OllamaError):
+    """The reply was cut short."""
+
+
+def ollama_error(error: Exception, host: str, received: bool) -> OllamaError:
+    """The `OllamaError` for an error of a request to `host`."""
+    if isinstance(error, OllamaError):
+        return error
+    if isinstance(error, asyncio.TimeoutError):
+        token = "next" if received else "first"
+        return OllamaTimeoutError(f"Timed out waiting for the {token} token", host)
+    if isinstance(error, ResponseError):
+        return OllamaResponseError(error.error, host, error.status_code)
+    if isinstance(error.__context__, httpx.HTTPStatusError):
+        # The ollama client fails to read the body of streamed errors.
+        response = error.__context__.response
+        return OllamaResponseError(
+            f"{response.status_code} {response.reason_phrase}",
+            host,
+            response.status_code,
+        )
+    reason = str(error) or type(error).__name__
+    if isinstance(error, httpx.TransportError):
+        if received:
+            return OllamaStreamError(f"The reply was cut short: {reason}", host)
+        return OllamaConnectionError(f"Unable to reach {host}: {reason}", host)
+    return OllamaError(reason, host)
+
+
+def can_fail_over(error: OllamaError) -> bool:
+    """Whether another backend may answer a request that failed with `error`."""
+    if isinstance(error, OllamaResponseError):
+        # Missing model, or a failure of the server such as running out of memory.
+        return error.status_code == 404 or error.status_code >= 500
+    return isinstance(error, OllamaConnectionError)
+
+
+def can_retry(error: OllamaError) -> bool:
+    """Whether a request that failed with `error` everywhere may be retried."""
+    return can_fail_over(error) and getattr(error, "status_code", None) != 404
+
+
+def backoff(attempt: int) -> float:
+    """Seconds to wait before retrying a request for the `attempt`th time."""
+    return envConfig.OTERM_RETRY_BACKOFF * 2 ** (attempt - 1)
+
+
+@dataclass
+class ResponseMetrics:
+    """
+    Timings of a response: the server's statistics, durations in
+    nanoseconds, and the time to first token and wall time measured by the
+    client, in seconds. The statistics of a `cached` response are those of
+    its generation.
+    """
+
+    eval_count: int = 0
+    eval_duration: int = 0
+    prompt_eval_count: int = 0
+    prompt_eval_duration: int = 0
+    load_duration: int = 0
+    total_duration: int = 0
+    ttft: float = 0.0
+    wall_time: float = 0.0
+    cached: bool = False
+
+    @classmethod
+    def from_response(
+        cls, response: Mapping[str, Any], ttft: float, wall_time: float
+    ) -> "ResponseMetrics":
+        return cls(
+            **{
+                name: response.get(name) or 0
+                for name in cls.__dataclass_fields__
+                if name not in ("ttft", "wall_time", "cached")
+            },
+            ttft=ttft,
+            wall_time=wall_time,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Mapping[str, Any]) -> "ResponseMetrics":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @property
+    def tokens_per_second(self) -> float:
+        if not self.eval_duration:
+            return 0.0
+        return self.eval_count / (self.eval_duration / 1e9)
+
+    def __str__(self) -> str:
+        if self.cached:
+            return f"cached · TTFT {self.ttft:.2f}s"
+        return f"{self.tokens_per_second:.1f} tok/s · TTFT {self.ttft:.2f}s"
+
+
+@dataclass
+class StreamChunk:
+    """
+    A piece of a streamed response. Regular chunks only carry the `delta`
+    received from the server; the final chunk has `done` set, the whole
+    response in `text`, the server's statistics (eval_count,
+    eval_duration, ...) in `stats` and the response's `metrics`.
+    """
+
+    delta: str = ""
+    done: bool = False
+    text: str = ""
+    stats: dict[str, Any] = field(default_factory=dict)
+    metrics: Optional[ResponseMetrics] = None
+
+
+# Ollama's context size when `num_ctx` is not set.
+DEFAULT_NUM_CTX = 2048
+# Roughly what vision models (llava) spend per image.
+IMAGE_TOKENS = 576
+# Role and separators of a message.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation in a few sentences, keeping facts, "
+    "names, decisions and open questions. Reply with the summary only."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for English text with common tokenizers.
+    return len(text) // 4 + 1
+
+
+def message_tokens(message: Message) -> int:
+    return (
+        MESSAGE_OVERHEAD_TOKENS
+        + estimate_tokens(message.get("content") or "")
+        + IMAGE_TOKENS * len(message.get("images") or [])
+    )
+
+
+class ContextWindow:
+    """
+    Selects the part of a chat history sent with each request, so that the
+    prompt fits within `budget` (a fraction) of the model's `num_ctx` and the
+    rest is left for the reply.
+
+    Leading system messages and the latest message are always sent, followed
+    by as many of the most recent turns as fit. When `summarize` is set, the
+    dropped turns are condensed in the background by `OllamaLLM` and the
+    summary is sent in their place.
+    """
+
+    def __init__(self, budget: float = 0.75, summarize: bool = False):
+        self.budget = budget
+        self.summarize = summarize
+        self.summary = ""
+        # Number of messages after the system prompt covered by `summary`.
+        self.summarized = 0
+        # Number of messages after the system prompt left out of the last
+        # selection.
+        self.dropped = 0
+
+    def max_tokens(self, num_ctx: int) -> int:
+        return int(num_ctx * self.budget)
+
+    def select(self, history: list[Message], num_ctx: int) -> list[Message]:
+        head = 0
+        while head < len(history) and history[head].get("role") == "system":
+            head += 1
+        system = history[:head]
+        summary: list[Message] = []
+        if self.summary:
+            summary = [
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{self.summary}",
+                }
+            ]
+
+        available = self.max_tokens(num_ctx) - sum(
+            message_tokens(message) for message in system + summary
+        )
+        start = len(history)
+        while start > head:
+            cost = message_tokens(history[start - 1])
+            if cost > available and start < len(history):
+                break
+            available -= cost
+            start -= 1
+        # Do not open the window with a reply whose prompt was dropped.
+        while start < len(history) - 1 and history[start].get("role") != "user":
+            start += 1
+
+        self.dropped = start - head
+        if not self.dropped:
+            summary = []
+        return system + summary + history[start:]
+
+
+def tokenize(text: str) -> list[str]:
+    """Split `text` in words with their trailing spaces, to replay it."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+class ResponseCache(object):
+    """
+    Replies to deterministic requests, i.e. with a `temperature` of 0 or a
+    `seed`, saved in `responses.db` under OTERM_DATA_DIR when
+    OTERM_RESPONSE_CACHE is set. Entries are keyed by a hash of the model's
+    digest, the options, format, system prompt and messages of the request.
+    They expire after OTERM_RESPONSE_CACHE_TTL seconds, and the least
+    recently used are evicted once they take more than
+    OTERM_RESPONSE_CACHE_MAX_BYTES. `hits` and `misses` count lookups.
+    """
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self._path = path
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # The connection, shared by lookups, and the size of the entries.
+        self._connection: Optional[aiosqlite.Connection] = None
+        self._size = 0
+        self._lock = asyncio.Lock()
+        # Digests of the models listed by the first backend, by name, and
+        # when they were listed.
+        self._digests: dict[str, str] = {}
+        self._listed_at: Optional[float] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path or envConfig.OTERM_DATA_DIR / "responses.db"
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes or envConfig.OTERM_RESPONSE_CACHE_MAX_BYTES
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl or envConfig.OTERM_RESPONSE_CACHE_TTL
+
+    @staticmethod
+    def cacheable(options: Optional[Mapping[str, Any]]) -> bool:
+        options = options or {}
+        return options.get("temperature") == 0 or options.get("seed") is not None
+
+    async def digest(self, model: str) -> Optional[str]:
+        """The digest of `model`, from the health checks or `/api/tags`."""
+        name = model_name(model)
+        for backend in backendPool.pool():
+            if name in backend.models:
+                return backend.models[name].get("digest")
+        now = time.monotonic()
+        if self._listed_at is None or now - self._listed_at > backendPool.interval:
+            try:
+                tags = await get_client(backendPool.urls[0]).list()
+            except Exception:
+                return None
+            self._digests = {m["name"]: m.get("digest") for m in tags["models"]}
+            self._listed_at = now
+        return self._digests.get(name)
+
+    async def key(
+        self,
+        model: str,
+        options: Optional[Mapping[str, Any]],
+        format: str,
+        system: Optional[str],
+        messages: list[Message],
+    ) -> Optional[str]:
+        """The key of a request, None when it is not to be cached."""
+        if not envConfig.OTERM_RESPONSE_CACHE or not self.cacheable(options):
+            return None
+        digest = await self.digest(model)
+        if digest is None:
+            return None
+        request = {
+            "digest": digest,
+            "options": dict(options or {}),
+            "format": format,
+            "system": system,
+            "messages": messages,
+        }
+        # Images not yet encoded are hashed by their representation.
+        encoded = json.dumps(request, sort_keys=True, default=repr)
+        return sha256(encoded.encode()).hexdigest()
+
+    async def connect(self) -> aiosqlite.Connection:
+        """The connection to the cache, opened on first use."""
+        if self._connection is None:
+            connection = await aiosqlite.connect(self.path)
+            try:
+                await connection.execute("PRAGMA journal_mode = WAL;")
+                await response_queries.create_response_table(connection)
+                [(self._size,)] = await response_queries.get_responses_size(
+                    connection
+                )
+            except aiosqlite.Error:
+                await connection.close()
+                raise
+            self._connection = connection
+        return self._connection
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            await connection.close()
+
+    async def get(self, key: str) -> Optional[tuple[str, dict[str, Any]]]:
+        """The text and statistics of the cached reply for `key`."""
+        now = time.time()
+        row = None
+        async with self._lock:
+            try:
+                db = await self.connect()
+                rows = await response_queries.get_response(
+                    db, key=key, expired=now - self.ttl
+                )
+                if rows:
+                    [row] = rows
+                    await response_queries.touch_response(db, key=key, used=now)
+                    await db.commit()
+            except aiosqlite.Error as e:
+                # The cache is best effort, the request is sent instead.
+                logging.warning(f"Unable to read the response cache: {e}")
+                row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0], json.loads(row[1])
+
+    async def put(
+        self, key: str, model: str, text: str, stats: Mapping[str, Any]
+    ) -> None:
+        now = time.time()
+        stats_json = json.dumps(stats)
+        size = len(text.encode()) + len(stats_json)
+        async with self._lock:
+            try:
+                db = await self.connect()
+                freed = await response_queries.delete_response(db, key=key)
+                await response_queries.save_response(
+                    db,
+                    key=key,
+                    model=model,
+                    text=text,
+                    stats=stats_json,
+                    size=size,
+                    created=now,
+                    used=now,
+                )
+                self._size += size - sum(row[0] for row in freed)
+                await self.evict(db, now)
+                await db.commit()
+            except aiosqlite.Error as e:
+                logging.warning(f"Unable to write to the response cache: {e}")
+                # Reopened, and measured again, on the next lookup.
+                await self.close()
+
+    async def evict(self, db: aiosqlite.Connection, now: float) -> None:
+        """Drop the expired entries, then the least recently used."""
+        freed = await response_queries.delete_expired_responses(
+            db, expired=now - self.ttl
+        )
+        self._size -= sum(row[0] for row in freed)
+        while self._size > self.max_bytes:
+            freed = await response_queries.delete_least_recently_used_responses(
+                db, count=1
+            )
+            if not freed:
+                break
+            self._size -= sum(row[0] for row in freed)
+
+
+# Expose the ResponseCache object for the app to import
+responseCache = ResponseCache()
+
 
 class OllamaLLM:
     def __init__(
@@ -39,6 +721,7 @@ class OllamaLLM:
             use_mlock=False,       # Standard memory locking
         ),
         keep_alive: int = 5,
+        context: Optional[ContextWindow] = None,
     ):
         self.model = model
         self.system = system
@@ -46,73 +729,326 @@ class OllamaLLM:
         self.format = format
         self.keep_alive = keep_alive
         self.options = options
-        self.client = AsyncClient(
-            host=envConfig.OLLAMA_URL, verify=envConfig.OTERM_VERIFY_SSL
+        self.context = context or ContextWindow(
+            budget=envConfig.OTERM_CONTEXT_BUDGET,
+            summarize=envConfig.OTERM_SUMMARIZE_CONTEXT,
         )
+        self._summary_task: Optional[asyncio.Task] = None
+        # Metrics of the last response, and the backend that gave it.
+        self.metrics: Optional[ResponseMetrics] = None
+        self.host: Optional[str] = None
 
         if system:
             system_prompt: Message = {"role": "system", "content": system}
             self.history = [system_prompt] + self.history
 
+    @property
+    def client(self) -> AsyncClient:
+        return get_client(self.host)
+
+    async def _candidates(self, host: Optional[str]) -> list[Backend]:
+        candidates = await backendPool.route(self.model, prefer=self.host)
+        if host is not None:
+            candidates.sort(key=lambda backend: backend.url != host)
+        return candidates
+
+    async def _chat(self, host: Optional[str] = None, **kwargs) -> Mapping[str, Any]:
+        """
+        A chat request to the model, sent to `host` or else the best backend.
+        See `_stream_chat`; the whole reply must arrive within the first token
+        timeout.
+        """
+        error: Optional[OllamaError] = None
+        for attempt in range(envConfig.OTERM_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(backoff(attempt))
+            for backend in await self._candidates(host):
+                with backendPool.request(backend):
+                    try:
+                        async with timeout(envConfig.OTERM_FIRST_TOKEN_TIMEOUT or None):
+                            response = await get_client(backend.url).chat(
+                                model=self.model, **kwargs
+                            )
+                    except Exception as e:
+                        if isinstance(e, httpx.TransportError):
+                            backendPool.failed(backend, e)
+                        error = ollama_error(e, backend.url, received=False)
+                        if not can_fail_over(error):
+                            raise error from e
+                        continue
+                backendPool.succeeded(backend, self.model)
+                self.host = backend.url
+                return response
+            assert error is not None
+            if not can_retry(error):
+                break
+        assert error is not None
+        raise error
+
+    async def _stream_chat(
+        self, host: Optional[str] = None, **kwargs
+    ) -> AsyncIterator[Mapping[str, Any]]:
+        """
+        A streamed chat request to the model, sent to `host` or else the best
+        backend. Until its first chunk is received, a request that cannot be
+        answered fails over to the next backends, and then is retried after
+        a backoff, up to OTERM_RETRIES times: after that the reply cannot be
+        resumed elsewhere.
+
+        The first chunk must arrive within OTERM_FIRST_TOKEN_TIMEOUT seconds,
+        and each next one within OTERM_TOKEN_TIMEOUT. Failures are raised as
+        an `OllamaError`. Closing the generator, or cancelling the task that
+        iterates it, closes the HTTP stream so that the server stops
+        generating.
+        """
+        error: Optional[OllamaError] = None
+        for attempt in range(envConfig.OTERM_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(backoff(attempt))
+            for backend in await self._candidates(host):
+                received = False
+                with backendPool.request(backend):
+                    try:
+                        stream = await get_client(backend.url).chat(
+                            model=self.model, stream=True, **kwargs
+                        )
+                        async with aclosing(stream):  # type: ignore
+                            while True:
+                                # Each read is bounded on its own, so that a
+                                # timeout cannot outlive the read it was for.
+                                async with timeout(
+                                    (
+                                        envConfig.OTERM_TOKEN_TIMEOUT
+                                        if received
+                                        else envConfig.OTERM_FIRST_TOKEN_TIMEOUT
+                                    )
+                                    or None
+                                ):
+                                    try:
+                                        chunk = await anext(stream)
+                                    except StopAsyncIteration:
+                                        break
+                                received = True
+                                yield chunk
+                    except Exception as e:
+                        if isinstance(e, httpx.TransportError):
+                            backendPool.failed(backend, e)
+                        error = ollama_error(e, backend.url, received)
+                        if received or not can_fail_over(error):
+                            raise error from e
+                        continue
+                backendPool.succeeded(backend, self.model)
+                self.host = backend.url
+                return
+            assert error is not None
+            if not can_retry(error):
+                break
+        assert error is not None
+        raise error
+
+    def _forget(self, message: Message) -> None:
+        """Remove `message`, the prompt of a reply that failed, from the history."""
+        for index in range(len(self.history) - 1, -1, -1):
+            if self.history[index] is message:
+                del self.history[index]
+                return
+
+    async def cache_key(self, messages: list[Message]) -> Optional[str]:
+        return await responseCache.key(
+            self.model, self.options, self.format, self.system, messages
+        )
+
+    @staticmethod
+    async def _replay(
+        text: str, stats: Mapping[str, Any]
+    ) -> AsyncGenerator[Mapping[str, Any], Any]:
+        """A cached reply, in chunks shaped like those of Ollama."""
+        for token in tokenize(text):
+            yield {"message": {"role": "assistant", "content": token}, "done": False}
+        yield {**stats, "done": True}
+
+    def messages(self) -> list[Message]:
+        """The part of the history that fits the context window."""
+        num_ctx = (self.options or {}).get("num_ctx") or DEFAULT_NUM_CTX
+        messages = self.context.select(self.history, num_ctx)
+        if self.context.summarize and self.context.dropped > self.context.summarized:
+            self.summarize_dropped()
+        return [self.with_images(message) for message in messages]
+
+    @staticmethod
+    def with_images(message: Message) -> Message:
+        """
+        A copy of `message` with the images of the `ImageStore`, referred to
+        by digest in the history, read and encoded for the request.
+        """
+        images = message.get("images")
+        if not images:
+            return message
+        return {
+            **message,
+            "images": [
+                (
+                    imageStore.encode(image)
+                    if isinstance(image, str) and imageStore.contains(image)
+                    else image
+                )
+                for image in images
+            ],
+        }
+
+    def summarize_dropped(self) -> None:
+        if self._summary_task is None or self._summary_task.done():
+            self._summary_task = asyncio.create_task(self._summarize_dropped())
+
+    async def _summarize_dropped(self) -> None:
+        head = 0
+        while head < len(self.history) and self.history[head].get("role") == "system":
+            head += 1
+        upto = self.context.dropped
+        dropped = self.history[head + self.context.summarized : head + upto]
+        transcript = "\n\n".join(
+            f"{message.get('role')}: {message.get('content')}" for message in dropped
+        )
+        if self.context.summary:
+            transcript = f"system: {self.context.summary}\n\n{transcript}"
+        try:
+            response = await self._chat(
+                messages=[
+                    {"role": "user", "content": f"{SUMMARY_PROMPT}\n\n{transcript}"}
+                ],
+                keep_alive=f"{self.keep_alive}m",
+                options=self.options,
+            )
+        except Exception as e:
+            # The summary is best effort, the dropped turns are simply left out.
+            logging.warning(f"Unable to summarize the conversation: {e}")
+            return
+        summary = response.get("message", {}).get("content", "")
+        if summary:
+            self.context.summary = summary
+            self.context.summarized = upto
+
     async def completion(self, prompt: str, images: Optional[list[str]] = None) -> str:
+        """
+        The reply to `prompt`, or an `OllamaError`. The history is left as it
+        was when the reply fails.
+        """
         user_prompt: Message = {"role": "user", "content": prompt}
         if images:
             user_prompt["images"] = images
         self.history.append(user_prompt)
-        
+
+        start = time.perf_counter()
         try:
-            response = await self.client.chat(
-                model=self.model,
-                messages=self.history,
-                keep_alive=f"{self.keep_alive}m",
-                options=self.options,
-                format=self.format,
-            )
-            ollama_response = response.get("message", {}).get("content", "")
-            self.history.append({"role": "assistant", "content": ollama_response})
-            return ollama_response
-        except Exception as e:
-            print(f"Error during completion: {e}")
-            return ""
+            messages = self.messages()
+            key = await self.cache_key(messages)
+            cached = await responseCache.get(key) if key else None
+            if cached is not None:
+                text, stats = cached
+                response = {**stats, "message": {"role": "assistant", "content": text}}
+            else:
+                response = await self._chat(
+                    messages=messages,
+                    keep_alive=f"{self.keep_alive}m",
+                    options=self.options,
+                    format=self.format,
+                )
+        except BaseException:
+            self._forget(user_prompt)
+            raise
+        elapsed = time.perf_counter() - start
+        # Without streaming the first token arrives with the whole reply.
+        self.metrics = ResponseMetrics.from_response(response, elapsed, elapsed)
+        self.metrics.cached = cached is not None
+        ollama_response = response.get("message", {}).get("content", "")
+        if key and cached is None:
+            stats = {k: v for k, v in response.items() if k != "message"}
+            await responseCache.put(key, self.model, ollama_response, stats)
+        self.history.append({"role": "assistant", "content": ollama_response})
+        return ollama_response
 
     async def stream(
         self, prompt: str, images: Optional[list[str]] = None
     ) -> AsyncGenerator[str, Any]:
+        # Yields the accumulated response after every token. Prefer
+        # `stream_deltas` which does not copy the whole response each time.
+        buffer = ""
+        async with aclosing(self.stream_deltas(prompt, images, final=False)) as chunks:
+            async for chunk in chunks:
+                buffer += chunk.delta
+                yield buffer
+
+    async def stream_deltas(
+        self,
+        prompt: str,
+        images: Optional[list[str]] = None,
+        final: bool = True,
+        host: Optional[str] = None,
+    ) -> AsyncGenerator[StreamChunk, Any]:
+        """
+        Stream the reply to `prompt`, from `host` if given, e.g. by the
+        `InferenceScheduler`, or else the best backend for the model. Raises
+        an `OllamaError` when the reply fails; iterate it with `aclosing` so
+        that leaving the loop early stops the reply. Unless the reply
+        completes, the history is left as it was. Replies in the
+        `ResponseCache` are streamed from there.
+        """
         user_prompt: Message = {"role": "user", "content": prompt}
         if images:
             user_prompt["images"] = images
         self.history.append(user_prompt)
 
+        start = time.perf_counter()
+        ttft = 0.0
+        parts: list[str] = []
+        stats: dict[str, Any] = {}
         try:
-            stream: AsyncIterator[dict] = await self.client.chat(
-                model=self.model,
-                messages=self.history,
-                stream=True,
-                options=self.options,
-                keep_alive=f"{self.keep_alive}m",
-                format=self.format,
-            )
-            buffer = ""
-            async for response in stream:
-                ollama_response = response.get("message", {}).get("content", "")
-                if ollama_response:
-                    buffer += ollama_response
-                    yield buffer
-                    # Optionally, you could use asyncio.sleep(0) to yield control back to the event loop
-                    # for higher responsiveness if needed.
-                    # await asyncio.sleep(0)
-            self.history.append({"role": "assistant", "content": buffer})
-        except Exception as e:
-            print(f"Error during streaming: {e}")
+            messages = self.messages()
+            key = await self.cache_key(messages)
+            cached = await responseCache.get(key) if key else None
+            if cached is not None:
+                stream = self._replay(*cached)
+            else:
+                stream = self._stream_chat(
+                    host,
+                    messages=messages,
+                    options=self.options,
+                    keep_alive=f"{self.keep_alive}m",
+                    format=self.format,
+                )
+            async with aclosing(stream):
+                async for response in stream:
+                    delta = response.get("message", {}).get("content", "")
+                    if delta:
+                        if not parts:
+                            ttft = time.perf_counter() - start
+                        parts.append(delta)
+                        yield StreamChunk(delta=delta)
+                    if response.get("done"):
+                        stats = {k: v for k, v in response.items() if k != "message"}
+        except BaseException:
+            # Failed, cancelled or left early.
+            self._forget(user_prompt)
+            raise
+        text = "".join(parts)
+        self.history.append({"role": "assistant", "content": text})
+        self.metrics = ResponseMetrics.from_response(
+            stats, ttft, time.perf_counter() - start
+        )
+        self.metrics.cached = cached is not None
+        if key and cached is None and stats:
+            await responseCache.put(key, self.model, text, stats)
+        if final:
+            yield StreamChunk(done=True, text=text, stats=stats, metrics=self.metrics)
 
     @staticmethod
     def list() -> Mapping[str, Any]:
-        client = Client(host=envConfig.OLLAMA_URL, verify=envConfig.OTERM_VERIFY_SSL)
+        client = Client(host=backendPool.urls[0], verify=envConfig.OTERM_VERIFY_SSL)
         return client.list()
 
     @staticmethod
     def show(model: str) -> Mapping[str, Any]:
-        client = Client(host=envConfig.OLLAMA_URL, verify=envConfig.OTERM_VERIFY_SSL)
+        client = Client(host=backendPool.urls[0], verify=envConfig.OTERM_VERIFY_SSL)
         return client.show(model)
 
 def parse_ollama_parameters(parameter_text: str) -> Options:
@@ -0,0 +1,131 @@
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Callable, Hashable, Optional, Sequence
+
+from oterm.config import envConfig
+
+
+@dataclass(eq=False)
+class Ticket:
+    # The backends the request can run on, preferred first.
+    backends: Sequence[str]
+    model: str
+    owner: Optional[Hashable]
+    seq: int
+    on_position: Optional[Callable[[int], None]] = None
+    # 1-based position in the queue of its backends, 0 once running.
+    position: int = 0
+    granted: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_running_loop().create_future()
+    )
+
+    def notify(self, position: int) -> None:
+        if position != self.position:
+            self.position = position
+            if self.on_position is not None:
+                self.on_position(position)
+
+
+class InferenceScheduler(object):
+    """
+    Limits the inferences running at once, per model and per backend, across
+    every chat of the app. A request runs on the first of its backends under
+    the limits, or waits in a queue: those of the foreground chat first, then
+    in the order they were made.
+
+    The requests of a same owner, e.g. a chat, run one after the other so
+    that each reply is part of the history sent with the next one.
+    """
+
+    def __init__(
+        self, per_model: Optional[int] = None, per_backend: Optional[int] = None
+    ) -> None:
+        self.per_model = per_model or envConfig.OTERM_MAX_INFERENCES_PER_MODEL
+        self.per_backend = per_backend or envConfig.OTERM_MAX_INFERENCES_PER_BACKEND
+        self.waiting: list[Ticket] = []
+        self.running: list[Ticket] = []
+        self._foreground: Optional[Hashable] = None
+        self._seq = itertools.count()
+
+    @property
+    def foreground(self) -> Optional[Hashable]:
+        """The owner whose requests are run first."""
+        return self._foreground
+
+    @foreground.setter
+    def foreground(self, owner: Optional[Hashable]) -> None:
+        self._foreground = owner
+        self.dispatch()
+
+    def rank(self, ticket: Ticket) -> tuple[bool, int]:
+        foreground = ticket.owner is not None and ticket.owner == self._foreground
+        return (not foreground, ticket.seq)
+
+    def backend(self, ticket: Ticket) -> Optional[str]:
+        """The backend the request can run on now, if any."""
+        if any(t.owner is not None and t.owner == ticket.owner for t in self.running):
+            return None
+        for backend in ticket.backends:
+            running = [t for t in self.running if t.granted.result() == backend]
+            model = [t for t in running if t.model == ticket.model]
+            if len(running) < self.per_backend and len(model) < self.per_model:
+                return backend
+        return None
+
+    def dispatch(self) -> None:
+        """Run the waiting requests that fit the limits, and number the rest."""
+        # An owner's requests are started in order, even when a later one
+        # would fit the limits before an earlier one.
+        blocked: set[Hashable] = set()
+        queued: list[Ticket] = []
+        for ticket in sorted(self.waiting, key=self.rank):
+            if ticket.granted.cancelled():
+                # Its task is leaving the queue.
+                continue
+            backend = None if ticket.owner in blocked else self.backend(ticket)
+            if backend is not None:
+                self.waiting.remove(ticket)
+                self.running.append(ticket)
+                ticket.notify(0)
+                ticket.granted.set_result(backend)
+                continue
+            if ticket.owner is not None:
+                blocked.add(ticket.owner)
+            ahead = sum(1 for t in queued if set(t.backends) & set(ticket.backends))
+            queued.append(ticket)
+            ticket.notify(ahead + 1)
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        backends: Sequence[str],
+        model: str,
+        owner: Optional[Hashable] = None,
+        on_position: Optional[Callable[[int], None]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Wait for a request to `model` to be allowed to run on one of
+        `backends`, and hold its place there until the block exits, giving
+        the backend. `on_position` is called with the position of the
+        request in the queue whenever it changes, and with 0 once it runs.
+        Cancelling the waiting task leaves the queue.
+        """
+        ticket = Ticket(backends, model, owner, next(self._seq), on_position)
+        self.waiting.append(ticket)
+        self.dispatch()
+        try:
+            yield await ticket.granted
+        finally:
+            # Also reached when cancelled while waiting, or right after the
+            # slot was granted but before the task could use it.
+            if ticket in self.waiting:
+                self.waiting.remove(ticket)
+            if ticket in self.running:
+                self.running.remove(ticket)
+            self.dispatch()
+
+
+# Expose the InferenceScheduler object for the app to import
+inferenceScheduler = InferenceScheduler()
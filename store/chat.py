@@ -15,10 +15,54 @@ SELECT id, name, model, system, format, parameters, keep_alive FROM chat WHERE i
 -- name: delete_chat
 DELETE FROM chat WHERE id = :id;
 -- name: save_message
-INSERT INTO message(chat_id, author, text)
-VALUES(:chat_id, :author, :text);
+INSERT INTO message(chat_id, author, text, metrics, status)
+VALUES(:chat_id, :author, :text, :metrics, :status) RETURNING id;
+-- name: update_message
+UPDATE message SET text = :text, metrics = COALESCE(:metrics, metrics),
+status = COALESCE(:status, status) WHERE id = :id;
+-- name: delete_message
+DELETE FROM message WHERE id = :id;
+-- name: abort_streaming_messages
+UPDATE message SET status = 'aborted' WHERE status = 'streaming';
 -- name: get_messages
-SELECT author, text FROM message WHERE chat_id = :chat_id;
+SELECT author, text FROM message WHERE chat_id = :chat_id ORDER BY id;
+-- name: get_history
+-- Messages along with the digests of their images, comma-separated.
+SELECT author, text, (
+    SELECT group_concat(digest) FROM (
+        SELECT digest FROM message_image WHERE message_id = message.id
+        ORDER BY position
+    )
+) FROM message WHERE chat_id = :chat_id ORDER BY id;
+-- name: save_message_images*!
+INSERT INTO message_image(message_id, position, digest)
+VALUES(:message_id, :position, :digest);
+-- name: get_latest_messages
+SELECT id, author, text, metrics FROM message WHERE chat_id = :chat_id
+ORDER BY id DESC LIMIT :limit;
+-- name: get_messages_before
+SELECT id, author, text, metrics FROM message
+WHERE chat_id = :chat_id AND id < :before_id
+ORDER BY id DESC LIMIT :limit;
+-- name: get_messages_since
+SELECT id, author, text, metrics FROM message
+WHERE chat_id = :chat_id AND id >= :since_id AND id < :before_id
+ORDER BY id;
+-- name: search_messages
+-- Ranks only the latest :candidates matches, so that terms found in most
+-- messages do not require scoring every one of them.
+SELECT message.id, message.chat_id, message.author,
+snippet(message_fts, 0, :start, :end, '…', :tokens)
+FROM message_fts
+JOIN message ON message.id = message_fts.rowid
+JOIN chat ON chat.id = message.chat_id
+WHERE message_fts MATCH :query AND message_fts.rowid >= (
+    SELECT COALESCE(MIN(rowid), 0) FROM (
+        SELECT rowid FROM message_fts WHERE message_fts MATCH :query
+        ORDER BY rowid DESC LIMIT :candidates
+    )
+)
+ORDER BY rank LIMIT :limit;
 """
 
 queries = aiosql.from_str(chat_sqlite, "aiosqlite")
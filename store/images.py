@@ -0,0 +1,56 @@
+import os
+import re
+from base64 import b64encode
+from hashlib import sha256
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Optional
+
+from oterm.config import envConfig
+
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+
+class ImageStore(object):
+    """
+    Content-addressed image files under `images` in OTERM_DATA_DIR.
+
+    Images are named after the SHA-256 digest of their data, so attaching
+    the same image again stores it only once. Messages refer to images by
+    digest, and the data is only read and encoded when a request sends it.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self._path = path
+
+    @property
+    def path(self) -> Path:
+        return self._path or envConfig.OTERM_DATA_DIR / "images"
+
+    def file(self, digest: str) -> Path:
+        return self.path / digest[:2] / digest
+
+    def put(self, data: bytes) -> str:
+        digest = sha256(data).hexdigest()
+        file = self.file(digest)
+        if not file.exists():
+            file.parent.mkdir(parents=True, exist_ok=True)
+            # Written under a temporary name so that a file named after its
+            # digest is always complete.
+            with NamedTemporaryFile(dir=file.parent, delete=False) as f:
+                f.write(data)
+            os.replace(f.name, file)
+        return digest
+
+    def contains(self, digest: str) -> bool:
+        return DIGEST.fullmatch(digest) is not None and self.file(digest).exists()
+
+    def get(self, digest: str) -> bytes:
+        return self.file(digest).read_bytes()
+
+    def encode(self, digest: str) -> str:
+        return b64encode(self.get(digest)).decode("utf-8")
+
+
+# Expose the ImageStore object for the app to import
+imageStore = ImageStore()
@@ -0,0 +1,36 @@
+import aiosql
+
+responses_sqlite = """
+-- name: create_response_table#
+CREATE TABLE IF NOT EXISTS "response" (
+	"key"		TEXT PRIMARY KEY,
+	"model"		TEXT NOT NULL,
+	"text"		TEXT NOT NULL,
+	"stats"		TEXT NOT NULL,
+	"size"		INTEGER NOT NULL,
+	"created"	REAL NOT NULL,
+	"used"		REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS "response_created_idx" ON "response" ("created");
+CREATE INDEX IF NOT EXISTS "response_used_idx" ON "response" ("used");
+
+-- name: get_response
+SELECT text, stats FROM response WHERE key = :key AND created > :expired;
+-- name: touch_response
+UPDATE response SET used = :used WHERE key = :key;
+-- name: save_response
+INSERT INTO response(key, model, text, stats, size, created, used)
+VALUES(:key, :model, :text, :stats, :size, :created, :used);
+-- name: delete_response
+DELETE FROM response WHERE key = :key RETURNING size;
+-- name: get_responses_size
+SELECT COALESCE(SUM(size), 0) FROM response;
+-- name: delete_expired_responses
+DELETE FROM response WHERE created <= :expired RETURNING size;
+-- name: delete_least_recently_used_responses
+DELETE FROM response WHERE key IN (
+    SELECT key FROM response ORDER BY used LIMIT :count
+) RETURNING size;
+"""
+
+queries = aiosql.from_str(responses_sqlite, "aiosqlite")
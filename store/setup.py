@@ -15,12 +15,46 @@ CREATE TABLE IF NOT EXISTS "chat" (
 
 -- name: create_message_table
 CREATE TABLE IF NOT EXISTS "message" (
+	"id"		INTEGER,
 	"chat_id"	INTEGER NOT NULL,
 	"author"	TEXT NOT NULL,
 	"text"		TEXT NOT NULL,
+	"metrics"	TEXT,
+	"status"	TEXT NOT NULL DEFAULT 'complete',
+	PRIMARY KEY("id" AUTOINCREMENT),
 	FOREIGN KEY("chat_id") REFERENCES "chat"("id") ON DELETE CASCADE
 );
 
+-- name: create_message_index
+CREATE INDEX IF NOT EXISTS "message_chat_id_idx" ON "message" ("chat_id", "id");
+
+-- name: create_image_table#
+CREATE TABLE IF NOT EXISTS "message_image" (
+	"message_id"	INTEGER NOT NULL,
+	"position"	INTEGER NOT NULL,
+	"digest"	TEXT NOT NULL,
+	PRIMARY KEY("message_id", "position"),
+	FOREIGN KEY("message_id") REFERENCES "message"("id") ON DELETE CASCADE
+);
+CREATE TRIGGER IF NOT EXISTS "message_image_delete" AFTER DELETE ON "message" BEGIN
+	DELETE FROM message_image WHERE message_id = old.id;
+END;
+
+-- name: create_message_search#
+CREATE VIRTUAL TABLE IF NOT EXISTS "message_fts" USING fts5(
+	"text", content="message", content_rowid="id"
+);
+CREATE TRIGGER IF NOT EXISTS "message_fts_insert" AFTER INSERT ON "message" BEGIN
+	INSERT INTO message_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS "message_fts_delete" AFTER DELETE ON "message" BEGIN
+	INSERT INTO message_fts(message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS "message_fts_update" AFTER UPDATE OF "text" ON "message" BEGIN
+	INSERT INTO message_fts(message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+	INSERT INTO message_fts(rowid, text) VALUES (new.id, new.text);
+END;
+
 -- name: get_user_version
 PRAGMA user_version;
 """
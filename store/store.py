@@ -1,22 +1,75 @@
+import asyncio
 import json
+import logging
+import time
+from functools import partial
 from importlib import metadata
 from pathlib import Path
-from typing import Literal
+from typing import Any, Awaitable, Callable, Literal
 
 import aiosqlite
 from ollama import Options
 from packaging.version import parse
 
-from oterm.app.widgets.chat import Author
 from oterm.config import envConfig
+from oterm.enums import Author
 from oterm.store.chat import queries as chat_queries
 from oterm.store.setup import queries as setup_queries
 from oterm.store.upgrades import upgrades
 from oterm.utils import int_to_semantic_version, semantic_version_to_int
 
 
+# Connection-level pragmas applied once to the long-lived connection.
+# WAL lets readers proceed while a write is in flight and, combined with
+# synchronous=NORMAL, only fsyncs on checkpoints instead of every commit.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # KiB, i.e. ~16MB of page cache
+    "mmap_size": 268435456,  # 256MB
+    "temp_store": "MEMORY",
+}
+
+# Number of messages fetched per page when opening/scrolling a chat.
+MESSAGE_PAGE_SIZE = 50
+
+# A streaming reply is checkpointed at most every CHECKPOINT_INTERVAL
+# seconds, or sooner once CHECKPOINT_SIZE characters have been added.
+CHECKPOINT_INTERVAL = 1.0
+CHECKPOINT_SIZE = 4096
+
+# Search results are ranked among the SEARCH_CANDIDATES latest matches. Their
+# snippets have matches between MATCH_START and MATCH_END.
+SEARCH_LIMIT = 50
+SEARCH_CANDIDATES = 2000
+SEARCH_SNIPPET_TOKENS = 16
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+MessageStatus = Literal["complete", "streaming", "aborted"]
+
+# A queued write: a query to run on the connection, and the future of its
+# result. Flush barriers have no query.
+Write = tuple[
+    Callable[[aiosqlite.Connection], Awaitable[Any]] | None, asyncio.Future
+]
+
+
 class Store(object):
+    """
+    The SQLite store of chats and messages.
+
+    Writes are queued and executed by a background task, which commits
+    everything queued so far in a single transaction. A write returns once
+    that transaction is committed, and raises if it is rolled back. `flush`
+    waits until all previous writes are committed.
+    """
+
     db_path: Path
+    connection: aiosqlite.Connection | None = None
+    search_connection: aiosqlite.Connection | None = None
+    _writes: "asyncio.Queue[Write] | None" = None
+    _writer: asyncio.Task | None = None
 
     @classmethod
     async def create(cls) -> "Store":
@@ -25,12 +78,17 @@ class Store(object):
         data_path.mkdir(parents=True, exist_ok=True)
         self.db_path = data_path / "store.db"
 
-        if not self.db_path.exists():
+        is_new = not self.db_path.exists()
+        await self.connect()
+        if is_new:
             # Create tables and set user_version
-            async with aiosqlite.connect(self.db_path) as connection:
-                await setup_queries.create_chat_table(connection)  # type: ignore
-                await setup_queries.create_message_table(connection)  # type: ignore
-                await self.set_user_version(metadata.version("oterm"))
+            await setup_queries.create_chat_table(self.connection)  # type: ignore
+            await setup_queries.create_message_table(self.connection)  # type: ignore
+            await setup_queries.create_message_index(self.connection)  # type: ignore
+            await setup_queries.create_image_table(self.connection)  # type: ignore
+            await setup_queries.create_message_search(self.connection)  # type: ignore
+            await self.connection.commit()  # type: ignore
+            await self.set_user_version(metadata.version("oterm"))
         else:
             # Upgrade database
             current_version: str = metadata.version("oterm")
@@ -42,18 +100,96 @@ class Store(object):
                     for step in steps:
                         await step(self.db_path)
             await self.set_user_version(current_version)
+            # Replies still streaming when oterm last exited were cut short.
+            await chat_queries.abort_streaming_messages(self.connection)  # type: ignore
+            await self.connection.commit()  # type: ignore
         return self
 
+    async def connect(self) -> None:
+        if self.connection is not None:
+            return
+        self.connection = await aiosqlite.connect(self.db_path)
+        for pragma, value in PRAGMAS.items():
+            await self.connection.execute(f"PRAGMA {pragma} = {value};")
+
+    async def close(self) -> None:
+        if self.connection is None:
+            return
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        if self.search_connection is not None:
+            await self.search_connection.close()
+            self.search_connection = None
+        connection, self.connection = self.connection, None
+        await connection.commit()
+        await connection.close()
+
+    async def write(self, query: Callable[[aiosqlite.Connection], Awaitable[Any]]):
+        """Queue `query` and wait until it has been executed."""
+        if self._writes is None:
+            self._writes = asyncio.Queue()
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_batches())
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait((query, future))
+        return await future
+
+    async def flush(self) -> None:
+        """Wait until every write queued so far is committed."""
+        if self._writer is None or self._writer.done():
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait((None, future))  # type: ignore
+        await future
+
+    async def _write_batches(self) -> None:
+        writes: asyncio.Queue[Write] = self._writes  # type: ignore
+        while True:
+            batch = [await writes.get()]
+            while not writes.empty():
+                batch.append(writes.get_nowait())
+
+            # Results of the writes and barriers, given once committed.
+            results: list[tuple[asyncio.Future, Any]] = []
+            try:
+                for query, future in batch:
+                    if query is None:
+                        results.append((future, None))
+                        continue
+                    try:
+                        result = await query(self.connection)  # type: ignore
+                    except Exception as e:
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        results.append((future, result))
+                await self.connection.commit()  # type: ignore
+            except Exception as e:
+                # The batch is lost but the writer keeps going, so that its
+                # callers and later writes do not wait forever.
+                logging.error(f"Unable to commit {len(results)} writes: {e}")
+                try:
+                    await self.connection.rollback()  # type: ignore
+                except Exception:
+                    pass
+                for future, _ in results:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for future, result in results:
+                if not future.done():
+                    future.set_result(result)
+
     async def get_user_version(self) -> str:
-        async with aiosqlite.connect(self.db_path) as connection:
-            res = await setup_queries.get_user_version(connection)  # type: ignore
-            return int_to_semantic_version(res[0][0])
+        res = await setup_queries.get_user_version(self.connection)  # type: ignore
+        return int_to_semantic_version(res[0][0])
 
     async def set_user_version(self, version: str) -> None:
-        async with aiosqlite.connect(self.db_path) as connection:
-            await connection.execute(
-                f"PRAGMA user_version = {semantic_version_to_int(version)};"
-            )
+        await self.connection.execute(  # type: ignore
+            f"PRAGMA user_version = {semantic_version_to_int(version)};"
+        )
 
     async def save_chat(
         self,
@@ -65,9 +201,9 @@ class Store(object):
         parameters: str,
         keep_alive: int,
     ) -> int:
-        async with aiosqlite.connect(self.db_path) as connection:
-            res: list[tuple[int]] = await chat_queries.save_chat(  # type: ignore
-                connection,
+        res: list[tuple[int]] = await self.write(
+            partial(
+                chat_queries.save_chat,
                 id=id,
                 name=name,
                 model=model,
@@ -76,18 +212,11 @@ class Store(object):
                 parameters=parameters,
                 keep_alive=keep_alive,
             )
-
-            await connection.commit()
-            return res[0][0]
+        )
+        return res[0][0]
 
     async def rename_chat(self, id: int, name: str) -> None:
-        async with aiosqlite.connect(self.db_path) as connection:
-            await chat_queries.rename_chat(  # type: ignore
-                connection,
-                id=id,
-                name=name,
-            )
-            await connection.commit()
+        await self.write(partial(chat_queries.rename_chat, id=id, name=name))
 
     async def edit_chat(
         self,
@@ -98,9 +227,9 @@ class Store(object):
         parameters: str,
         keep_alive: int,
     ) -> None:
-        async with aiosqlite.connect(self.db_path) as connection:
-            await chat_queries.edit_chat(  # type: ignore
-                connection,
+        await self.write(
+            partial(
+                chat_queries.edit_chat,
                 id=id,
                 name=name,
                 system=system,
@@ -108,28 +237,27 @@ class Store(object):
                 parameters=parameters,
                 keep_alive=keep_alive,
             )
-            await connection.commit()
+        )
 
     async def get_chats(
         self,
     ) -> list[
         tuple[int, str, str, str | None, Literal["", "json"], Options, int]
     ]:
-        async with aiosqlite.connect(self.db_path) as connection:
-            chats = await chat_queries.get_chats(connection)  # type: ignore
-            chats = [
-                (
-                    id,
-                    name,
-                    model,
-                    system,
-                    format,
-                    json.loads(parameters),
-                    keep_alive,
-                )
-                for id, name, model, system, format, parameters, keep_alive in chats
-            ]
-            return chats
+        chats = await chat_queries.get_chats(self.connection)  # type: ignore
+        chats = [
+            (
+                id,
+                name,
+                model,
+                system,
+                format,
+                json.loads(parameters),
+                keep_alive,
+            )
+            for id, name, model, system, format, parameters, keep_alive in chats
+        ]
+        return chats
 
     async def get_chat(
         self, id
@@ -137,38 +265,257 @@ class Store(object):
         tuple[int, str, str, str | None, Literal["", "json"], Options, int]
         | None
     ):
-        async with aiosqlite.connect(self.db_path) as connection:
-            chat = await chat_queries.get_chat(connection, id=id)  # type: ignore
-            if chat:
-                chat = chat[0]
-                id, name, model, system, format, parameters, keep_alive = chat
-                return (
-                    id,
-                    name,
-                    model,
-                    system,
-                    format,
-                    json.loads(parameters),
-                    keep_alive,
-                )
+        chat = await chat_queries.get_chat(self.connection, id=id)  # type: ignore
+        if chat:
+            chat = chat[0]
+            id, name, model, system, format, parameters, keep_alive = chat
+            return (
+                id,
+                name,
+                model,
+                system,
+                format,
+                json.loads(parameters),
+                keep_alive,
+            )
 
     async def delete_chat(self, id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as connection:
-            await chat_queries.delete_chat(connection, id=id)  # type: ignore
-            await connection.commit()
+        await self.write(partial(chat_queries.delete_chat, id=id))
 
-    async def save_message(self, chat_id: int, author: str, text: str) -> None:
-        async with aiosqlite.connect(self.db_path) as connection:
-            await chat_queries.save_message(  # type: ignore
-                connection,
+    async def save_message(
+        self,
+        chat_id: int,
+        author: str,
+        text: str,
+        metrics: str | None = None,
+        status: MessageStatus = "complete",
+    ) -> int:
+        res: list[tuple[int]] = await self.write(
+            partial(
+                chat_queries.save_message,
                 chat_id=chat_id,
                 author=author,
                 text=text,
+                metrics=metrics,
+                status=status,
             )
-            await connection.commit()
+        )
+        return res[0][0]
+
+    async def update_message(
+        self,
+        id: int,
+        text: str,
+        metrics: str | None = None,
+        status: MessageStatus | None = None,
+    ) -> None:
+        await self.write(
+            partial(
+                chat_queries.update_message,
+                id=id,
+                text=text,
+                metrics=metrics,
+                status=status,
+            )
+        )
+
+    async def delete_message(self, id: int) -> None:
+        await self.write(partial(chat_queries.delete_message, id=id))
 
     async def get_messages(self, chat_id: int) -> list[tuple[Author, str]]:
-        async with aiosqlite.connect(self.db_path) as connection:
-            messages = await chat_queries.get_messages(connection, chat_id=chat_id)  # type: ignore
-            messages = [(Author(author), text) for author, text in messages]
-            return messages
+        messages = await chat_queries.get_messages(  # type: ignore
+            self.connection, chat_id=chat_id
+        )
+        messages = [(Author(author), text) for author, text in messages]
+        return messages
+
+    async def save_message_images(self, message_id: int, digests: list[str]) -> None:
+        """Attach images of the `ImageStore`, by digest, to a message."""
+        images = [
+            {"message_id": message_id, "position": position, "digest": digest}
+            for position, digest in enumerate(digests)
+        ]
+        await self.write(
+            lambda connection: chat_queries.save_message_images(connection, images)
+        )
+
+    async def get_history(self, chat_id: int) -> list[tuple[Author, str, list[str]]]:
+        """The messages of a chat along with the digests of their images."""
+        messages = await chat_queries.get_history(  # type: ignore
+            self.connection, chat_id=chat_id
+        )
+        return [
+            (Author(author), text, digests.split(",") if digests else [])
+            for author, text, digests in messages
+        ]
+
+    async def get_messages_page(
+        self,
+        chat_id: int,
+        before_id: int | None = None,
+        limit: int = MESSAGE_PAGE_SIZE,
+    ) -> list[tuple[int, Author, str, dict | None]]:
+        """
+        Keyset-paginated messages of a chat, oldest first, along with the
+        metrics of assistant messages.
+
+        Returns the latest `limit` messages, or the `limit` messages preceding
+        `before_id` when given. Served from the (chat_id, id) index so the
+        cost is proportional to the page, not to the chat or database size.
+        """
+        if before_id is None:
+            messages = await chat_queries.get_latest_messages(  # type: ignore
+                self.connection, chat_id=chat_id, limit=limit
+            )
+        else:
+            messages = await chat_queries.get_messages_before(  # type: ignore
+                self.connection, chat_id=chat_id, before_id=before_id, limit=limit
+            )
+        return [
+            (id, Author(author), text, json.loads(metrics) if metrics else None)
+            for id, author, text, metrics in reversed(messages)
+        ]
+
+    async def get_messages_since(
+        self, chat_id: int, since_id: int, before_id: int
+    ) -> list[tuple[int, Author, str, dict | None]]:
+        """
+        The messages of a chat from `since_id` up to `before_id`, oldest
+        first, in the format of `get_messages_page`.
+        """
+        messages = await chat_queries.get_messages_since(  # type: ignore
+            self.connection, chat_id=chat_id, since_id=since_id, before_id=before_id
+        )
+        return [
+            (id, Author(author), text, json.loads(metrics) if metrics else None)
+            for id, author, text, metrics in messages
+        ]
+
+    async def search(
+        self, query: str, limit: int = SEARCH_LIMIT
+    ) -> list[tuple[int, int, Author, str]]:
+        """
+        Full-text search across all chats.
+
+        Returns `(message id, chat id, author, snippet)` of the best matches
+        of the words in `query`. A word ending in `*` matches as a prefix.
+        Searches run on a connection of their own, and are interrupted when
+        cancelled, so they never hold up writes or the next search.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        # The search connection only sees committed writes.
+        await self.flush()
+        if self.search_connection is None:
+            self.search_connection = await aiosqlite.connect(self.db_path)
+            await self.search_connection.execute("PRAGMA query_only = 1;")
+        connection = self.search_connection
+        try:
+            results = await chat_queries.search_messages(  # type: ignore
+                connection,
+                query=expression,
+                candidates=SEARCH_CANDIDATES,
+                limit=limit,
+                start=MATCH_START,
+                end=MATCH_END,
+                tokens=SEARCH_SNIPPET_TOKENS,
+            )
+        except asyncio.CancelledError:
+            await connection.interrupt()
+            raise
+        return [
+            (id, chat_id, Author(author), snippet)
+            for id, chat_id, author, snippet in results
+        ]
+
+
+def match_expression(query: str) -> str:
+    """Turn user input into an FTS5 query matching all of its words."""
+    words = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            words.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(words)
+
+
+class StreamingMessage(object):
+    """
+    A message persisted while it is being streamed.
+
+    The row is inserted with status "streaming" by `start`. The text
+    received so far is written with a single UPDATE at most every
+    `interval` seconds, or sooner once `size` characters have been added,
+    in the background. `finish` writes the whole text with its final
+    status, so a crash loses at most the last checkpoint interval.
+    """
+
+    def __init__(
+        self,
+        store: Store,
+        chat_id: int,
+        author: str,
+        interval: float = CHECKPOINT_INTERVAL,
+        size: int = CHECKPOINT_SIZE,
+    ):
+        self.store = store
+        self.chat_id = chat_id
+        self.author = author
+        self.interval = interval
+        self.size = size
+        self.id: int | None = None
+        self._parts: list[str] = []
+        self._length = 0
+        self._saved_length = 0
+        self._saved_at = 0.0
+        self._checkpoint: asyncio.Task | None = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    async def start(self) -> int:
+        self.id = await self.store.save_message(
+            self.chat_id, self.author, "", status="streaming"
+        )
+        self._saved_at = time.monotonic()
+        return self.id
+
+    def append(self, delta: str) -> None:
+        self._parts.append(delta)
+        self._length += len(delta)
+        if self._checkpoint is not None and not self._checkpoint.done():
+            # Coalesced into the next checkpoint.
+            return
+        if (
+            self._length - self._saved_length >= self.size
+            or time.monotonic() - self._saved_at >= self.interval
+        ):
+            self._checkpoint = asyncio.create_task(self.checkpoint())
+
+    async def checkpoint(self) -> None:
+        self._saved_length = self._length
+        self._saved_at = time.monotonic()
+        await self.store.update_message(self.id, self.text)  # type: ignore
+
+    async def finish(
+        self,
+        text: str | None = None,
+        status: MessageStatus = "complete",
+        metrics: str | None = None,
+    ) -> None:
+        if self._checkpoint is not None:
+            await asyncio.shield(self._checkpoint)
+        await self.store.update_message(
+            self.id,  # type: ignore
+            self.text if text is None else text,
+            metrics=metrics,
+            status=status,
+        )
+
+    async def discard(self) -> None:
+        if self._checkpoint is not None:
+            await asyncio.shield(self._checkpoint)
+        await self.store.delete_message(self.id)  # type: ignore
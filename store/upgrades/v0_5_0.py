@@ -0,0 +1,141 @@
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import aiosqlite
+
+# Messages indexed per transaction when backfilling the search index.
+SEARCH_BACKFILL_CHUNK_SIZE = 10000
+
+
+async def message_id(db_path: Path) -> None:
+    async with aiosqlite.connect(db_path) as connection:
+        columns = await connection.execute_fetchall("PRAGMA table_info(message);")
+        if "id" not in [column[1] for column in columns]:
+            # SQLite cannot add a primary key to an existing table, so rebuild
+            # it preserving the insertion order of the existing messages.
+            await connection.executescript(
+                """
+                BEGIN;
+                CREATE TABLE "message_new" (
+                    "id"		INTEGER,
+                    "chat_id"	INTEGER NOT NULL,
+                    "author"	TEXT NOT NULL,
+                    "text"		TEXT NOT NULL,
+                    PRIMARY KEY("id" AUTOINCREMENT),
+                    FOREIGN KEY("chat_id") REFERENCES "chat"("id") ON DELETE CASCADE
+                );
+                INSERT INTO message_new(chat_id, author, text)
+                SELECT chat_id, author, text FROM message ORDER BY rowid;
+                DROP TABLE message;
+                ALTER TABLE message_new RENAME TO message;
+                COMMIT;
+                """
+            )
+        await connection.executescript(
+            """
+            CREATE INDEX IF NOT EXISTS "message_chat_id_idx" ON "message" ("chat_id", "id");
+            """
+        )
+
+
+async def message_metrics(db_path: Path) -> None:
+    async with aiosqlite.connect(db_path) as connection:
+        columns = await connection.execute_fetchall("PRAGMA table_info(message);")
+        if "metrics" not in [column[1] for column in columns]:
+            await connection.executescript(
+                """
+                ALTER TABLE message ADD COLUMN metrics TEXT;
+                """
+            )
+
+
+async def message_status(db_path: Path) -> None:
+    async with aiosqlite.connect(db_path) as connection:
+        columns = await connection.execute_fetchall("PRAGMA table_info(message);")
+        if "status" not in [column[1] for column in columns]:
+            await connection.executescript(
+                """
+                ALTER TABLE message ADD COLUMN status TEXT NOT NULL DEFAULT 'complete';
+                """
+            )
+
+
+async def message_search(db_path: Path) -> None:
+    async with aiosqlite.connect(db_path) as connection:
+        await connection.executescript(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS "message_fts" USING fts5(
+                "text", content="message", content_rowid="id"
+            );
+            CREATE TRIGGER IF NOT EXISTS "message_fts_insert" AFTER INSERT ON "message" BEGIN
+                INSERT INTO message_fts(rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS "message_fts_delete" AFTER DELETE ON "message" BEGIN
+                INSERT INTO message_fts(message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS "message_fts_update" AFTER UPDATE OF "text" ON "message" BEGIN
+                INSERT INTO message_fts(message_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                INSERT INTO message_fts(rowid, text) VALUES (new.id, new.text);
+            END;
+            """
+        )
+        # Index the existing messages in chunks, one transaction each, so that
+        # large databases are not indexed in a single huge transaction and an
+        # interrupted upgrade resumes after the last indexed message.
+        res = await connection.execute_fetchall(
+            "SELECT COALESCE(MAX(id), 0) FROM message_fts_docsize;"
+        )
+        last_id = list(res)[0][0]
+        while True:
+            res = await connection.execute_fetchall(
+                """
+                SELECT MAX(id) FROM (
+                    SELECT id FROM message WHERE id > ? ORDER BY id LIMIT ?
+                );
+                """,
+                (last_id, SEARCH_BACKFILL_CHUNK_SIZE),
+            )
+            chunk_end = list(res)[0][0]
+            if chunk_end is None:
+                break
+            await connection.execute(
+                """
+                INSERT INTO message_fts(rowid, text)
+                SELECT id, text FROM message WHERE id > ? AND id <= ?;
+                """,
+                (last_id, chunk_end),
+            )
+            await connection.commit()
+            last_id = chunk_end
+
+
+async def message_images(db_path: Path) -> None:
+    async with aiosqlite.connect(db_path) as connection:
+        await connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS "message_image" (
+                "message_id"	INTEGER NOT NULL,
+                "position"	INTEGER NOT NULL,
+                "digest"	TEXT NOT NULL,
+                PRIMARY KEY("message_id", "position"),
+                FOREIGN KEY("message_id") REFERENCES "message"("id") ON DELETE CASCADE
+            );
+            CREATE TRIGGER IF NOT EXISTS "message_image_delete" AFTER DELETE ON "message" BEGIN
+                DELETE FROM message_image WHERE message_id = old.id;
+            END;
+            """
+        )
+
+
+upgrades: list[tuple[str, list[Callable[[Path], Awaitable[None]]]]] = [
+    (
+        "0.5.0",
+        [
+            message_id,
+            message_metrics,
+            message_status,
+            message_search,
+            message_images,
+        ],
+    )
+]
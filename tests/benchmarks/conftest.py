@@ -0,0 +1,78 @@
+import json
+import os
+import platform
+import resource
+import sys
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import pytest
+
+# Path of the JSON report of the benchmarks, if set.
+RESULTS_PATH = os.environ.get("OTERM_BENCHMARK_RESULTS")
+# The benchmarks take minutes, so they only run when asked for.
+ENABLED = bool(os.environ.get("OTERM_BENCHMARKS"))
+BENCHMARKS_DIR = Path(__file__).parent
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    config.addinivalue_line(
+        "markers", "benchmark: measures oterm, run with OTERM_BENCHMARKS=1"
+    )
+
+
+def pytest_collection_modifyitems(
+    config: pytest.Config, items: list[pytest.Item]
+) -> None:
+    skip = pytest.mark.skip(reason="set OTERM_BENCHMARKS=1 to run the benchmarks")
+    for item in items:
+        if BENCHMARKS_DIR in item.path.parents:
+            item.add_marker(pytest.mark.benchmark)
+            if not ENABLED:
+                item.add_marker(skip)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident memory of the process so far, in megabytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+@pytest.fixture(scope="session")
+def benchmark_results() -> Iterator[dict[str, dict[str, Any]]]:
+    """
+    Results of the benchmarks, by name. Written as JSON, along with the
+    versions and peak memory of the run, to OTERM_BENCHMARK_RESULTS at the
+    end of the session, so that runs can be compared over time.
+    """
+    results: dict[str, dict[str, Any]] = {}
+    yield results
+    if not RESULTS_PATH:
+        return
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "oterm": metadata.version("oterm"),
+        "textual": metadata.version("textual"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "results": results,
+    }
+    with open(RESULTS_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+@pytest.fixture
+def record(benchmark_results, request) -> Callable[..., None]:
+    """Record the results of the running benchmark, along with the peak RSS."""
+
+    def record(**results) -> None:
+        benchmark_results[request.node.name] = {
+            **results,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        }
+
+    return record
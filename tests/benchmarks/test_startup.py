@@ -0,0 +1,91 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from oterm.app.oterm import OTerm
+from oterm.config import envConfig
+from oterm.app.widgets.chat import ChatContainer, ChatItem
+from oterm.store.store import MESSAGE_PAGE_SIZE
+
+# Commands that do not start the UI.
+FAST_COMMANDS = [["--version"], ["--db"]]
+# Cold start budgets, in seconds.
+FAST_COMMAND_BUDGET = 1.0
+MOUNT_BUDGET = 2.0
+FIRST_PAINT_BUDGET = 3.0
+
+
+async def time_to_interactive(chats: int) -> float:
+    """
+    Seconds from launching the app until every tab exists and the active chat
+    has rendered its messages.
+    """
+    app = OTerm()
+    start = time.perf_counter()
+    async with app.run_test() as pilot:
+        while True:
+            containers = app.query(ChatContainer)
+            if (
+                len(containers) == chats
+                and any(c.loaded for c in containers)
+                and app.query(ChatItem)
+            ):
+                break
+            await pilot.pause(0.01)
+        elapsed = time.perf_counter() - start
+        await pilot.press("ctrl+q")
+    return elapsed
+
+
+@pytest.mark.asyncio
+async def test_startup_independent_of_history_size(synthetic_store):
+    # Both histories fill at least one page of the active chat, so the same
+    # number of messages gets rendered in either case.
+    await synthetic_store(20, MESSAGE_PAGE_SIZE)
+    small_history = min([await time_to_interactive(20) for _ in range(2)])
+
+    await synthetic_store(20, 2000)
+    large_history = min([await time_to_interactive(20) for _ in range(2)])
+
+    # Only chat metadata is read at startup and a single chat is hydrated,
+    # so 40k messages of history should barely register.
+    assert large_history < small_history * 1.5 + 0.5
+
+
+def run_cli(*args: str, **env: str) -> tuple[float, str]:
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-m", "oterm.cli.oterm", *args],
+        env={**os.environ, **env},
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=60,
+    )
+    return time.perf_counter() - start, result.stdout
+
+
+@pytest.mark.parametrize("command", FAST_COMMANDS)
+def test_fast_commands_cold_start(command):
+    elapsed = min(run_cli(*command)[0] for _ in range(3))
+    assert elapsed < FAST_COMMAND_BUDGET
+
+
+@pytest.mark.asyncio
+async def test_profile_startup_cold_start(synthetic_store):
+    await synthetic_store(20, MESSAGE_PAGE_SIZE)
+    _, output = run_cli(
+        "--profile-startup",
+        OTERM_DATA_DIR=str(envConfig.OTERM_DATA_DIR),
+        TEXTUAL_DRIVER="textual.drivers.headless_driver:HeadlessDriver",
+    )
+    timings = {}
+    for line in output.splitlines():
+        step, elapsed, _ = line.rsplit(maxsplit=2)
+        timings[step] = float(elapsed) / 1000
+    assert timings["mount"] < MOUNT_BUDGET
+    assert timings["first paint"] < FIRST_PAINT_BUDGET
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+from textual.app import App, ComposeResult
+from textual.widgets import Markdown
+
+from oterm.app.widgets.chat import Author, ChatItem
+
+PARAGRAPH = (
+    "Streaming **markdown** with `inline code` and a [link](https://ollama.com) "
+    "that goes on for a while so that the paragraph wraps a few times.\n\n"
+)
+CODE = "```python\ndef fib(n):\n    return n if n < 2 else fib(n - 1) + fib(n - 2)\n```\n\n"
+
+
+def tokens(count: int) -> list[str]:
+    document = (PARAGRAPH * 3 + CODE) * (count // 40 + 1)
+    words = document.split(" ")
+    return [word + " " for word in words][:count]
+
+
+class StreamingApp(App):
+    def compose(self) -> ComposeResult:
+        item = ChatItem()
+        item.author = Author.OLLAMA
+        yield item
+
+
+@pytest.mark.asyncio
+async def test_chat_item_render_rate(monkeypatch, record):
+    """
+    Feed a 2k token reply at 400 tokens/s and check the UI keeps up while
+    painting at a bounded frame rate, re-parsing only the trailing block.
+    """
+    updates: list[str] = []
+    update = Markdown.update
+
+    def counting_update(self, markdown):
+        updates.append(" ".join(self.classes))
+        return update(self, markdown)
+
+    monkeypatch.setattr(Markdown, "update", counting_update)
+
+    stream = tokens(2000)
+    rate = 400
+    app = StreamingApp()
+    async with app.run_test() as pilot:
+        item = app.query_one(ChatItem)
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        for i, token in enumerate(stream):
+            item.append_text(token)
+            # Deliver tokens on the wall-clock schedule of a model running at
+            # `rate` tokens/s; falling behind means the UI could not keep up.
+            delay = start + (i + 1) / rate - time.perf_counter()
+            await asyncio.sleep(max(delay, 0))
+        await item.finish_stream()
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        await pilot.pause()
+
+        assert item.text == "".join(stream)
+        blocks = len(item.query(".block"))
+
+    ideal = len(stream) / rate
+    frames = updates.count("tail")
+    record(
+        tokens=len(stream),
+        generated_tokens_per_s=rate,
+        rendered_tokens_per_s=round(len(stream) / wall, 1),
+        frames=frames,
+        blocks=blocks,
+        wall_s=round(wall, 3),
+        render_cpu_s=round(cpu, 3),
+    )
+    assert wall < ideal * 1.5
+    assert frames <= wall * ChatItem.RENDER_FPS + 2
+    # Finished blocks are parsed once, when mounted.
+    assert blocks > 0
+    assert updates.count("block") == blocks
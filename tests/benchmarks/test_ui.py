@@ -0,0 +1,208 @@
+"""
+End-to-end benchmarks of the app, driven headlessly with Textual's Pilot
+against a synthetic store and the mock Ollama server. Every test records
+its measurements in `benchmark_results`; set OTERM_BENCHMARK_RESULTS to a
+path to get them as JSON. OTERM_BENCHMARK_CHATS and OTERM_BENCHMARK_MESSAGES
+set the size of the store.
+"""
+
+import asyncio
+import os
+import statistics
+import time
+from typing import Awaitable, Callable
+
+import pytest
+from textual.app import App
+from textual.widgets import TabbedContent
+
+from oterm.app.oterm import OTerm
+from oterm.app.splash import SplashScreen
+from oterm.app.widgets.chat import ChatContainer, ChatItem, MessageList
+
+CHATS = int(os.environ.get("OTERM_BENCHMARK_CHATS", 50))
+MESSAGES = int(os.environ.get("OTERM_BENCHMARK_MESSAGES", 1000))
+SIZE = (120, 40)
+# Tab switches measured, to chats opened for the first time and again.
+SWITCHES = 10
+# Streamed reply, in tokens, and the rate the mock model generates them at.
+STREAM_TOKENS = 500
+STREAM_RATE = 100
+
+REPLY = (
+    "Streaming **markdown** with `inline code` and a [link](https://ollama.com) "
+    "that goes on for a while so that the paragraph wraps a few times.\n\n"
+    "```python\ndef fib(n):\n    return n if n < 2 else fib(n - 1) + fib(n - 2)\n"
+    "```\n\n"
+)
+
+
+def summary(samples: list[float]) -> dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "median_s": round(statistics.median(ordered), 4),
+        "p95_s": round(ordered[min(len(ordered) * 95 // 100, len(ordered) - 1)], 4),
+        "max_s": round(ordered[-1], 4),
+    }
+
+
+async def wait_for(
+    pilot, condition: Callable[[], bool], timeout: float = 60
+) -> None:
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "Timed out"
+        await pilot.pause(0.005)
+
+
+async def painted(app: App) -> None:
+    """Wait for the next refresh of the screen."""
+    refreshed = asyncio.Event()
+    app.call_after_refresh(refreshed.set)
+    await refreshed.wait()
+
+
+def active_container(app: App) -> ChatContainer:
+    pane = app.query_one(TabbedContent).active_pane
+    assert pane is not None
+    return pane.query_one(ChatContainer)
+
+
+def rendered(app: App) -> bool:
+    container = active_container(app)
+    return container.loaded and bool(container.query(ChatItem))
+
+
+async def interactive(pilot) -> None:
+    """Wait until the splash is gone and the active chat is rendered."""
+    app = pilot.app
+    await wait_for(
+        pilot, lambda: not isinstance(app.screen, SplashScreen) and rendered(app)
+    )
+    await painted(app)
+
+
+@pytest.fixture
+def store(synthetic_store) -> Callable[[], Awaitable[list[int]]]:
+    return lambda: synthetic_store(CHATS, MESSAGES)
+
+
+@pytest.mark.asyncio
+async def test_time_to_first_paint(store, record):
+    await store()
+    start = time.perf_counter()
+    app = OTerm()
+    async with app.run_test(size=SIZE) as pilot:
+        ready = time.perf_counter() - start
+        await painted(app)
+        first_paint = time.perf_counter() - start
+        await wait_for(pilot, lambda: rendered(app))
+        await painted(app)
+        chat_rendered = time.perf_counter() - start
+        await pilot.press("ctrl+q")
+
+    record(
+        chats=CHATS,
+        messages=MESSAGES,
+        ready_s=round(ready, 4),
+        first_paint_s=round(first_paint, 4),
+        chat_rendered_s=round(chat_rendered, 4),
+    )
+    assert chat_rendered < 10
+
+
+@pytest.mark.asyncio
+async def test_tab_switch_latency(store, record):
+    await store()
+    app = OTerm()
+    async with app.run_test(size=SIZE) as pilot:
+        await interactive(pilot)
+
+        async def switch(change: int) -> float:
+            start = time.perf_counter()
+            await app.action_cycle_chat(change)
+            await wait_for(pilot, lambda: rendered(app))
+            await painted(app)
+            return time.perf_counter() - start
+
+        # Chats are loaded the first time they are shown, then only shown.
+        first = [await switch(+1) for _ in range(SWITCHES)]
+        again = [await switch(-1) for _ in range(SWITCHES)]
+        await pilot.press("ctrl+q")
+
+    record(
+        chats=CHATS,
+        messages=MESSAGES,
+        first_open=summary(first),
+        reopen=summary(again),
+    )
+    assert statistics.median(first) < 8
+    assert statistics.median(again) < 3
+
+
+@pytest.mark.asyncio
+async def test_chat_open_time(store, record):
+    await store()
+    app = OTerm()
+    async with app.run_test(size=SIZE) as pilot:
+        await interactive(pilot)
+        containers = [c for c in app.query(ChatContainer) if not c.loaded]
+        durations = []
+        for container in containers[:SWITCHES]:
+            start = time.perf_counter()
+            await container.load_messages()
+            durations.append(time.perf_counter() - start)
+        # Only a page of messages is read, the history waits for a prompt.
+        assert all(c.ollama is None for c in containers[:SWITCHES])
+        await pilot.press("ctrl+q")
+
+    record(chats=CHATS, messages=MESSAGES, load_messages=summary(durations))
+    assert statistics.median(durations) < 3
+
+
+@pytest.mark.asyncio
+async def test_streaming_render_rate(store, record, mock_ollama, monkeypatch):
+    frames: list[float] = []
+    render_stream = ChatItem.render_stream
+
+    async def timed_render_stream(self: ChatItem) -> None:
+        dirty = self._dirty
+        await render_stream(self)
+        if dirty:
+            frames.append(time.perf_counter())
+
+    monkeypatch.setattr(ChatItem, "render_stream", timed_render_stream)
+    words = (REPLY * (STREAM_TOKENS // 30 + 1)).split(" ")
+    reply = " ".join(words[:STREAM_TOKENS])
+    mock_ollama.config.reply = reply
+    mock_ollama.config.rate = STREAM_RATE
+
+    await store()
+    app = OTerm()
+    async with app.run_test(size=SIZE) as pilot:
+        await interactive(pilot)
+        message_list = active_container(app).query_one(MessageList)
+        messages = len(message_list.entries)
+        await pilot.press(*"Hi", "enter")
+        start = time.perf_counter()
+        await wait_for(pilot, lambda: len(message_list.entries) == messages + 2)
+        elapsed = time.perf_counter() - start
+        assert message_list.entries[-1][2] == reply
+        await pilot.press("ctrl+q")
+
+    streaming = frames[-1] - frames[0]
+    record(
+        chats=CHATS,
+        messages=MESSAGES,
+        tokens=STREAM_TOKENS,
+        generated_tokens_per_s=STREAM_RATE,
+        rendered_tokens_per_s=round(STREAM_TOKENS / elapsed, 1),
+        frames=len(frames),
+        frames_per_s=round(len(frames) / streaming, 1),
+        reply_s=round(elapsed, 3),
+    )
+    # Frames are painted at a bounded rate, and the reply is rendered at
+    # most a few times slower than the model generates it.
+    assert len(frames) / streaming <= ChatItem.RENDER_FPS + 1
+    assert elapsed < STREAM_TOKENS / STREAM_RATE * 3
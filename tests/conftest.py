@@ -1,19 +1,34 @@
 from base64 import b64encode
 from io import BytesIO
+from typing import Awaitable, Callable, Iterator
 
-import ollama
 import pytest
 import pytest_asyncio
+from mock_ollama import MockOllama
 from PIL import Image
 
+from oterm.config import envConfig
+from oterm.store.store import Store
 
-@pytest_asyncio.fixture(autouse=True)
-async def load_test_models():
-    try:
-        ollama.show("llama3.1")
-    except ollama.ResponseError:
-        ollama.pull("llama3.1")
-    yield
+
+@pytest.fixture(scope="session")
+def mock_ollama_server() -> Iterator[MockOllama]:
+    server = MockOllama()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def mock_ollama(mock_ollama_server, monkeypatch) -> MockOllama:
+    """
+    The mock Ollama server, reset for each test and used by oterm, and by
+    any process a test starts, instead of a live Ollama.
+    """
+    mock_ollama_server.reset()
+    monkeypatch.setattr(envConfig, "OLLAMA_URL", mock_ollama_server.url)
+    monkeypatch.setenv("OLLAMA_URL", mock_ollama_server.url)
+    return mock_ollama_server
 
 
 @pytest.fixture(scope="session")
@@ -22,3 +37,47 @@ def llama_image():
     image = Image.open("tests/data/lama.jpg")
     image.save(buffered, format="JPEG")
     return b64encode(buffered.getvalue()).decode("utf-8")
+
+
+@pytest_asyncio.fixture
+async def synthetic_store(
+    tmp_path, monkeypatch
+) -> Callable[[int, int], Awaitable[list[int]]]:
+    """
+    Factory pointing OTERM_DATA_DIR to a fresh temporary directory and
+    populating its `store.db` with `chats` chats of `messages` alternating
+    user/assistant messages each. Returns the ids of the created chats.
+    """
+
+    async def populate(chats: int, messages: int) -> list[int]:
+        data_dir = tmp_path / f"{chats}x{messages}"
+        monkeypatch.setattr(envConfig, "OTERM_DATA_DIR", data_dir)
+        store = await Store.create()
+        chat_ids = []
+        for i in range(chats):
+            chat_id = await store.save_chat(
+                id=None,
+                name=f"chat #{i + 1}",
+                model="llama3.1:latest",
+                system=None,
+                format="",
+                parameters="{}",
+                keep_alive=5,
+            )
+            chat_ids.append(chat_id)
+            await store.connection.executemany(  # type: ignore
+                "INSERT INTO message(chat_id, author, text) VALUES(?, ?, ?)",
+                [
+                    (
+                        chat_id,
+                        "me" if j % 2 == 0 else "ollama",
+                        f"Message {j} with some *markdown* and `code`.",
+                    )
+                    for j in range(messages)
+                ],
+            )
+        await store.connection.commit()  # type: ignore
+        await store.close()
+        return chat_ids
+
+    return populate
@@ -0,0 +1,335 @@
+"""
+A stand-in for the Ollama server, to run the tests and benchmarks offline
+and independently of the speed of a model.
+
+It implements `/api/chat` (streamed or not), `/api/tags`, `/api/show` and
+`/api/ps`, generating replies at a configurable token rate, with latency
+before the first token, jitter between tokens and injected errors. It can
+be run on its own to try oterm against it:
+
+    python tests/mock_ollama.py --port 11435 --rate 50
+    OLLAMA_URL=http://127.0.0.1:11435 oterm
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from hashlib import sha256
+from typing import Any, Callable, Optional, Union
+
+from aiohttp import web
+
+LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua."
+).split()
+
+
+@dataclass
+class MockOllamaConfig:
+    # Models listed by /api/tags, and the only ones that can be used.
+    models: list[str] = field(default_factory=lambda: ["llama3.1:latest"])
+    # The reply to every chat, or a function of the request body returning it.
+    # By default `tokens` words of lorem ipsum.
+    reply: Union[str, Callable[[dict], str], None] = None
+    tokens: int = 20
+    # Tokens generated per second, 0 for as fast as possible.
+    rate: float = 0.0
+    # Seconds before the first token, e.g. loading the model, and at most
+    # how many seconds are randomly added before each token.
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Fraction of requests failing with `error_status`, and a number of
+    # next requests failing for sure.
+    error_rate: float = 0.0
+    fail_next: int = 0
+    error_status: int = 500
+    # Streams are cut, without a final chunk, after this many tokens.
+    disconnect_after: Optional[int] = None
+    seed: int = 0
+
+
+def digest(name: str) -> str:
+    return sha256(name.encode()).hexdigest()
+
+
+def model_name(name: str) -> str:
+    # Ollama takes untagged names for their `latest` tag.
+    return name if ":" in name else f"{name}:latest"
+
+
+def keep_alive_seconds(keep_alive: Union[str, float, None]) -> float:
+    if keep_alive is None:
+        return 300.0
+    if isinstance(keep_alive, (int, float)):
+        return float(keep_alive)
+    units = {"s": 1, "m": 60, "h": 3600}
+    if keep_alive[-1:] in units:
+        return float(keep_alive[:-1]) * units[keep_alive[-1]]
+    return float(keep_alive)
+
+
+def tokenize(text: str) -> list[str]:
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class MockOllama(object):
+    """
+    The mock server. Its `config` can be changed at any time, including
+    while it runs in the background with `start`, and it records the body
+    of every chat request in `chats`.
+    """
+
+    def __init__(self, config: Optional[MockOllamaConfig] = None) -> None:
+        self.reset(config)
+        self.url = ""
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    def reset(self, config: Optional[MockOllamaConfig] = None) -> None:
+        self.config = config or MockOllamaConfig()
+        self.random = random.Random(self.config.seed)
+        self.chats: list[dict] = []
+        self.requests: dict[str, int] = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.loaded: dict[str, float] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.count_requests])
+        app.router.add_post("/api/chat", self.chat)
+        app.router.add_get("/api/tags", self.tags)
+        app.router.add_post("/api/show", self.show)
+        app.router.add_get("/api/ps", self.ps)
+        return app
+
+    @web.middleware
+    async def count_requests(
+        self, request: web.Request, handler
+    ) -> web.StreamResponse:
+        self.requests[request.path] = self.requests.get(request.path, 0) + 1
+        if self.config.fail_next > 0:
+            self.config.fail_next -= 1
+            return self.error("Injected error")
+        if self.random.random() < self.config.error_rate:
+            return self.error("Injected error")
+        return await handler(request)
+
+    def error(self, message: str, status: Optional[int] = None) -> web.Response:
+        return web.json_response(
+            {"error": message}, status=status or self.config.error_status
+        )
+
+    def model_info(self, name: str) -> dict[str, Any]:
+        return {
+            "name": name,
+            "model": name,
+            "modified_at": now(),
+            "size": 4_661_224_676,
+            "digest": digest(name),
+            "details": {
+                "format": "gguf",
+                "family": "llama",
+                "parameter_size": "8.0B",
+                "quantization_level": "Q4_0",
+            },
+        }
+
+    def reply(self, body: dict) -> str:
+        reply = self.config.reply
+        if callable(reply):
+            return reply(body)
+        if reply is not None:
+            return reply
+        return " ".join(LOREM[i % len(LOREM)] for i in range(self.config.tokens))
+
+    async def tags(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {"models": [self.model_info(name) for name in self.config.models]}
+        )
+
+    async def show(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        name = model_name(body.get("name") or body.get("model") or "")
+        if name not in self.config.models:
+            return self.error(f"model '{name}' not found", status=404)
+        return web.json_response(
+            {
+                "modelfile": f"FROM {name}\nPARAMETER temperature 0.7",
+                "parameters": "temperature                    0.7",
+                "template": "{{ .Prompt }}",
+                "details": self.model_info(name)["details"],
+                "model_info": {"general.architecture": "llama"},
+            }
+        )
+
+    async def ps(self, request: web.Request) -> web.Response:
+        models = []
+        for name, expires in self.loaded.items():
+            if expires < time.time():
+                continue
+            info = self.model_info(name)
+            expires_at = datetime.fromtimestamp(expires, timezone.utc)
+            info["expires_at"] = expires_at.isoformat()
+            info["size_vram"] = info["size"]
+            models.append(info)
+        return web.json_response({"models": models})
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        model = model_name(body.get("model") or "")
+        if model not in self.config.models:
+            return self.error(
+                f'model "{model}" not found, try pulling it first', status=404
+            )
+        self.chats.append(body)
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        keep_alive = keep_alive_seconds(body.get("keep_alive"))
+        # Loaded once requested, and kept alive for a while after replying.
+        self.loaded[model] = time.time() + keep_alive
+        try:
+            return await self.generate(request, body)
+        finally:
+            self.in_flight -= 1
+            self.loaded[model] = time.time() + keep_alive
+
+    async def generate(self, request: web.Request, body: dict) -> web.StreamResponse:
+        config = self.config
+        start = time.perf_counter_ns()
+        reply = self.reply(body)
+        if body.get("format") == "json":
+            reply = json.dumps({"reply": reply})
+        tokens = tokenize(reply)
+        prompt_tokens = sum(
+            len(tokenize(message.get("content") or ""))
+            for message in body.get("messages", [])
+        )
+
+        def chunk(content: str, **extra) -> dict[str, Any]:
+            return {
+                "model": body["model"],
+                "created_at": now(),
+                "message": {"role": "assistant", "content": content},
+                "done": False,
+                **extra,
+            }
+
+        def final(content: str, generated: int) -> dict[str, Any]:
+            elapsed = time.perf_counter_ns() - start
+            return chunk(
+                content,
+                done=True,
+                done_reason="stop",
+                total_duration=elapsed,
+                load_duration=int(config.latency * 1e9),
+                prompt_eval_count=prompt_tokens,
+                prompt_eval_duration=int(config.latency * 1e9),
+                eval_count=generated,
+                eval_duration=max(elapsed - int(config.latency * 1e9), 1),
+            )
+
+        async def pause(first: bool) -> None:
+            delay = config.latency if first else 0.0
+            if config.rate:
+                delay += 1 / config.rate
+            if config.jitter:
+                delay += self.random.uniform(0, config.jitter)
+            if delay:
+                await asyncio.sleep(delay)
+
+        if not body.get("stream", True):
+            for index in range(len(tokens)):
+                await pause(index == 0)
+            return web.json_response(final(reply, len(tokens)))
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+        for index, token in enumerate(tokens):
+            if index == config.disconnect_after:
+                # Cut the connection short, as a crashing server would.
+                assert request.transport is not None
+                request.transport.close()
+                return response
+            await pause(index == 0)
+            await response.write(json.dumps(chunk(token)).encode() + b"\n")
+        await response.write(json.dumps(final("", len(tokens))).encode() + b"\n")
+        await response.write_eof()
+        return response
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving on the running event loop, returning the URL."""
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sockets = site._server.sockets  # type: ignore
+        self.url = f"http://{host}:{sockets[0].getsockname()[1]}"
+        return self.url
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve from a background thread, returning the URL."""
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(self.serve(host, port))
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self._runner.cleanup())  # type: ignore
+            loop.close()
+
+        self._loop = loop
+        self._thread = threading.Thread(target=run, name="mock-ollama", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.url
+
+    def stop(self) -> None:
+        if self._loop is not None and self._thread is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = self._thread = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", action="append", dest="models")
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50.0)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    config = MockOllamaConfig(
+        tokens=args.tokens,
+        rate=args.rate,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    )
+    if args.models:
+        config.models = args.models
+    server = MockOllama(config)
+    print(f"Mock Ollama serving {config.models} on http://{args.host}:{args.port}")
+    web.run_app(server.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
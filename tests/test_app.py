@@ -0,0 +1,27 @@
+import pytest
+
+from oterm.app.oterm import OTerm
+from oterm.app.widgets.chat import ChatContainer, ChatItem, MessageList
+from oterm.store.store import MESSAGE_PAGE_SIZE
+
+
+@pytest.mark.asyncio
+async def test_startup_reads_a_single_page_of_history(synthetic_store):
+    await synthetic_store(5, 2000)
+    app = OTerm()
+    async with app.run_test() as pilot:
+        while not any(c.loaded for c in app.query(ChatContainer)):
+            await pilot.pause(0.01)
+        while not app.query(ChatItem):
+            await pilot.pause(0.01)
+
+        # Every tab exists, but only the active chat is hydrated, with its
+        # latest page of messages, and no chat reads its whole history.
+        containers = app.query(ChatContainer)
+        assert len(containers) == 5
+        assert [c.loaded for c in containers].count(True) == 1
+        assert all(c.ollama is None for c in containers)
+        active = next(c for c in containers if c.loaded)
+        message_list = active.query_one(MessageList)
+        assert len(message_list.entries) == MESSAGE_PAGE_SIZE
+        await pilot.press("ctrl+q")
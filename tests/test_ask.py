@@ -0,0 +1,162 @@
+import asyncio
+import json
+import subprocess
+import sys
+from io import StringIO
+
+import ollama
+import pytest
+import pytest_asyncio
+
+from oterm.cli.ask import ask, ask_batch
+from oterm.config import envConfig
+from oterm.enums import Author
+from oterm.ollamaclient import OllamaError, get_client
+from oterm.store.store import Store
+
+
+def fake_chat(requests: list[dict], tokens: list[str]):
+    async def chat(**kwargs):
+        requests.append(kwargs)
+
+        async def stream():
+            for token in tokens:
+                await asyncio.sleep(0.01)
+                yield {"message": {"role": "assistant", "content": token}}
+            yield {
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "eval_count": len(tokens),
+                "eval_duration": 1000,
+            }
+
+        return stream()
+
+    return chat
+
+
+@pytest_asyncio.fixture
+async def requests(monkeypatch) -> list[dict]:
+    requests: list[dict] = []
+    monkeypatch.setattr(get_client(), "chat", fake_chat(requests, ["Hello", "!"]))
+    return requests
+
+
+@pytest.mark.asyncio
+async def test_ask_streams_the_reply(requests):
+    out = StringIO()
+    chunk = await ask("Hi", model="llama3.1", out=out)
+    assert out.getvalue() == "Hello!"
+    assert chunk.text == "Hello!"
+    assert chunk.metrics is not None and chunk.metrics.eval_count == 2
+    assert requests[0]["messages"][-1] == {"role": "user", "content": "Hi"}
+
+
+@pytest.mark.asyncio
+async def test_ask_continues_a_stored_chat(requests, tmp_path, monkeypatch):
+    monkeypatch.setattr(envConfig, "OTERM_DATA_DIR", tmp_path)
+    store = await Store.create()
+    chat_id = await store.save_chat(
+        id=None,
+        name="chat",
+        model="llama3.1",
+        system="Be brief.",
+        format="",
+        parameters="{}",
+        keep_alive=5,
+    )
+    await store.save_message(chat_id, Author.USER.value, "Hi")
+    await store.save_message(chat_id, Author.OLLAMA.value, "Hello!")
+    await store.close()
+
+    await ask("Again", chat_id=chat_id, out=StringIO())
+
+    assert requests[0]["model"] == "llama3.1"
+    assert [m["content"] for m in requests[0]["messages"]] == [
+        "Be brief.",
+        "Hi",
+        "Hello!",
+        "Again",
+    ]
+    store = await Store.create()
+    messages = await store.get_messages(chat_id)
+    await store.close()
+    assert messages[-2:] == [(Author.USER, "Again"), (Author.OLLAMA, "Hello!")]
+
+
+@pytest.mark.asyncio
+async def test_failed_prompts_are_not_kept_in_the_chat(tmp_path, monkeypatch):
+    monkeypatch.setattr(envConfig, "OTERM_DATA_DIR", tmp_path)
+    store = await Store.create()
+    chat_id = await store.save_chat(
+        id=None,
+        name="chat",
+        model="llama3.1",
+        system=None,
+        format="",
+        parameters="{}",
+        keep_alive=5,
+    )
+    await store.close()
+
+    async def chat(**kwargs):
+        raise ollama.ResponseError("model is unavailable", 400)
+
+    monkeypatch.setattr(get_client(), "chat", chat)
+    with pytest.raises(OllamaError):
+        await ask("Hi", chat_id=chat_id, out=StringIO())
+
+    store = await Store.create()
+    messages = await store.get_messages(chat_id)
+    await store.close()
+    assert messages == []
+
+
+@pytest.mark.asyncio
+async def test_batch_answers_with_bounded_concurrency(monkeypatch):
+    in_flight = peak = 0
+
+    async def chat(**kwargs):
+        async def stream():
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+            yield {"message": {"role": "assistant", "content": kwargs["model"]}}
+            yield {"message": {"content": ""}, "done": True, "eval_count": 1}
+
+        return stream()
+
+    monkeypatch.setattr(get_client(), "chat", chat)
+    lines = [json.dumps({"id": i, "prompt": f"Prompt {i}"}) for i in range(10)]
+    lines += ["", "not json", json.dumps({"id": 10})]
+    out = StringIO()
+
+    summary = await ask_batch(
+        StringIO("\n".join(lines)), out, model="llama3.1", concurrency=3
+    )
+
+    results = {
+        result["line"]: result
+        for result in map(json.loads, out.getvalue().splitlines())
+    }
+    assert peak == 3
+    assert (summary.prompts, summary.failed, summary.eval_count) == (12, 2, 10)
+    assert all(results[i + 1]["response"] == "llama3.1" for i in range(10))
+    assert results[1]["metrics"]["eval_count"] == 1
+    assert "Invalid line" in results[12]["error"]
+    assert results[13] == {
+        "line": 13,
+        "id": 10,
+        "model": "llama3.1",
+        "error": "A prompt is required",
+    }
+
+
+def test_ask_does_not_import_textual():
+    script = "import sys, oterm.cli.ask; print('textual' in sys.modules)"
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip() == "False"
@@ -0,0 +1,73 @@
+import time
+
+import pytest
+import pytest_asyncio
+
+from mock_ollama import MockOllama, MockOllamaConfig
+from oterm import ollamaclient
+from oterm.ollamaclient import BackendPool, OllamaLLM, close_clients
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clients():
+    yield
+    await close_clients()
+
+
+@pytest.fixture
+def other_ollama():
+    server = MockOllama(MockOllamaConfig(models=["llama3.1:latest", "phi3:latest"]))
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.asyncio
+async def test_requests_go_to_loaded_models_then_idle_backends(
+    mock_ollama, other_ollama
+):
+    pool = BackendPool([mock_ollama.url, other_ollama.url])
+    first, other = pool.pool()
+    await pool.refresh()
+    assert sorted(other.models) == ["llama3.1:latest", "phi3:latest"]
+    assert first.loaded == other.loaded == set()
+
+    # Only the other backend has phi3; both have llama3.1, but the least busy
+    # is preferred, unless the model is loaded on the other.
+    assert pool.candidates("phi3")[0] is other
+    assert pool.candidates("llama3.1")[0] is first
+    with pool.request(first):
+        assert pool.candidates("llama3.1")[0] is other
+    other_ollama.loaded["llama3.1:latest"] = time.time() + 300
+    await pool.refresh(force=True)
+    assert other.loaded == {"llama3.1:latest"}
+    assert pool.candidates("llama3.1:latest")[0] is other
+    assert pool.models() == [
+        first.models["llama3.1:latest"],
+        other.models["phi3:latest"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_requests_fail_over_when_a_backend_goes_down(
+    mock_ollama, other_ollama, monkeypatch
+):
+    other_ollama.config.reply = "From the other backend."
+    pool = BackendPool([other_ollama.url, mock_ollama.url])
+    monkeypatch.setattr(ollamaclient, "backendPool", pool)
+    llm = OllamaLLM(model="llama3.1:latest")
+    assert await llm.completion("Hi") == "From the other backend."
+    assert llm.host == other_ollama.url
+
+    other_ollama.stop()
+    chunks = [chunk async for chunk in llm.stream_deltas("Again")]
+    assert chunks[-1].text == mock_ollama.reply({})
+    assert llm.host == mock_ollama.url
+    down, up = pool.pool()
+    assert not down.healthy and down.error
+    assert up.loaded == {"llama3.1:latest"}
+    assert down.in_flight == up.in_flight == 0
+
+    # Until it is back up, the next requests go to the healthy backend.
+    await llm.completion("And again")
+    assert len(mock_ollama.chats) == 2
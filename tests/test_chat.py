@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from oterm.app.oterm import OTerm
+from oterm.app.widgets.chat import (
+    ChatContainer,
+    ChatItem,
+    MessageList,
+    finished_blocks_end,
+)
+from oterm.app.widgets.prompt import FlexibleInput
+from oterm.store.store import StreamingMessage
+
+
+def test_an_open_code_fence_is_not_split():
+    text = "Intro.\n\n```python\ndef f():\n\n    return 1\n"
+    assert finished_blocks_end(text) == text.index("```")
+    # Nor is one closed by a line still being streamed.
+    assert finished_blocks_end("```python\ncode\n```") == 0
+
+
+def test_a_closed_code_fence_is_finished():
+    text = "```python\ncode\n```\nAfter the code"
+    assert finished_blocks_end(text) == text.index("After")
+    # Shorter or other fences do not close it.
+    text = "~~~~\n```\n\nx\n~~\n~~~~\n\nnext"
+    assert finished_blocks_end(text) == text.index("next")
+
+
+def test_indented_lines_continue_a_block():
+    text = "- one\n\n  still one\n"
+    assert finished_blocks_end(text) == 0
+    text += "\n- two"
+    assert finished_blocks_end(text) == text.index("- two")
+
+
+def test_a_trailing_paragraph_is_not_finished():
+    assert finished_blocks_end("First paragraph") == 0
+    text = "First.\n\nSecond, still stre"
+    assert finished_blocks_end(text) == text.index("Second")
+
+
+def test_blocks_are_found_from_start():
+    text = "```\nopen\n\na\n\nb\n\nc"
+    start = text.index("a")
+    assert finished_blocks_end(text, start) == text.index("c")
+    assert finished_blocks_end(text, text.index("c")) == text.index("c")
+
+
+async def active_chat(pilot) -> ChatContainer:
+    app = pilot.app
+    while not app.query(ChatItem):
+        await pilot.pause(0.01)
+    return next(c for c in app.query(ChatContainer) if c.loaded)
+
+
+@pytest.mark.asyncio
+async def test_cancel_while_saving_a_reply_keeps_the_turn(
+    synthetic_store, mock_ollama, monkeypatch
+):
+    mock_ollama.config.reply = "Hello there"
+    finish = StreamingMessage.finish
+
+    async def slow_finish(self, *args, **kwargs) -> None:
+        # Escape is pressed once the stream is over, while the reply is saved.
+        chat.key_escape()
+        await asyncio.sleep(0.1)
+        await finish(self, *args, **kwargs)
+
+    monkeypatch.setattr(StreamingMessage, "finish", slow_finish)
+    await synthetic_store(1, 2)
+    app = OTerm()
+    async with app.run_test() as pilot:
+        chat = await active_chat(pilot)
+        message_list = chat.query_one(MessageList)
+        await pilot.press(*"Hi", "enter")
+        await chat.stop_inference()
+
+        assert chat.ollama is not None
+        roles = [message["role"] for message in chat.ollama.history]
+        assert roles == ["user", "assistant", "user", "assistant"]
+        assert chat.messages[-2:] == [
+            (chat.messages[-2][0], "Hi"),
+            (chat.messages[-1][0], "Hello there"),
+        ]
+        assert [text for _, _, text, _ in message_list.entries[-2:]] == [
+            "Hi",
+            "Hello there",
+        ]
+        assert chat.query_one("#prompt", FlexibleInput).text == ""
+        cursor = await app.store.connection.execute(  # type: ignore
+            "SELECT text, status FROM message ORDER BY id DESC LIMIT 1"
+        )
+        assert await cursor.fetchone() == ("Hello there", "complete")
+        await pilot.press("ctrl+q")
@@ -0,0 +1,22 @@
+import subprocess
+import sys
+
+# Modules that only the UI needs, and commands that must not import them.
+UI_MODULES = ["textual", "ollama", "aiosqlite", "PIL", "rich_pixels", "pyperclip"]
+FAST_COMMANDS = [["--version"], ["--db"]]
+
+
+def test_fast_commands_do_not_import_the_ui():
+    script = (
+        "import sys; from oterm.cli.oterm import cli;"
+        f"cli({FAST_COMMANDS!r}[int(sys.argv[1])], standalone_mode=False);"
+        f"print([m for m in {UI_MODULES!r} if m in sys.modules])"
+    )
+    for index, command in enumerate(FAST_COMMANDS):
+        output = subprocess.run(
+            [sys.executable, "-c", script, str(index)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        assert output.splitlines()[-1] == "[]", command
@@ -0,0 +1,130 @@
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import pytest
+from textual import on
+from textual.app import App, ComposeResult
+
+from oterm.app.widgets import image as image_widget
+from oterm.app.widgets.image import ImageDirectoryTree
+
+
+class TreeApp(App):
+    def __init__(self, path: Path) -> None:
+        self.root_path = path
+        super().__init__()
+
+    def compose(self) -> ComposeResult:
+        yield ImageDirectoryTree(self.root_path)
+
+
+def populate(path: Path, images: int, others: int, directories: int) -> None:
+    for i in range(images):
+        (path / f"image{i:05}.{'PNG' if i % 2 else 'jpg'}").touch()
+    for i in range(others):
+        (path / f"notes{i}.txt").touch()
+    for i in range(directories):
+        (path / f"album{i}").mkdir()
+
+
+async def loaded(pilot, tree: ImageDirectoryTree, count: int) -> None:
+    while len(tree.root.children) < count:
+        await pilot.pause(0.01)
+    await pilot.pause(0.1)
+
+
+@pytest.mark.asyncio
+async def test_directories_are_listed_in_batches(tmp_path, monkeypatch):
+    populate(tmp_path, images=2000, others=3000, directories=3)
+    batches = []
+    add_entries = ImageDirectoryTree.add_entries
+
+    def recording_add_entries(self, node, entries):
+        batches.append(len(entries))
+        add_entries(self, node, entries)
+
+    monkeypatch.setattr(ImageDirectoryTree, "add_entries", recording_add_entries)
+    stats = []
+    is_dir = Path.is_dir
+
+    def recording_is_dir(path):
+        stats.append(path)
+        return is_dir(path)
+
+    monkeypatch.setattr(Path, "is_dir", recording_is_dir)
+    app = TreeApp(tmp_path)
+    async with app.run_test() as pilot:
+        tree = app.query_one(ImageDirectoryTree)
+        await loaded(pilot, tree, 2003)
+        names = [str(node.label) for node in tree.root.children]
+        assert len(names) == 2003
+        assert names[:4] == ["album0", "album1", "album2", "image00000.jpg"]
+        assert names == sorted(names[:3]) + sorted(names[3:], key=str.lower)
+        assert batches == [250, 500, 1000, 253]
+        # Entry types come from the directory entries, not a stat per file.
+        assert not [path for path in stats if path.parent == tmp_path]
+
+
+@pytest.mark.asyncio
+async def test_entries_are_shown_while_the_directory_is_read(tmp_path, monkeypatch):
+    populate(tmp_path, images=1000, others=0, directories=0)
+    resume = threading.Event()
+    scandir = os.scandir
+
+    @contextmanager
+    def slow_scandir(path):
+        with scandir(path) as entries:
+
+            def read():
+                for i, entry in enumerate(entries):
+                    if i == 300:
+                        resume.wait(10)
+                    yield entry
+
+            yield read()
+
+    monkeypatch.setattr(image_widget.os, "scandir", slow_scandir)
+    app = TreeApp(tmp_path)
+    async with app.run_test() as pilot:
+        tree = app.query_one(ImageDirectoryTree)
+        await loaded(pilot, tree, image_widget.DIRECTORY_BATCH_SIZE)
+        assert len(tree.root.children) == image_widget.DIRECTORY_BATCH_SIZE
+        resume.set()
+        await loaded(pilot, tree, 1000)
+
+
+@pytest.mark.asyncio
+async def test_images_are_selected(tmp_path):
+    populate(tmp_path, images=1, others=0, directories=1)
+    (tmp_path / "album0" / "nested.png").touch()
+    selected = []
+
+    class SelectApp(TreeApp):
+        @on(ImageDirectoryTree.FileSelected)
+        def on_file_selected(self, event: ImageDirectoryTree.FileSelected) -> None:
+            selected.append(event.path)
+
+    app = SelectApp(tmp_path)
+    async with app.run_test() as pilot:
+        tree = app.query_one(ImageDirectoryTree)
+        await loaded(pilot, tree, 2)
+        album = tree.root.children[0]
+        tree.select_node(album)
+        while not album.children:
+            await pilot.pause(0.01)
+        tree.select_node(album.children[0])
+        await pilot.pause(0.1)
+    assert selected == [tmp_path / "album0" / "nested.png"]
+
+
+@pytest.mark.asyncio
+async def test_large_directories_are_truncated(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_widget, "MAX_DIRECTORY_ENTRIES", 100)
+    populate(tmp_path, images=150, others=0, directories=0)
+    app = TreeApp(tmp_path)
+    async with app.run_test() as pilot:
+        tree = app.query_one(ImageDirectoryTree)
+        await loaded(pilot, tree, 100)
+        assert len(tree.root.children) == 100
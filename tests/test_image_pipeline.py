@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from oterm.image_pipeline import ImagePipeline
+from oterm.store.images import ImageStore
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(max_workers=1)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+def pipeline_in(tmp_path, **kwargs) -> tuple[ImagePipeline, CountingExecutor]:
+    executor = CountingExecutor()
+    pipeline = ImagePipeline(
+        store=ImageStore(tmp_path / "images"), executor=executor, **kwargs
+    )
+    return pipeline, executor
+
+
+def noise(path, size: tuple[int, int], mode: str = "RGB") -> None:
+    Image.frombytes(mode, size, os.urandom(size[0] * size[1] * len(mode))).save(path)
+
+
+@pytest.mark.asyncio
+async def test_large_images_are_resized_to_fit_the_budget(tmp_path):
+    pipeline, executor = pipeline_in(tmp_path, max_edge=512, max_bytes=60_000)
+    noise(tmp_path / "photo.jpg", (3000, 2000))
+
+    digest = await pipeline.prepare(tmp_path / "photo.jpg")
+
+    data = pipeline.store.get(digest)
+    assert len(data) <= 60_000
+    with Image.open(BytesIO(data)) as image:
+        assert image.format == "JPEG"
+        assert max(image.size) <= 512
+    assert executor.submitted == 1
+
+
+@pytest.mark.asyncio
+async def test_transparent_images_are_converted(tmp_path):
+    pipeline, _ = pipeline_in(tmp_path)
+    noise(tmp_path / "icon.png", (64, 32), mode="RGBA")
+
+    digest = await pipeline.prepare(tmp_path / "icon.png")
+
+    with Image.open(BytesIO(pipeline.store.get(digest))) as image:
+        assert (image.mode, image.size) == ("RGB", (64, 32))
+
+
+@pytest.mark.asyncio
+async def test_prepared_images_are_cached_until_modified(tmp_path):
+    pipeline, executor = pipeline_in(tmp_path)
+    path = tmp_path / "photo.png"
+    noise(path, (100, 100))
+
+    digest = await pipeline.prepare(path)
+    assert await pipeline.prepare(path) == digest
+    assert executor.submitted == 1
+
+    noise(path, (120, 100))
+    assert await pipeline.prepare(path) != digest
+    assert executor.submitted == 2
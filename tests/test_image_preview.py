@@ -0,0 +1,83 @@
+import os
+
+import pytest
+from PIL import Image as PILImage
+from textual.app import App, ComposeResult
+
+from oterm.app.widgets import image as image_widget
+from oterm.app.widgets.image import Image, PreviewCache, render_preview
+
+
+def noise(path, size: tuple[int, int]) -> str:
+    PILImage.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(path)
+    return str(path)
+
+
+def test_render_preview_fits_the_preview_size(tmp_path):
+    width, height, pixels = render_preview(noise(tmp_path / "wide.png", (400, 100)))
+    assert (width, height) == (image_widget.IMG_MAX_SIZE, 20)
+    assert pixels is not None
+
+
+def test_preview_cache_is_bounded_by_memory():
+    cost = 10 * 10 * image_widget.PREVIEW_PIXEL_BYTES
+    cache = PreviewCache(max_bytes=3 * cost)
+    for key in "abc":
+        cache.put(key, (10, 10, None))  # type: ignore
+    assert cache.get("a") is not None
+
+    cache.put("d", (10, 10, None))  # type: ignore
+    assert list(cache.previews) == ["c", "a", "d"]
+    assert cache.size == 3 * cost
+
+
+class PreviewApp(App):
+    def compose(self) -> ComposeResult:
+        yield Image(id="image")
+
+
+@pytest.mark.asyncio
+async def test_only_the_settled_highlight_is_rendered(tmp_path, monkeypatch):
+    paths = [noise(tmp_path / f"{i}.png", (40, 30)) for i in range(5)]
+    rendered = []
+
+    def recording_render(path):
+        rendered.append(path)
+        return render_preview(path)
+
+    monkeypatch.setattr(image_widget, "render_preview", recording_render)
+    monkeypatch.setattr(Image, "previews", PreviewCache())
+    app = PreviewApp()
+    async with app.run_test() as pilot:
+        image = app.query_one(Image)
+        for path in paths:
+            image.path = path
+            await pilot.pause(0.01)
+        await app.workers.wait_for_complete()
+        assert rendered == [paths[-1]]
+        assert image.pixels is not None
+
+        # Cached previews are shown without rendering them again.
+        image.path = paths[0]
+        await app.workers.wait_for_complete()
+        image.path = paths[-1]
+        await app.workers.wait_for_complete()
+        assert rendered == [paths[-1], paths[0]]
+
+
+@pytest.mark.asyncio
+async def test_images_that_fail_to_render_are_not_previewed(tmp_path, monkeypatch):
+    path = noise(tmp_path / "bomb.png", (40, 30))
+
+    def failing_render(path):
+        raise PILImage.DecompressionBombError("Image size exceeds limit")
+
+    monkeypatch.setattr(image_widget, "render_preview", failing_render)
+    monkeypatch.setattr(Image, "previews", PreviewCache())
+    app = PreviewApp()
+    async with app.run_test():
+        image = app.query_one(Image)
+        image.path = path
+        await app.workers.wait_for_complete()
+        assert image.pixels is None
+        assert app.is_running
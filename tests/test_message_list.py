@@ -0,0 +1,171 @@
+import pytest
+from textual.widgets import OptionList, TabbedContent
+
+from oterm.app.chat_search import ChatSearch
+from oterm.app.oterm import OTerm
+from oterm.app.widgets.chat import ChatContainer, ChatItem, MessageList
+from oterm.store.store import MESSAGE_PAGE_SIZE
+
+# Messages loaded by scrolling up, a few pages more than the first one.
+LOADED = 4 * MESSAGE_PAGE_SIZE
+
+
+async def settle(pilot, message_list: MessageList) -> None:
+    await pilot.pause(0.1)
+    while (
+        message_list._lock.locked()
+        or message_list._window_update_pending
+        or message_list._anchor is not None
+    ):
+        await pilot.pause(0.05)
+
+
+def assert_window_consistent(message_list: MessageList) -> None:
+    children = list(message_list.children)
+    items = message_list.items
+    assert children[0] is message_list.top_spacer
+    assert children[1 : len(items) + 1] == items
+    assert children[len(items) + 1] is message_list.bottom_spacer
+    for index, item in enumerate(items, message_list.start):
+        _, author, text, _ = message_list.entries[index]
+        assert (item.author, item.text) == (author, text)
+
+
+@pytest.mark.asyncio
+async def test_long_chat_mounts_a_bounded_window(synthetic_store):
+    await synthetic_store(1, 500)
+    app = OTerm()
+    async with app.run_test(size=(100, 40)) as pilot:
+        while not any(c.loaded for c in app.query(ChatContainer)):
+            await pilot.pause(0.01)
+        message_list = app.query_one(MessageList)
+        await settle(pilot, message_list)
+        assert message_list.scroll_y == message_list.max_scroll_y
+        assert_window_consistent(message_list)
+
+        # Scroll all the way up a few times, loading older pages on the way.
+        for _ in range(300):
+            if len(message_list.entries) >= LOADED:
+                break
+            message_list.scroll_to(
+                y=max(message_list.scroll_y - 50, 0), animate=False
+            )
+            await settle(pilot, message_list)
+            assert_window_consistent(message_list)
+        assert len(message_list.entries) >= LOADED
+
+        # Visible messages plus the overscan on either side, however many
+        # have been loaded.
+        limit = message_list.size.height + 2 * MessageList.OVERSCAN
+        assert len(app.query(ChatItem)) <= limit
+
+        message_list.scroll_end(animate=False)
+        await settle(pilot, message_list)
+        assert_window_consistent(message_list)
+        assert message_list.end == len(message_list.entries)
+        assert message_list.scroll_y == message_list.max_scroll_y
+        assert len(app.query(ChatItem)) <= limit
+        await pilot.press("ctrl+q")
+
+
+@pytest.mark.asyncio
+async def test_search_jumps_to_an_old_message(synthetic_store):
+    chat_ids = await synthetic_store(2, 500)
+    app = OTerm()
+    async with app.run_test(size=(100, 40)) as pilot:
+        while not any(c.loaded for c in app.query(ChatContainer)):
+            await pilot.pause(0.01)
+
+        await pilot.press("ctrl+g")
+        assert isinstance(app.screen, ChatSearch)
+        await pilot.press(*"17")
+        results = app.screen.query_one(OptionList)
+        while not results.option_count:
+            await pilot.pause(0.05)
+        # Message 17 of each chat.
+        assert results.option_count == 2
+        # Jump to the chat that has not been opened yet.
+        ids = [
+            tuple(map(int, str(results.get_option_at_index(i).id).split("-")))
+            for i in range(results.option_count)
+        ]
+        results.highlighted = [chat_id for chat_id, _ in ids].index(chat_ids[1])
+        chat_id, message_id = ids[results.highlighted]
+        await pilot.press("enter")
+        await pilot.pause(0.1)
+
+        tabs = app.query_one(TabbedContent)
+        assert tabs.active == f"chat-{chat_id}"
+        message_list = tabs.get_pane(tabs.active).query_one(MessageList)
+        await settle(pilot, message_list)
+        assert_window_consistent(message_list)
+        first, _ = message_list.visible_range()
+        id, _, text, _ = message_list.entries[first]
+        assert id == message_id
+        assert text.startswith("Message 17 ")
+        await pilot.press("ctrl+q")
+
+
+async def opened_chat(pilot) -> tuple[ChatContainer, MessageList]:
+    app = pilot.app
+    while not any(c.loaded for c in app.query(ChatContainer)):
+        await pilot.pause(0.01)
+    container = next(c for c in app.query(ChatContainer) if c.loaded)
+    message_list = container.query_one(MessageList)
+    await settle(pilot, message_list)
+    return container, message_list
+
+
+def top_message(message_list: MessageList) -> tuple[int | None, float]:
+    """The id of the first visible message, and its offset in the viewport."""
+    first, _ = message_list.visible_range()
+    id = message_list.entries[first][0]
+    return id, message_list.position(first) - message_list.scroll_y
+
+
+@pytest.mark.asyncio
+async def test_older_messages_are_prepended_in_place(synthetic_store):
+    await synthetic_store(1, 3 * MESSAGE_PAGE_SIZE)
+    app = OTerm()
+    async with app.run_test(size=(100, 40)) as pilot:
+        container, message_list = await opened_chat(pilot)
+        message_list.scroll_to(y=3, animate=False)
+        await settle(pilot, message_list)
+        id, offset = top_message(message_list)
+        assert len(message_list.entries) == MESSAGE_PAGE_SIZE
+
+        # Reaching the top loads the previous page above, out of view.
+        message_list.scroll_to(y=0, animate=False)
+        while len(message_list.entries) == MESSAGE_PAGE_SIZE:
+            await pilot.pause(0.01)
+        await settle(pilot, message_list)
+        assert len(message_list.entries) == 2 * MESSAGE_PAGE_SIZE
+        assert_window_consistent(message_list)
+        index = [entry[0] for entry in message_list.entries].index(id)
+        assert message_list.position(index) - message_list.scroll_y == offset + 3
+        assert container.has_older_messages
+        await pilot.press("ctrl+q")
+
+
+@pytest.mark.asyncio
+async def test_show_entry_mounts_an_old_message(synthetic_store):
+    await synthetic_store(1, 3 * MESSAGE_PAGE_SIZE)
+    app = OTerm()
+    async with app.run_test(size=(100, 40)) as pilot:
+        container, message_list = await opened_chat(pilot)
+        for _ in range(2):
+            await container.load_older_messages()
+            await settle(pilot, message_list)
+        assert len(message_list.entries) == 3 * MESSAGE_PAGE_SIZE
+        assert message_list.start > 5 + MessageList.OVERSCAN
+
+        await message_list.show_entry(5)
+        await settle(pilot, message_list)
+        assert_window_consistent(message_list)
+        assert message_list.start <= 5 < message_list.end
+        first, _ = message_list.visible_range()
+        assert first == 5
+        assert message_list.position(5) == message_list.scroll_y
+        limit = message_list.size.height + 2 * MessageList.OVERSCAN
+        assert len(app.query(ChatItem)) <= limit
+        await pilot.press("ctrl+q")
@@ -0,0 +1,91 @@
+import httpx
+import ollama
+import pytest
+import pytest_asyncio
+
+from oterm.ollamaclient import OllamaLLM, close_clients, get_client
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clients():
+    yield
+    await close_clients()
+
+
+@pytest.mark.asyncio
+async def test_streamed_and_complete_replies(mock_ollama):
+    mock_ollama.config.reply = "Hello there, how are you?"
+    llm = OllamaLLM(model="llama3.1:latest")
+
+    chunks = [chunk async for chunk in llm.stream_deltas("Hi")]
+    assert [chunk.delta for chunk in chunks[:-1]] == [
+        "Hello ",
+        "there, ",
+        "how ",
+        "are ",
+        "you?",
+    ]
+    assert chunks[-1].text == "Hello there, how are you?"
+    assert chunks[-1].stats["eval_count"] == 5
+
+    assert await llm.completion("Again") == "Hello there, how are you?"
+    assert [chat["stream"] for chat in mock_ollama.chats] == [True, False]
+    assert mock_ollama.chats[-1]["messages"][-1]["content"] == "Again"
+
+
+@pytest.mark.asyncio
+async def test_models_are_listed_shown_and_loaded(mock_ollama):
+    mock_ollama.config.models = ["llama3.1:latest", "mistral:latest"]
+    client = get_client()
+
+    tags = await client.list()
+    assert [model["name"] for model in tags["models"]] == mock_ollama.config.models
+    assert "FROM mistral:latest" in (await client.show("mistral:latest"))["modelfile"]
+    # Untagged names are those of the latest tag, as with Ollama.
+    assert "FROM mistral:latest" in (await client.show("mistral"))["modelfile"]
+    with pytest.raises(ollama.ResponseError) as error:
+        await client.show("unknown")
+    assert error.value.status_code == 404
+
+    assert (await client.ps())["models"] == []
+    await client.chat(model="mistral", messages=[], keep_alive="5m")
+    assert [model["name"] for model in (await client.ps())["models"]] == [
+        "mistral:latest"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_token_rate_and_latency(mock_ollama):
+    mock_ollama.config.tokens = 10
+    mock_ollama.config.rate = 100
+    mock_ollama.config.latency = 0.1
+    llm = OllamaLLM(model="llama3.1:latest")
+
+    async for _ in llm.stream_deltas("Hi"):
+        pass
+
+    assert llm.metrics is not None
+    assert llm.metrics.ttft >= 0.1
+    assert llm.metrics.wall_time >= 0.19
+    # As reported by the server, tokens are generated at most at the rate.
+    assert llm.metrics.eval_count == 10
+    assert 100 / 5 < llm.metrics.tokens_per_second <= 100 * 1.05
+
+
+@pytest.mark.asyncio
+async def test_injected_errors(mock_ollama):
+    mock_ollama.config.fail_next = 1
+    mock_ollama.config.error_status = 503
+    client = get_client()
+    with pytest.raises(ollama.ResponseError) as error:
+        await client.chat(model="llama3.1:latest", messages=[])
+    assert error.value.status_code == 503
+    await client.chat(model="llama3.1:latest", messages=[])
+
+    mock_ollama.config.disconnect_after = 3
+    stream = await client.chat(model="llama3.1:latest", messages=[], stream=True)
+    received = []
+    with pytest.raises(httpx.HTTPError):
+        async for chunk in stream:
+            received.append(chunk)
+    assert len(received) == 3
@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from textual.app import App
+from textual.widgets import OptionList
+
+from oterm.app.chat_edit import ChatEdit
+from oterm.model_catalog import ModelCatalog
+
+
+class FakeClient:
+    def __init__(self, models: list[dict]):
+        self.models = models
+        self.shown: list[str] = []
+        self.running = 0
+        self.max_running = 0
+
+    async def list(self):
+        return {"models": self.models}
+
+    async def show(self, name: str):
+        self.shown.append(name)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return {"system": f"You are {name}.", "modelfile": "FROM ..."}
+
+
+def catalog_with(tmp_path, client: FakeClient) -> ModelCatalog:
+    catalog = ModelCatalog(path=tmp_path / "models.json", concurrency=3)
+    catalog.client = lambda: client  # type: ignore
+    return catalog
+
+
+def models(count: int, digest: str = "a") -> list[dict]:
+    return [
+        {"name": f"model{i}:latest", "digest": digest, "size": i} for i in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_infos_are_fetched_concurrently_and_bounded(tmp_path):
+    client = FakeClient(models(10))
+    catalog = catalog_with(tmp_path, client)
+
+    listed = await catalog.list()
+    infos = {model["name"]: info async for model, info in catalog.infos(listed)}
+
+    assert sorted(infos) == sorted(model["name"] for model in listed)
+    assert all("modelfile" not in info for info in infos.values())
+    assert client.max_running == 3
+
+
+@pytest.mark.asyncio
+async def test_infos_are_cached_on_disk_by_digest(tmp_path):
+    client = FakeClient(models(3))
+    catalog = catalog_with(tmp_path, client)
+    [_ async for _ in catalog.infos(client.models)]
+
+    # A new catalog, as in the next run of the app, reads the disk cache.
+    client = FakeClient(models(3))
+    catalog = catalog_with(tmp_path, client)
+    [_ async for _ in catalog.infos(client.models)]
+    assert client.shown == []
+
+    client.models[1]["digest"] = "b"
+    infos = [model["name"] async for model, _ in catalog.infos(client.models)]
+    assert client.shown == ["model1:latest"]
+    # Cached models come first.
+    assert infos[-1] == "model1:latest"
+
+
+@pytest.mark.asyncio
+async def test_removed_models_are_dropped_from_cache(tmp_path):
+    client = FakeClient(models(3))
+    catalog = catalog_with(tmp_path, client)
+    [_ async for _ in catalog.infos(client.models)]
+
+    [_ async for _ in catalog.infos(client.models[:1])]
+
+    catalog = catalog_with(tmp_path, client)
+    catalog.load()
+    assert list(catalog.cache) == ["model0:latest"]
+
+
+class EditApp(App):
+    def on_mount(self) -> None:
+        self.push_screen(ChatEdit())
+
+
+@pytest.mark.asyncio
+async def test_the_dialog_survives_an_unreachable_ollama(mock_ollama, monkeypatch):
+    monkeypatch.setattr(ChatEdit, "models", [])
+    mock_ollama.config.fail_next = 1
+    app = EditApp()
+    async with app.run_test() as pilot:
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        assert isinstance(app.screen, ChatEdit)
+        assert app.screen.query_one("#model-select", OptionList).option_count == 0
+        [notification] = app._notifications
+        assert notification.severity == "error"
+        assert "Unable to load the models" in notification.message
+
+        await pilot.press("escape")
+        assert not isinstance(app.screen, ChatEdit)
@@ -0,0 +1,279 @@
+import asyncio
+import json
+import socket
+from base64 import b64decode
+
+import pytest
+
+from oterm.config import envConfig
+from oterm.ollamaclient import (
+    ContextWindow,
+    OllamaConnectionError,
+    OllamaLLM,
+    OllamaResponseError,
+    OllamaStreamError,
+    OllamaTimeoutError,
+    ResponseMetrics,
+    close_clients,
+    get_client,
+    message_tokens,
+)
+from oterm.store.images import ImageStore
+
+
+def fake_chat(tokens: list[str]):
+    async def chat(**kwargs):
+        async def stream():
+            for token in tokens:
+                yield {"message": {"role": "assistant", "content": token}}
+            yield {
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "eval_count": len(tokens),
+                "eval_duration": 1000,
+            }
+
+        return stream()
+
+    return chat
+
+
+@pytest.mark.asyncio
+async def test_stream_deltas(monkeypatch):
+    llm = OllamaLLM()
+    monkeypatch.setattr(llm.client, "chat", fake_chat(["Hello", ", ", "world"]))
+
+    chunks = [chunk async for chunk in llm.stream_deltas("Hi")]
+
+    assert [chunk.delta for chunk in chunks[:-1]] == ["Hello", ", ", "world"]
+    final = chunks[-1]
+    assert final.done and final.text == "Hello, world"
+    assert final.stats["eval_count"] == 3
+    assert "message" not in final.stats
+    assert llm.history[-1] == {"role": "assistant", "content": "Hello, world"}
+    assert final.metrics is llm.metrics
+    assert final.metrics.eval_count == 3
+    assert final.metrics.tokens_per_second == 3e6
+    assert 0 < final.metrics.ttft <= final.metrics.wall_time
+
+
+@pytest.mark.asyncio
+async def test_stored_images_are_encoded_per_request(tmp_path, monkeypatch):
+    images = ImageStore(tmp_path)
+    monkeypatch.setattr("oterm.ollamaclient.imageStore", images)
+    digest = images.put(b"image data")
+    requests = []
+    chat = fake_chat(["Nice"])
+
+    async def recording_chat(**kwargs):
+        requests.append(kwargs["messages"])
+        return await chat(**kwargs)
+
+    llm = OllamaLLM(options={"num_ctx": 4096})
+    monkeypatch.setattr(llm.client, "chat", recording_chat)
+    [_ async for _ in llm.stream_deltas("Look", [digest])]
+    [_ async for _ in llm.stream_deltas("Again")]
+
+    # The history refers to the image, each request carries its data.
+    assert llm.history[0]["images"] == [digest]
+    for messages in requests:
+        assert b64decode(messages[0]["images"][0]) == b"image data"
+
+
+@pytest.mark.asyncio
+async def test_stream_yields_accumulated_text(monkeypatch):
+    llm = OllamaLLM()
+    monkeypatch.setattr(llm.client, "chat", fake_chat(["Hello", ", ", "world"]))
+
+    assert [text async for text in llm.stream("Hi")] == [
+        "Hello",
+        "Hello, ",
+        "Hello, world",
+    ]
+
+
+def test_context_window_keeps_system_and_recent_turns():
+    history = [{"role": "system", "content": "Be brief."}]
+    for i in range(50):
+        history.append({"role": "user", "content": f"question {i} " * 10})
+        history.append({"role": "assistant", "content": f"answer {i} " * 10})
+    history.append({"role": "user", "content": "last question"})
+    context = ContextWindow(budget=0.5)
+
+    messages = context.select(history, num_ctx=1024)
+
+    assert messages[0] == history[0]
+    assert messages[-1] == history[-1]
+    assert messages[1]["role"] == "user"
+    assert messages[1:] == history[-(len(messages) - 1) :]
+    assert sum(map(message_tokens, messages)) <= 512
+    assert context.dropped == len(history) - len(messages)
+
+
+def test_context_window_always_sends_the_latest_message():
+    history = [
+        {"role": "user", "content": "old"},
+        {"role": "assistant", "content": "reply"},
+        {"role": "user", "content": "long " * 1000},
+    ]
+    assert ContextWindow().select(history, num_ctx=128) == history[-1:]
+
+
+def test_context_window_counts_images():
+    history = [
+        {"role": "user", "content": "look", "images": ["..."]},
+        {"role": "assistant", "content": "a cat"},
+        {"role": "user", "content": "and now?"},
+    ]
+    assert ContextWindow().select(history, num_ctx=512) == history[-1:]
+    assert ContextWindow().select(history, num_ctx=2048) == history
+
+
+@pytest.mark.asyncio
+async def test_dropped_turns_are_summarized(monkeypatch):
+    llm = OllamaLLM(
+        system="Be brief.",
+        options={"num_ctx": 64},
+        context=ContextWindow(budget=1, summarize=True),
+    )
+    requests = []
+
+    async def chat(**kwargs):
+        requests.append(kwargs["messages"])
+        return {"message": {"role": "assistant", "content": "They said hi."}}
+
+    monkeypatch.setattr(llm.client, "chat", chat)
+    for i in range(3):
+        await llm.completion(f"hi {i} " * 20)
+    await llm._summary_task
+
+    assert llm.context.summary == "They said hi."
+    assert llm.context.summarized > 0
+    summary_request = next(r for r in requests if len(r) == 1)
+    assert "hi 0" in summary_request[0]["content"]
+
+    await llm.completion("bye")
+    assert requests[-1][0]["content"] == "Be brief."
+    assert "They said hi." in requests[-1][1]["content"]
+    assert requests[-1][-1]["content"] == "bye"
+
+
+@pytest.mark.asyncio
+async def test_llms_share_a_client_per_host():
+    first, second = OllamaLLM(), OllamaLLM(model="llama3.1:latest")
+    assert first.client is second.client
+    assert get_client("http://other:11434") is not first.client
+
+    client = first.client
+    await close_clients()
+    assert client._client.is_closed
+    assert OllamaLLM().client is not client
+
+
+def test_response_metrics_round_trip():
+    metrics = ResponseMetrics.from_response(
+        {"eval_count": 20, "eval_duration": 2_000_000_000, "done": True},
+        ttft=0.25,
+        wall_time=2.5,
+    )
+    assert str(metrics) == "10.0 tok/s · TTFT 0.25s"
+    assert ResponseMetrics.from_dict(json.loads(metrics.to_json())) == metrics
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(envConfig, "OTERM_RETRIES", 2)
+    monkeypatch.setattr(envConfig, "OTERM_RETRY_BACKOFF", 0.01)
+
+
+@pytest.mark.asyncio
+async def test_failures_before_the_first_token_are_retried(mock_ollama, fast_retries):
+    mock_ollama.config.fail_next = 2
+    mock_ollama.config.error_status = 503
+    llm = OllamaLLM(model="llama3.1:latest")
+    chunks = [chunk async for chunk in llm.stream_deltas("Hi")]
+    assert chunks[-1].done
+    assert mock_ollama.requests["/api/chat"] == 3
+
+    mock_ollama.config.fail_next = 3
+    with pytest.raises(OllamaResponseError) as error:
+        await llm.completion("Again")
+    assert error.value.status_code == 503
+    assert error.value.host == envConfig.OLLAMA_URL
+
+    # A missing model is not retried.
+    llm = OllamaLLM(model="unknown:latest")
+    with pytest.raises(OllamaResponseError) as error:
+        await llm.completion("Hi")
+    assert error.value.status_code == 404
+    assert mock_ollama.requests["/api/chat"] == 7
+
+
+@pytest.mark.asyncio
+async def test_unreachable_backends_raise_a_connection_error(
+    fast_retries, monkeypatch
+):
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]
+    monkeypatch.setattr(envConfig, "OLLAMA_URL", f"http://127.0.0.1:{port}")
+    llm = OllamaLLM(model="llama3.1:latest")
+    with pytest.raises(OllamaConnectionError) as error:
+        [_ async for _ in llm.stream_deltas("Hi")]
+    assert error.value.host == envConfig.OLLAMA_URL
+
+
+@pytest.mark.asyncio
+async def test_first_and_next_tokens_time_out(mock_ollama, monkeypatch):
+    monkeypatch.setattr(envConfig, "OTERM_FIRST_TOKEN_TIMEOUT", 0.2)
+    monkeypatch.setattr(envConfig, "OTERM_TOKEN_TIMEOUT", 0.2)
+    mock_ollama.config.latency = 0.5
+    llm = OllamaLLM(model="llama3.1:latest")
+    with pytest.raises(OllamaTimeoutError, match="first token"):
+        [_ async for _ in llm.stream_deltas("Hi")]
+
+    monkeypatch.setattr(envConfig, "OTERM_FIRST_TOKEN_TIMEOUT", 1.0)
+    mock_ollama.config.latency = 0
+    mock_ollama.config.rate = 2
+    with pytest.raises(OllamaTimeoutError, match="next token"):
+        [_ async for _ in llm.stream_deltas("Hi")]
+    # Failed turns are left out of the history, and the timeouts do not
+    # cancel anything the task awaits afterwards.
+    assert llm.history == []
+    await asyncio.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_replies_cut_short_are_not_retried(mock_ollama, fast_retries):
+    mock_ollama.config.disconnect_after = 3
+    llm = OllamaLLM(model="llama3.1:latest")
+    received = []
+    with pytest.raises(OllamaStreamError):
+        async for chunk in llm.stream_deltas("Hi"):
+            received.append(chunk.delta)
+    assert len(received) == 3
+    assert mock_ollama.requests["/api/chat"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelling_a_reply_closes_its_stream(mock_ollama):
+    mock_ollama.config.tokens = 200
+    mock_ollama.config.rate = 50
+    llm = OllamaLLM(model="llama3.1:latest")
+    received = asyncio.Event()
+
+    async def reply() -> None:
+        async for _ in llm.stream_deltas("Hi"):
+            received.set()
+
+    task = asyncio.create_task(reply())
+    await received.wait()
+    assert mock_ollama.in_flight == 1
+    task.cancel()
+    for _ in range(50):
+        if mock_ollama.in_flight == 0:
+            break
+        await asyncio.sleep(0.02)
+    # The server noticed, and stopped generating, well before the end.
+    assert mock_ollama.in_flight == 0
+    assert llm.history == []
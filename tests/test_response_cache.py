@@ -0,0 +1,98 @@
+import time
+from typing import AsyncIterator
+
+import pytest
+import pytest_asyncio
+
+from oterm import ollamaclient
+from oterm.config import envConfig
+from oterm.ollamaclient import OllamaLLM, ResponseCache, close_clients
+
+MODEL = "llama3.1:latest"
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def clients():
+    yield
+    await close_clients()
+
+
+@pytest_asyncio.fixture
+async def cache(tmp_path, monkeypatch) -> AsyncIterator[ResponseCache]:
+    cache = ResponseCache(path=tmp_path / "responses.db")
+    monkeypatch.setattr(ollamaclient, "responseCache", cache)
+    monkeypatch.setattr(envConfig, "OTERM_RESPONSE_CACHE", True)
+    yield cache
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_deterministic_replies_are_streamed_from_the_cache(mock_ollama, cache):
+    mock_ollama.config.reply = "Hello there, how are you?"
+
+    def llm() -> OllamaLLM:
+        return OllamaLLM(model=MODEL, system="Be brief.", options={"temperature": 0})
+
+    chunks = [chunk async for chunk in llm().stream_deltas("Hi")]
+    assert not chunks[-1].metrics.cached
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # Replayed through the same interfaces, with the original statistics.
+    again = llm()
+    replayed = [chunk async for chunk in again.stream_deltas("Hi")]
+    assert [c.delta for c in replayed] == [c.delta for c in chunks]
+    assert replayed[-1].stats["eval_count"] == chunks[-1].stats["eval_count"]
+    assert again.metrics.cached and "cached" in str(again.metrics)
+    assert [text async for text in llm().stream("Hi")][-1] == chunks[-1].text
+    assert await llm().completion("Hi") == chunks[-1].text
+    assert (cache.hits, cache.misses) == (3, 1)
+    assert len(mock_ollama.chats) == 1
+
+    # Another history, system prompt or options is another request.
+    assert await again.completion("Hi") == chunks[-1].text
+    await OllamaLLM(model=MODEL, options={"temperature": 0}).completion("Hi")
+    await OllamaLLM(model=MODEL, options={"seed": 1}).completion("Hi")
+    assert len(mock_ollama.chats) == 4
+    assert cache.misses == 4
+
+
+@pytest.mark.asyncio
+async def test_sampled_replies_are_not_cached(mock_ollama, cache, monkeypatch):
+    for _ in range(2):
+        await OllamaLLM(model=MODEL, options={"temperature": 0.7}).completion("Hi")
+    assert len(mock_ollama.chats) == 2
+    assert cache.hits == cache.misses == 0
+
+    # Nor is anything while the cache is off.
+    monkeypatch.setattr(envConfig, "OTERM_RESPONSE_CACHE", False)
+    for _ in range(2):
+        await OllamaLLM(model=MODEL, options={"temperature": 0}).completion("Hi")
+    assert len(mock_ollama.chats) == 4
+
+
+@pytest.mark.asyncio
+async def test_expired_and_least_recently_used_replies_are_evicted(cache):
+    cache._max_bytes = 250
+    cache._ttl = 60
+    stats = {"eval_count": 1}
+    for key in "abc":
+        await cache.put(key, MODEL, key * 50, stats)
+    # Reading "a" makes "b" the least recently used.
+    assert await cache.get("a") == ("a" * 50, stats)
+    await cache.put("d", MODEL, "d" * 50, stats)
+    assert await cache.get("b") is None
+    assert await cache.get("c") is not None
+
+    # Lookups share one connection, reopened after it is closed.
+    db = await cache.connect()
+    assert await cache.connect() is db
+    await close_clients()
+    assert await cache.connect() is not db
+    assert await cache.get("c") is not None
+
+    db = await cache.connect()
+    await db.execute("UPDATE response SET created = ?;", (time.time() - 61,))
+    await db.commit()
+    assert await cache.get("a") is None
+    await cache.put("e", MODEL, "e" * 50, stats)
+    assert await cache.get("c") is None and await cache.get("e") is not None
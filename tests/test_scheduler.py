@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+
+from oterm.scheduler import InferenceScheduler
+
+BACKEND = "http://localhost:11434"
+
+
+async def hold(
+    scheduler: InferenceScheduler,
+    model: str,
+    owner: int,
+    release: asyncio.Event,
+    log: list,
+    positions: list | None = None,
+) -> None:
+    on_position = positions.append if positions is not None else None
+    async with scheduler.slot([BACKEND], model, owner, on_position):
+        log.append(owner)
+        await release.wait()
+
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_limits_per_model_and_backend():
+    scheduler = InferenceScheduler(per_model=1, per_backend=2)
+    release = asyncio.Event()
+    log: list[int] = []
+    tasks = [
+        asyncio.create_task(hold(scheduler, model, owner, release, log))
+        for owner, model in enumerate(["llama3.1", "llama3.1", "mistral", "phi3"])
+    ]
+    await settle()
+    # One per model, two on the backend: phi3 waits behind the second llama.
+    assert log == [0, 2]
+    assert len(scheduler.waiting) == 2
+
+    release.set()
+    await asyncio.wait(tasks)
+    assert sorted(log) == [0, 1, 2, 3]
+    assert scheduler.running == scheduler.waiting == []
+
+
+@pytest.mark.asyncio
+async def test_foreground_first_and_owners_in_order():
+    scheduler = InferenceScheduler(per_model=1, per_backend=1)
+    releases = [asyncio.Event() for _ in range(4)]
+    log: list[int] = []
+    positions: dict[int, list[int]] = {i: [] for i in range(4)}
+
+    def start(i: int, owner: int) -> asyncio.Task:
+        return asyncio.create_task(
+            hold(scheduler, "llama3.1", owner, releases[i], log, positions[i])
+        )
+
+    tasks = [start(0, owner=1)]
+    await settle()
+    tasks += [start(1, owner=2), start(2, owner=3), start(3, owner=3)]
+    await settle()
+    assert [positions[i] for i in range(1, 4)] == [[1], [2], [3]]
+
+    # The foreground chat's requests move ahead, in the order it made them.
+    scheduler.foreground = 3
+    assert [positions[i][-1] for i in range(1, 4)] == [3, 1, 2]
+
+    for release in releases:
+        release.set()
+        await settle()
+    await asyncio.wait(tasks)
+    assert log == [1, 3, 3, 2]
+    assert positions[2][-1] == positions[3][-1] == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelling_a_queued_request():
+    scheduler = InferenceScheduler(per_model=1, per_backend=1)
+    release = asyncio.Event()
+    log: list[int] = []
+    positions: list[int] = []
+    running = asyncio.create_task(hold(scheduler, "llama3.1", 1, release, log))
+    queued = asyncio.create_task(
+        hold(scheduler, "llama3.1", 2, release, log, positions)
+    )
+    last = asyncio.create_task(hold(scheduler, "llama3.1", 3, release, log))
+    await settle()
+
+    queued.cancel()
+    await settle()
+    assert queued.cancelled()
+    assert positions == [1]
+    assert [ticket.owner for ticket in scheduler.waiting] == [3]
+
+    # Cancelled right after being granted the slot, which is passed on.
+    after = asyncio.create_task(hold(scheduler, "llama3.1", 4, release, log))
+    running.cancel()
+    await asyncio.sleep(0)
+    assert [ticket.owner for ticket in scheduler.running] == [3]
+    last.cancel()
+    await settle()
+    assert log == [1, 4]
+    release.set()
+    await after
+    assert scheduler.running == scheduler.waiting == []
+
+
+@pytest.mark.asyncio
+async def test_requests_run_on_the_first_backend_with_room():
+    scheduler = InferenceScheduler(per_model=1, per_backend=4)
+    release = asyncio.Event()
+    hosts: list[str] = []
+
+    async def run(backends: list[str]) -> None:
+        async with scheduler.slot(backends, "llama3.1") as host:
+            hosts.append(host)
+            await release.wait()
+
+    tasks = [asyncio.create_task(run(["a", "b"])) for _ in range(3)]
+    await settle()
+    assert hosts == ["a", "b"]
+    assert scheduler.waiting[0].position == 1
+
+    release.set()
+    await asyncio.wait(tasks)
+    assert hosts[2] in ("a", "b")
@@ -1,3 +1,21 @@
+import asyncio
+import sqlite3
+
+import aiosqlite
+import pytest
+import pytest_asyncio
+
+from oterm.config import envConfig
+from oterm.enums import Author
+from oterm.store.images import ImageStore
+from oterm.store.store import (
+    MATCH_END,
+    MATCH_START,
+    Store,
+    StreamingMessage,
+    match_expression,
+)
+from oterm.store.upgrades import v0_5_0
 from oterm.utils import int_to_semantic_version, semantic_version_to_int
 
 
@@ -13,3 +31,327 @@ def test_sqlite_user_version():
     version = "255.255.255"
     assert semantic_version_to_int(version) == 16777215
     assert int_to_semantic_version(16777215) == version
+
+
+@pytest_asyncio.fixture
+async def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(envConfig, "OTERM_DATA_DIR", tmp_path)
+    store = await Store.create()
+    yield store
+    await store.close()
+
+
+async def new_chat(store: Store) -> int:
+    return await store.save_chat(
+        id=None,
+        name="chat",
+        model="llama3.1",
+        system=None,
+        format="",
+        parameters="{}",
+        keep_alive=5,
+    )
+
+
+@pytest.mark.asyncio
+async def test_store_reuses_connection_in_wal_mode(store):
+    connection = store.connection
+    chat_id = await new_chat(store)
+    await store.save_message(chat_id, "me", "Hello")
+    await store.save_message(chat_id, "ollama", "Hi!")
+    assert store.connection is connection
+
+    res = await connection.execute_fetchall("PRAGMA journal_mode;")
+    assert res[0][0] == "wal"
+    assert [text for _, text in await store.get_messages(chat_id)] == ["Hello", "Hi!"]
+
+
+@pytest.mark.asyncio
+async def test_store_close_persists_writes(store):
+    chat_id = await new_chat(store)
+    await store.rename_chat(chat_id, "renamed")
+    await store.close()
+    await store.close()
+    assert store.connection is None
+
+    reopened = await Store.create()
+    chat = await reopened.get_chat(chat_id)
+    await reopened.close()
+    assert chat is not None and chat[1] == "renamed"
+
+
+@pytest.mark.asyncio
+async def test_get_messages_page(store):
+    chat_id = await new_chat(store)
+    for i in range(5):
+        await store.save_message(chat_id, "me", f"message {i}")
+
+    page = await store.get_messages_page(chat_id, limit=2)
+    assert [text for _, _, text, _ in page] == ["message 3", "message 4"]
+
+    page = await store.get_messages_page(chat_id, before_id=page[0][0], limit=2)
+    assert [text for _, _, text, _ in page] == ["message 1", "message 2"]
+
+    page = await store.get_messages_page(chat_id, before_id=page[0][0], limit=2)
+    assert [text for _, _, text, _ in page] == ["message 0"]
+    assert await store.get_messages_page(chat_id, before_id=page[0][0]) == []
+
+
+@pytest.mark.asyncio
+async def test_message_metrics(store):
+    chat_id = await new_chat(store)
+    await store.save_message(chat_id, "me", "hi")
+    await store.save_message(
+        chat_id, "ollama", "hello", metrics='{"eval_count": 3, "ttft": 0.5}'
+    )
+
+    page = await store.get_messages_page(chat_id)
+    assert [metrics for *_, metrics in page] == [None, {"eval_count": 3, "ttft": 0.5}]
+
+
+async def message_rows(store: Store) -> list[tuple[str, str]]:
+    return list(
+        await store.connection.execute_fetchall(  # type: ignore
+            "SELECT text, status FROM message ORDER BY id"
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_streaming_message_checkpoints_are_coalesced(store):
+    chat_id = await new_chat(store)
+    updates = []
+    update_message = store.update_message
+
+    async def counting_update_message(id, text, **kwargs):
+        updates.append(text)
+        await update_message(id, text, **kwargs)
+
+    store.update_message = counting_update_message
+    reply = StreamingMessage(store, chat_id, "ollama", interval=3600, size=10)
+    await reply.start()
+    assert await message_rows(store) == [("", "streaming")]
+
+    for _ in range(100):
+        reply.append("ab")
+        await asyncio.sleep(0)
+    await reply._checkpoint
+    # One UPDATE per 10 characters at most, never one per token.
+    assert 0 < len(updates) <= 20
+    assert (await message_rows(store))[0][1] == "streaming"
+
+    await reply.finish(metrics='{"eval_count": 100}')
+    assert await message_rows(store) == [("ab" * 100, "complete")]
+
+
+@pytest.mark.asyncio
+async def test_interrupted_streaming_messages_are_aborted(tmp_path, monkeypatch):
+    monkeypatch.setattr(envConfig, "OTERM_DATA_DIR", tmp_path)
+    store = await Store.create()
+    chat_id = await new_chat(store)
+    reply = StreamingMessage(store, chat_id, "ollama", interval=0)
+    await reply.start()
+    reply.append("partial")
+    await reply._checkpoint
+    # oterm is killed before the reply completes.
+    await store.close()
+
+    store = await Store.create()
+    assert await message_rows(store) == [("partial", "aborted")]
+    await store.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_share_a_commit(store, monkeypatch):
+    chat_id = await new_chat(store)
+    commits = []
+    commit = store.connection.commit  # type: ignore
+
+    async def counting_commit():
+        commits.append(1)
+        await commit()
+
+    monkeypatch.setattr(store.connection, "commit", counting_commit)
+    ids = await asyncio.gather(
+        *(store.save_message(chat_id, "me", f"message {i}") for i in range(50))
+    )
+    assert len(set(ids)) == 50
+    assert len(commits) < 5
+
+    # Committed once flushed, as seen from another connection.
+    await store.flush()
+    async with aiosqlite.connect(store.db_path) as connection:
+        res = await connection.execute_fetchall("SELECT COUNT(*) FROM message")
+    assert list(res) == [(50,)]
+
+
+@pytest.mark.asyncio
+async def test_failed_write_raises_to_its_caller(store):
+    chat_id = await new_chat(store)
+    results = await asyncio.gather(
+        store.save_message(chat_id, "me", "before"),
+        store.save_message(chat_id, "me", None),  # type: ignore
+        store.save_message(chat_id, "me", "after"),
+        return_exceptions=True,
+    )
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    await store.flush()
+    assert [text for text, _ in await message_rows(store)] == ["before", "after"]
+
+
+@pytest.mark.asyncio
+async def test_failed_commit_raises_and_the_writer_goes_on(store, monkeypatch):
+    chat_id = await new_chat(store)
+    commit = store.connection.commit  # type: ignore
+    failures = [sqlite3.OperationalError("disk I/O error")]
+
+    async def failing_commit():
+        if failures:
+            raise failures.pop()
+        await commit()
+
+    monkeypatch.setattr(store.connection, "commit", failing_commit)
+    results = await asyncio.gather(
+        store.save_message(chat_id, "me", "lost"),
+        store.flush(),
+        return_exceptions=True,
+    )
+    assert [type(result) for result in results] == [sqlite3.OperationalError] * 2
+
+    await store.save_message(chat_id, "me", "kept")
+    await store.flush()
+    assert [text for text, _ in await message_rows(store)] == ["kept"]
+
+
+def test_image_store_dedupes_by_content(tmp_path):
+    images = ImageStore(tmp_path)
+    digest = images.put(b"image data")
+    assert images.put(b"image data") == digest
+    assert [path.name for path in tmp_path.rglob("*") if path.is_file()] == [digest]
+    assert images.get(digest) == b"image data"
+    assert images.contains(digest)
+    assert not images.contains("0" * 64)
+    assert not images.contains("not a digest")
+
+
+@pytest.mark.asyncio
+async def test_message_images(store):
+    chat_id = await new_chat(store)
+    first = await store.save_message(chat_id, "me", "Look at these")
+    await store.save_message_images(first, ["b" * 64, "a" * 64])
+    await store.save_message(chat_id, "ollama", "Nice pictures.")
+    second = await store.save_message(chat_id, "me", "And this one")
+    await store.save_message_images(second, ["a" * 64])
+
+    assert await store.get_history(chat_id) == [
+        (Author.USER, "Look at these", ["b" * 64, "a" * 64]),
+        (Author.OLLAMA, "Nice pictures.", []),
+        (Author.USER, "And this one", ["a" * 64]),
+    ]
+
+    await store.delete_message(second)
+    res = await store.connection.execute_fetchall(  # type: ignore
+        "SELECT message_id FROM message_image"
+    )
+    assert list(res) == [(first,), (first,)]
+
+
+@pytest.mark.asyncio
+async def test_search_finds_messages_across_chats(store):
+    first, second = await new_chat(store), await new_chat(store)
+    await store.save_message(first, "me", "How do I reverse a list in Python?")
+    await store.save_message(first, "ollama", "Use reversed(), or slice with [::-1].")
+    reply = await store.save_message(second, "ollama", "Lists can be sorted.")
+    await store.save_message(second, "me", "Tell me about Rust lists and lists.")
+
+    results = await store.search("lists")
+    assert [(chat_id, author.value) for _, chat_id, author, _ in results] == [
+        (second, "me"),
+        (second, "ollama"),
+    ]
+    assert f"{MATCH_START}lists{MATCH_END}" in results[0][3]
+    assert len(await store.search("list*")) == 3
+    assert await store.search("python rust") == []
+
+    # The index follows updates and deletions.
+    await store.update_message(reply, "Tuples cannot be sorted.")
+    assert [id for id, *_ in await store.search("tuples")] == [reply]
+    assert len(await store.search("lists")) == 1
+    await store.delete_message(reply)
+    assert await store.search("tuples") == []
+
+    # Messages of deleted chats are not found.
+    await store.delete_chat(first)
+    assert await store.search("python") == []
+
+
+def test_match_expression():
+    assert match_expression('say "hi" AND bye*') == '"say" """hi""" "AND" "bye"*'
+    assert match_expression(" * ") == ""
+
+
+@pytest.mark.asyncio
+async def test_cancelled_search_is_interrupted(store, monkeypatch):
+    await store.search("warm up")
+    interrupted = []
+    interrupt = store.search_connection.interrupt  # type: ignore
+
+    async def recording_interrupt():
+        interrupted.append(True)
+        await interrupt()
+
+    monkeypatch.setattr(store.search_connection, "interrupt", recording_interrupt)
+    search = asyncio.create_task(store.search("anything"))
+    await asyncio.sleep(0)
+    search.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await search
+    assert interrupted == [True]
+    # The connection is still usable.
+    assert await store.search("anything") == []
+
+
+@pytest.mark.asyncio
+async def test_upgrade_adds_message_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(envConfig, "OTERM_DATA_DIR", tmp_path)
+    monkeypatch.setattr(v0_5_0, "SEARCH_BACKFILL_CHUNK_SIZE", 2)
+    async with aiosqlite.connect(tmp_path / "store.db") as connection:
+        await connection.executescript(
+            """
+            CREATE TABLE chat (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, model TEXT NOT NULL,
+                system TEXT, format TEXT, parameters TEXT, keep_alive INTEGER DEFAULT 5
+            );
+            CREATE TABLE message (chat_id INTEGER NOT NULL, author TEXT NOT NULL, text TEXT NOT NULL);
+            INSERT INTO chat(name, model, parameters) VALUES ('chat', 'llama3.1', '{}');
+            INSERT INTO message VALUES (1, 'me', 'first'), (1, 'ollama', 'second'),
+                (1, 'me', 'third');
+            PRAGMA user_version = 1024;
+            """
+        )
+
+    store = await Store.create()
+    page = await store.get_messages_page(1)
+    indexes = await store.connection.execute_fetchall("PRAGMA index_list(message);")
+    statuses = await message_rows(store)
+    history = await store.get_history(1)
+    found = [
+        [id for id, *_ in await store.search(text)]
+        for text in ("first", "second", "third")
+    ]
+    await store.close()
+
+    assert [(id, text, metrics) for id, _, text, metrics in page] == [
+        (1, "first", None),
+        (2, "second", None),
+        (3, "third", None),
+    ]
+    assert "message_chat_id_idx" in [index[1] for index in indexes]
+    assert statuses == [
+        ("first", "complete"),
+        ("second", "complete"),
+        ("third", "complete"),
+    ]
+    assert [images for *_, images in history] == [[], [], []]
+    # Backfilled in chunks of 2 messages.
+    assert found == [[1], [2], [3]]